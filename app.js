@@ -198,6 +198,11 @@ function advanceDeck() {
     stackEl.insertBefore(card, stackEl.firstChild);
   }
   updatePositions();
+
+  // Ask for the next page of the current search before the deck wraps around
+  if (window.onDeckLow && recommendations.length - nextDataIndex <= STACK_SIZE) {
+    window.onDeckLow();
+  }
 }
 
 window.findAndRender = function (location) {
@@ -251,3 +256,16 @@ window.updateStackWithRecommendations = function (apiRecommendations) {
   console.log(`✅ Updated stack with ${recommendations.length} Gemini-ranked recommendations`);
   return true;
 };
+
+// Append the next page of the same search behind the cards already queued
+window.appendRecommendations = function (apiRecommendations) {
+  if (!apiRecommendations || apiRecommendations.length === 0) return false;
+  const seen = new Set(recommendations.map((p) => p.id));
+  const fresh = apiRecommendations.filter((p) => !seen.has(p.id));
+  if (nextDataIndex === 0) {
+    nextDataIndex = recommendations.length;
+  }
+  recommendations = recommendations.concat(fresh);
+  console.log(`➕ Appended ${fresh.length} recommendations (${recommendations.length} total)`);
+  return true;
+};
@@ -4,15 +4,32 @@ Flask API 後端服務
 提供推薦接口
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 from flasgger import Swagger
+from werkzeug.middleware.proxy_fix import ProxyFix
 from recommendation_system import UserRecommendationSystem
+from catalog import Catalog
+from gemini_client import GeminiClient, warm_up_session
+from ranking_cache import RankingCache, make_cache_key
+from recommendation_sessions import RecommendationSessionStore, SessionExpired
+from facets import FACET_FIELDS, OPTION_LISTS
+from query_compiler import QueryError, compile_query
+from embedding_index import EmbeddingIndex, GeminiEmbedder, HashingEmbedder
+from gemini_resilience import Deadline
+from question_prefetch import QuestionPrefetcher
+import hashlib
 import json
 import os
+import threading
 
 app = Flask(__name__)
 
+# 部署在反向代理（如 Railway）後面時設置代理層數，按 X-Forwarded-For 取真實客戶端地址（用於按地址限流）
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+
 # 配置 CORS - 允許來自 Vercel 和本地開發的請求
 CORS(app, resources={
     r"/api/*": {
@@ -25,7 +42,7 @@ CORS(app, resources={
             "http://localhost:3000"   # 其他常用端口
         ],
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"],
+        "allow_headers": ["Content-Type", "X-Request-Deadline"],
         "supports_credentials": False
     }
 })
@@ -48,29 +65,100 @@ app.config['SWAGGER'] = {
 
 swagger = Swagger(app)
 
-# 初始化推薦系統
+def _build_embedding_index():
+    """按 RECOMMEND_EMBEDDINGS 創建描述搜索的語義索引（gemini / hashing，未設置時不啟用）"""
+    kind = os.environ.get('RECOMMEND_EMBEDDINGS', '').lower()
+    if not kind:
+        return None
+    if kind == 'gemini':
+        embedder = GeminiEmbedder(GeminiClient(), model=os.environ.get('RECOMMEND_EMBEDDING_MODEL', 'text-embedding-004'))
+    elif kind == 'hashing':
+        embedder = HashingEmbedder()
+    else:
+        raise ValueError(f"不支持的嵌入方式: {kind}")
+    return EmbeddingIndex(
+        embedder,
+        path=os.environ.get('RECOMMEND_EMBEDDING_PATH', '.user_embeddings.npz'),
+        nlist=int(os.environ.get('RECOMMEND_EMBEDDING_NLIST', 0))
+    )
+
+
+# 初始化用戶目錄與推薦系統；目錄在後台監視數據庫文件，變更時建好新快照再原子替換
+CATALOG_POLL_INTERVAL = float(os.environ.get('CATALOG_POLL_INTERVAL', 5))
+catalog = None
 try:
-    rec_system = UserRecommendationSystem()
+    catalog = Catalog(
+        os.environ.get('USER_DATABASE', 'users_database.json'),
+        backend=os.environ.get('RECOMMEND_BACKEND', 'index'),
+        embedding_index=_build_embedding_index(),
+        parse_confidence=float(os.environ.get('RECOMMEND_PARSE_CONFIDENCE', 0.8)),
+        version_path=os.environ.get('CATALOG_VERSION_PATH') or None
+    )
+    if CATALOG_POLL_INTERVAL > 0:
+        catalog.start(interval=CATALOG_POLL_INTERVAL)
+    rec_system = UserRecommendationSystem(
+        catalog=catalog,
+        candidate_limit=int(os.environ.get('RECOMMEND_CANDIDATE_LIMIT', 50)),
+        candidate_token_budget=int(os.environ['RECOMMEND_CANDIDATE_TOKENS'])
+        if os.environ.get('RECOMMEND_CANDIDATE_TOKENS') else None,
+        shard_size=int(os.environ['RECOMMEND_SHARD_SIZE'])
+        if os.environ.get('RECOMMEND_SHARD_SIZE') else None,
+        prompt_encoding=os.environ.get('RECOMMEND_PROMPT_ENCODING', 'compact'),
+        parse_descriptions=os.environ.get('RECOMMEND_PARSE_DESCRIPTIONS', '1').lower() in ('1', 'true', 'yes'),
+        cache=RankingCache(
+            max_entries=int(os.environ.get('RANKING_CACHE_MAX_ENTRIES', 1024)),
+            ttl_seconds=float(os.environ.get('RANKING_CACHE_TTL', 600))
+        ),
+        sessions=RecommendationSessionStore(
+            max_sessions=int(os.environ.get('RECOMMEND_SESSION_MAX', 2048)),
+            ttl_seconds=float(os.environ.get('RECOMMEND_SESSION_TTL', 900))
+        ),
+        session_size=int(os.environ.get('RECOMMEND_SESSION_SIZE', 100)),
+        coalesce=os.environ.get('RECOMMEND_COALESCE', '1').lower() in ('1', 'true', 'yes')
+    )
     print("✅ 推薦系統初始化成功")
 except Exception as e:
     print(f"❌ 推薦系統初始化失敗: {e}")
     rec_system = None
 
-# 獲取所有可用選項
+# 共用的 Gemini 客戶端（HTTP 連接池在進程內共享）
 try:
-    with open('users_database.json', 'r', encoding='utf-8') as f:
-        users = json.load(f)
-    
-    # 提取唯一的地區、職業、興趣
-    locations = sorted(list(set([user['location'] for user in users])))
-    occupations = sorted(list(set([user['occupation'] for user in users])))
-    all_hobbies = []
-    for user in users:
-        all_hobbies.extend(user['hobby'])
-    hobbies = sorted(list(set(all_hobbies)))
+    gemini = rec_system.client if rec_system else GeminiClient()
 except Exception as e:
-    print(f"⚠️  警告: 無法加載用戶數據庫: {e}")
-    locations, occupations, hobbies = [], [], []
+    print(f"⚠️  警告: Gemini 客戶端初始化失敗: {e}")
+    gemini = None
+
+# 後台預熱連接池，不阻塞啟動
+threading.Thread(
+    target=warm_up_session,
+    kwargs={'connections': int(os.environ.get('GEMINI_WARM_CONNECTIONS', 2))},
+    daemon=True
+).start()
+
+# 各接口的端到端時間預算（秒），需小於 gunicorn worker 的超時（默認 30 秒）；
+# 客戶端可用 X-Request-Deadline 請求頭（剩餘秒數）進一步縮短
+ENDPOINT_DEADLINES = {
+    'recommend': float(os.environ.get('RECOMMEND_DEADLINE', 20)),
+    'generate_question': float(os.environ.get('GENERATE_QUESTION_DEADLINE', 8)),
+    # 批量接口給內部任務使用；整批超過這個時間時剩下的條件使用本地排序
+    'recommend_batch': float(os.environ.get('RECOMMEND_BATCH_DEADLINE', 25)),
+}
+
+# 批量推薦：單次請求的最大條件數 / 同時進行的 AI 排序調用數
+RECOMMEND_BATCH_MAX = int(os.environ.get('RECOMMEND_BATCH_MAX', 5000))
+RECOMMEND_BATCH_WORKERS = int(os.environ.get('RECOMMEND_BATCH_WORKERS', 8))
+
+
+def _request_deadline(endpoint):
+    """計算本次請求的截止時間（接口預算與客戶端請求頭取較小值）"""
+    budget = ENDPOINT_DEADLINES[endpoint]
+    header = request.headers.get('X-Request-Deadline')
+    if header:
+        try:
+            budget = min(budget, max(0.0, float(header)))
+        except ValueError:
+            pass
+    return Deadline(budget)
 
 
 @app.route('/')
@@ -98,6 +186,160 @@ def serve_avatars(filename):
 
 
 
+FALLBACK_QUESTIONS = [
+    {
+        "question": "What's your ideal weekend?",
+        "options": ["Adventure outdoors", "Cozy at home", "Social activities"]
+    },
+    {
+        "question": "What matters most to you?",
+        "options": ["Humor & fun", "Deep conversations", "Shared hobbies"]
+    }
+]
+
+
+# 問題生成的輸出結構（Gemini JSON 模式），不再需要手動去掉 markdown 再解析
+QUESTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "question": {"type": "STRING"},
+        "options": {"type": "ARRAY", "items": {"type": "STRING"}}
+    },
+    "required": ["question", "options"]
+}
+QUESTION_MAX_TOKENS = 200
+
+
+def _build_question_prompt(previous_answers, question_number):
+    """構建生成問題的 Gemini prompt"""
+    return f"""You are a dating app matchmaker AI. Based on the user's previous answers:
+{previous_answers}
+
+Generate a creative, engaging question (question #{question_number}) to learn more about their dating preferences or personality.
+
+IMPORTANT:
+- Provide EXACTLY 3 distinct, concise options
+- Keep options short (2-4 words max)
+- Make the question conversational and fun
+- Vary the question type (personality, activities, values, lifestyle)
+- Each option should be different enough to be meaningful
+
+Return ONLY valid JSON in this exact format (no markdown, no extra text):
+{{
+  "question": "Your question here?",
+  "options": ["Option 1", "Option 2", "Option 3"]
+}}"""
+
+
+def _parse_question(text):
+    """解析 Gemini 返回的問題 JSON（格式不正確時拋出 ValueError）"""
+    # JSON 模式下不會有 markdown，保留清理以兼容未使用 JSON 模式的響應
+    text = text.strip()
+    if text.startswith('```json'):
+        text = text[7:]
+    if text.startswith('```'):
+        text = text[3:]
+    if text.endswith('```'):
+        text = text[:-3]
+    text = text.strip()
+
+    result = json.loads(text)
+
+    # 驗證格式
+    if not isinstance(result, dict) or 'question' not in result or not isinstance(result.get('options'), list):
+        raise ValueError('Invalid response format')
+
+    # 確保只有 3 個選項
+    result['options'] = result['options'][:3]
+    return result
+
+
+def _fallback_question(question_number):
+    """返回備用問題"""
+    return FALLBACK_QUESTIONS[question_number % 2]
+
+
+def _generate_question(previous_answers, question_number, deadline):
+    """
+    調用 Gemini 生成一個問題
+
+    Args:
+        previous_answers: 之前的回答
+        question_number: 問題編號
+        deadline: 截止時間
+
+    Returns:
+        {"question", "options"}；Gemini 沒有返回候選結果時為 None
+
+    Raises:
+        ValueError: 客戶端未初始化、請求失敗（含截止時間已到）或格式不正確
+    """
+    # 調用 Gemini（復用共享客戶端與連接池）
+    if gemini is None:
+        raise ValueError('Gemini 客戶端未初始化')
+    response = gemini.generate_text(
+        _build_question_prompt(previous_answers, question_number),
+        temperature=0.9,
+        max_tokens=QUESTION_MAX_TOKENS,
+        deadline=deadline,
+        response_mime_type='application/json',
+        response_schema=QUESTION_SCHEMA
+    )
+
+    # 解析回應
+    if response and 'candidates' in response:
+        text = response['candidates'][0]['content']['parts'][0]['text']
+        return _parse_question(text)
+    elif response and 'error' in response:
+        # 請求失敗或截止時間已到，由調用方改用備用問題
+        raise ValueError(response['error'])
+    return None
+
+
+# 後台預取下一題：每個預取任務有自己的時間預算，不受觸發它的請求影響
+question_prefetcher = QuestionPrefetcher(
+    generate=lambda answers, number: _generate_question(
+        answers, number, Deadline(ENDPOINT_DEADLINES['generate_question'])
+    ),
+    max_workers=int(os.environ.get('QUESTION_PREFETCH_WORKERS', 4)),
+    max_entries=int(os.environ.get('QUESTION_PREFETCH_MAX_ENTRIES', 512)),
+    ttl_seconds=float(os.environ.get('QUESTION_PREFETCH_TTL', 120)),
+    max_per_session=int(os.environ.get('QUESTION_PREFETCH_PER_SESSION', 9)),
+    max_per_client=int(os.environ.get('QUESTION_PREFETCH_PER_CLIENT', 30)),
+    client_window=float(os.environ.get('QUESTION_PREFETCH_CLIENT_WINDOW', 60))
+)
+
+
+def _prefetch_next_questions(data, previous_answers, question_number, question):
+    """
+    返回問題後為它的每個選項預取下一題
+
+    請求帶 session_id 時才預取（並記錄該會話已返回過問題）；帶 total_questions 且當前已是最後一題時不預取
+    """
+    question_prefetcher.mark_served(data.get('session_id'))
+    total_questions = data.get('total_questions')
+    if total_questions is not None and question_number >= total_questions:
+        return
+    question_prefetcher.prefetch(
+        data.get('session_id'), previous_answers, question_number, question.get('options', [])[:3],
+        client=request.remote_addr
+    )
+
+
+def _sse(event, data):
+    """格式化一條 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _sse_response(events):
+    """把事件生成器包裝成 text/event-stream 響應（禁止代理緩衝，事件到達即推送）"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/api/generate-question', methods=['POST'])
 def generate_question():
     """
@@ -107,6 +349,11 @@ def generate_question():
       - Agent
     description: 使用 Gemini AI 根據之前的回答生成下一個問題
     parameters:
+      - name: X-Request-Deadline
+        in: header
+        type: number
+        required: false
+        description: 客戶端可接受的最長等待時間（秒），不超過服務端為接口配置的時間預算
       - name: body
         in: body
         required: true
@@ -121,6 +368,12 @@ def generate_question():
             question_number:
               type: integer
               description: 當前問題編號
+            session_id:
+              type: string
+              description: 前端會話 ID（可選），帶上時服務端會在後台為每個選項預取下一題
+            total_questions:
+              type: integer
+              description: 問題總數（可選），當前已是最後一題時不再預取
     responses:
       200:
         description: 成功生成問題
@@ -141,74 +394,175 @@ def generate_question():
         
         previous_answers = data.get('previous_answers', [])
         question_number = data.get('question_number', 2)
-        
-        # 構建 Gemini prompt
-        prompt = f"""You are a dating app matchmaker AI. Based on the user's previous answers:
-{previous_answers}
-
-Generate a creative, engaging question (question #{question_number}) to learn more about their dating preferences or personality.
+        session_id = data.get('session_id')
+        deadline = _request_deadline('generate_question')
 
-IMPORTANT:
-- Provide EXACTLY 3 distinct, concise options
-- Keep options short (2-4 words max)
-- Make the question conversational and fun
-- Vary the question type (personality, activities, values, lifestyle)
-- Each option should be different enough to be meaningful
-
-Return ONLY valid JSON in this exact format (no markdown, no extra text):
-{{
-  "question": "Your question here?",
-  "options": ["Option 1", "Option 2", "Option 3"]
-}}"""
-
-        # 調用 Gemini
-        from gemini_client import GeminiClient
-        gemini = GeminiClient()
-        response = gemini.generate_text(prompt, temperature=0.9)
-        
-        # 解析回應
-        if response and 'candidates' in response:
-            text = response['candidates'][0]['content']['parts'][0]['text']
-            
-            # 清理可能的 markdown 格式
-            text = text.strip()
-            if text.startswith('```json'):
-                text = text[7:]
-            if text.startswith('```'):
-                text = text[3:]
-            if text.endswith('```'):
-                text = text[:-3]
-            text = text.strip()
-            
-            # 解析 JSON
-            import json
-            result = json.loads(text)
-            
-            # 驗證格式
-            if 'question' not in result or 'options' not in result:
-                raise ValueError('Invalid response format')
-            
-            # 確保只有 3 個選項
-            result['options'] = result['options'][:3]
-            
-            return jsonify(result), 200
-        else:
+        # 先取後台預取的結果（仍在生成時最多等到截止時間），未命中再實時生成
+        result = question_prefetcher.take(
+            session_id, previous_answers, question_number, timeout=deadline.remaining()
+        )
+        if result is None:
+            result = _generate_question(previous_answers, question_number, deadline)
+        if result is None:
             return jsonify({'error': '無法生成問題'}), 500
+
+        _prefetch_next_questions(data, previous_answers, question_number, result)
+        return jsonify(result), 200
             
     except Exception as e:
         print(f"❌ Error generating question: {e}")
         # 返回備用問題
-        fallback_questions = [
-            {
-                "question": "What's your ideal weekend?",
-                "options": ["Adventure outdoors", "Cozy at home", "Social activities"]
-            },
-            {
-                "question": "What matters most to you?",
-                "options": ["Humor & fun", "Deep conversations", "Shared hobbies"]
-            }
-        ]
-        return jsonify(fallback_questions[question_number % 2]), 200
+        return jsonify(_fallback_question(question_number)), 200
+
+
+@app.route('/api/generate-question/stream', methods=['POST'])
+def generate_question_stream():
+    """
+    流式生成問題（Server-Sent Events）
+    ---
+    tags:
+      - Agent
+    description: |
+      與 /api/generate-question 相同的輸入，以 text/event-stream 返回：
+      生成過程中推送若干 delta 事件（data 為 {"text": 片段}），
+      最後推送一個 question 事件（data 為 {"question", "options"}）；生成失敗時 question 為備用問題
+    parameters:
+      - name: X-Request-Deadline
+        in: header
+        type: number
+        required: false
+        description: 客戶端可接受的最長等待時間（秒），不超過服務端為接口配置的時間預算
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            previous_answers:
+              type: array
+              items:
+                type: string
+              description: 用戶之前的回答
+            question_number:
+              type: integer
+              description: 當前問題編號
+            session_id:
+              type: string
+              description: 前端會話 ID（可選），帶上時服務端會在後台為每個選項預取下一題
+            total_questions:
+              type: integer
+              description: 問題總數（可選），當前已是最後一題時不再預取
+    produces:
+      - text/event-stream
+    responses:
+      200:
+        description: 事件流
+      400:
+        description: 請求參數錯誤
+    """
+    data = request.json
+    if not data:
+        return jsonify({'error': '無效的請求'}), 400
+
+    previous_answers = data.get('previous_answers', [])
+    question_number = data.get('question_number', 2)
+    deadline = _request_deadline('generate_question')
+    prompt = _build_question_prompt(previous_answers, question_number)
+
+    def events():
+        text = ""
+        result = question_prefetcher.take(
+            data.get('session_id'), previous_answers, question_number, timeout=deadline.remaining()
+        )
+        if result is not None:
+            # 命中預取，直接推送完整問題
+            _prefetch_next_questions(data, previous_answers, question_number, result)
+            yield _sse('question', result)
+            return
+        try:
+            if gemini is None:
+                raise ValueError('Gemini 客戶端未初始化')
+            for chunk in gemini.stream_text(
+                prompt,
+                temperature=0.9,
+                max_tokens=QUESTION_MAX_TOKENS,
+                deadline=deadline,
+                response_mime_type='application/json',
+                response_schema=QUESTION_SCHEMA
+            ):
+                text += chunk
+                yield _sse('delta', {'text': chunk})
+            result = _parse_question(text)
+            _prefetch_next_questions(data, previous_answers, question_number, result)
+        except Exception as e:
+            print(f"❌ Error streaming question: {e}")
+            result = _fallback_question(question_number)
+        yield _sse('question', result)
+
+    return _sse_response(events())
+
+
+@app.route('/api/generate-question/prefetch', methods=['POST'])
+def prefetch_question():
+    """
+    預取下一題
+    ---
+    tags:
+      - Agent
+    description: |
+      為已展示的問題重新預取下一題（如預取結果過期後）：服務端在後台為每個選項生成下一題，
+      之後帶相同 session_id 請求 /api/generate-question 時直接返回預取結果。
+      只對 /api/generate-question 已經返回過問題的會話生效，並按會話與客戶端地址限制預取次數，
+      超出限制或會話未知時 scheduled 為 0
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - session_id
+            - options
+          properties:
+            session_id:
+              type: string
+              description: 前端會話 ID
+            previous_answers:
+              type: array
+              items:
+                type: string
+              description: 當前問題之前的回答
+            question_number:
+              type: integer
+              description: 當前問題編號
+            options:
+              type: array
+              items:
+                type: string
+              description: 當前問題展示的選項
+    responses:
+      202:
+        description: 已排入後台
+        schema:
+          type: object
+          properties:
+            scheduled:
+              type: integer
+      400:
+        description: 請求參數錯誤
+    """
+    data = request.json
+    if not data or not data.get('session_id') or not isinstance(data.get('options'), list):
+        return jsonify({'error': '需要 session_id 與 options'}), 400
+
+    scheduled = question_prefetcher.prefetch(
+        data['session_id'],
+        data.get('previous_answers', []),
+        data.get('question_number', 1),
+        data['options'][:3],
+        client=request.remote_addr
+    )
+    return jsonify({'scheduled': scheduled}), 202
 
 
 @app.route('/api/health', methods=['GET'])
@@ -230,8 +584,51 @@ def health_check():
             version:
               type: string
               example: 1.0.0
+            ranking_cache:
+              type: object
+              description: 推薦結果緩存的命中統計
+            recommend_sessions:
+              type: object
+              description: 分頁推薦會話的數量、翻頁次數與過期統計
+            recommend_coalescing:
+              type: object
+              description: 相同條件並發推薦的合併統計（followers 為共享結果、省下排序的請求數）
+            gemini_coalescing:
+              type: object
+              description: 相同 Gemini 請求並發時的合併統計
+            gemini_circuit:
+              type: object
+              description: Gemini 熔斷器狀態（state 為 closed / open / half_open，open 時直接使用本地降級結果）
+            gemini_quota:
+              type: object
+              description: 本地 RPM / TPM 令牌桶的剩餘配額與排隊、丟棄統計
+            question_prefetch:
+              type: object
+              description: 下一題預取的命中率與後台任務統計
+            embedding_index:
+              type: object
+              description: 語義召回索引的規模與嵌入統計（啟用 RECOMMEND_EMBEDDINGS 時）
+            catalog:
+              type: object
+              description: 用戶目錄的當前版本、用戶數與熱重載統計
     """
-    return jsonify({"status": "ok", "version": "1.0.0"})
+    health = {"status": "ok", "version": "1.0.0"}
+    if catalog:
+        health['catalog'] = catalog.stats()
+    if rec_system:
+        health['ranking_cache'] = rec_system.cache.stats()
+        health['recommend_sessions'] = rec_system.sessions.stats()
+        if rec_system.flights is not None:
+            health['recommend_coalescing'] = rec_system.flights.stats()
+        if rec_system.embeddings is not None:
+            health['embedding_index'] = rec_system.embeddings.stats()
+    if gemini:
+        health['gemini_circuit'] = gemini.breaker.stats()
+        health['gemini_quota'] = gemini.quota.stats()
+        if gemini.flights is not None:
+            health['gemini_coalescing'] = gemini.flights.stats()
+    health['question_prefetch'] = question_prefetcher.stats()
+    return jsonify(health)
 
 
 @app.route('/api/options', methods=['GET'])
@@ -241,7 +638,37 @@ def get_options():
     ---
     tags:
       - Data
-    description: 返回系統中所有可用的地點、職業和興趣選項，用於前端構建篩選器。
+    description: |
+      返回系統中所有可用的地點、職業和興趣選項，以及每個取值的用戶數，用於前端構建篩選器。
+      可用查詢參數傳入已選條件，計數與列表會按條件收窄（每個分面不受自身條件限制，方便切換）。
+      響應帶有與數據庫版本綁定的 ETag，帶 If-None-Match 的重複請求返回 304。
+    parameters:
+      - name: location
+        in: query
+        type: string
+      - name: occupation
+        in: query
+        type: string
+      - name: gender
+        in: query
+        type: string
+      - name: hobby
+        in: query
+        type: array
+        items:
+          type: string
+        collectionFormat: multi
+        description: 可重複，命中任意一個即可
+      - name: age_min
+        in: query
+        type: integer
+      - name: age_max
+        in: query
+        type: integer
+      - name: If-None-Match
+        in: header
+        type: string
+        required: false
     responses:
       200:
         description: 成功獲取選項
@@ -263,12 +690,70 @@ def get_options():
               items:
                 type: string
               description: 可用興趣列表
+            facets:
+              type: object
+              description: 各分面（location / occupation / hobby / gender / 外觀字段）的 [{value, count}]，按用戶數從多到少
+            catalog_version:
+              type: string
+      304:
+        description: 選項自上次請求以來沒有變化
+      400:
+        description: 查詢參數無效
     """
-    return jsonify({
-        'locations': locations,
-        'occupations': occupations,
-        'hobbies': hobbies
-    })
+    if not catalog:
+        return jsonify({'locations': [], 'occupations': [], 'hobbies': [], 'facets': {}})
+
+    try:
+        criteria = _facet_criteria(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # 快照只取一次；ETag 由數據庫版本 + 規範化的條件決定，數據庫沒變時前端拿到 304
+    snapshot = catalog.snapshot()
+    etag = hashlib.sha1(make_cache_key(criteria, version=snapshot.version).encode('utf-8')).hexdigest()[:20]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        facets = snapshot.facets.counts(criteria)
+        if criteria:
+            options = {
+                name: sorted(item['value'] for item in facets[field])
+                for name, field in OPTION_LISTS.items()
+            }
+        else:
+            options = snapshot.options
+        response = jsonify(dict(options, facets=facets, catalog_version=snapshot.version))
+    response.set_etag(etag)
+    # 允許瀏覽器緩存，但每次使用前都帶 If-None-Match 重新驗證
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def _check_query(criteria):
+    """提前編譯條件中的布爾查詢，格式錯誤時返回錯誤信息（接口返回 400 而不是推薦過程中的 500）"""
+    if isinstance(criteria, dict) and criteria.get('query'):
+        try:
+            compile_query(criteria['query'])
+        except QueryError as e:
+            return f"無效的查詢: {e}"
+    return None
+
+
+def _facet_criteria(args):
+    """把查詢參數轉成推薦條件格式（hobby 可重複，年齡為整數）"""
+    criteria = {}
+    for key in FACET_FIELDS:
+        values = [v for v in args.getlist(key) if v]
+        if not values:
+            continue
+        criteria[key] = values if key == 'hobby' else values[0]
+    for key in ('age_min', 'age_max'):
+        if args.get(key):
+            try:
+                criteria[key] = int(args[key])
+            except ValueError:
+                raise ValueError(f"{key} 必須是整數")
+    return criteria
 
 
 @app.route('/avatars/<path:filename>')
@@ -293,19 +778,25 @@ def recommend():
     ---
     tags:
       - Recommendation
-    description: 根據用戶提供的條件，使用 Gemini AI 進行智能排序並返回推薦用戶。
+    description: |
+      根據用戶提供的條件，使用 Gemini AI 進行智能排序並返回推薦用戶。
+      帶 page_size 時開始分頁會話：一次排序前 N 名保存在服務端，返回第一頁和 next_cursor；
+      之後只傳 cursor（和 page_size）即可取下一頁，不再過濾和調用 Gemini。
     parameters:
+      - name: X-Request-Deadline
+        in: header
+        type: number
+        required: false
+        description: 客戶端可接受的最長等待時間（秒），不超過服務端為接口配置的時間預算
       - name: body
         in: body
         required: true
         schema:
           type: object
-          required:
-            - criteria
           properties:
             criteria:
               type: object
-              description: 篩選條件
+              description: 篩選條件（傳 cursor 翻頁時不需要）
               properties:
                 location:
                   type: string
@@ -325,10 +816,25 @@ def recommend():
                 gender:
                   type: string
                   description: 性別偏好
+                hair_color:
+                  type: string
+                  description: 髮色（其他外觀條件 hair_length / hairstyle / eye_color / style 同理）
+                description:
+                  type: string
+                  description: 自由描述；能被本地解析器可靠解析時直接按解析出的條件過濾，不調用 Gemini
+                query:
+                  type: object
+                  description: 布爾查詢，例如 {"and":[{"location":"Miami"},{"not":{"occupation":"Engineer"}},{"at_least":2,"hobby":["Music","Travel","Hiking"]},{"age":{"min":25,"max":35}}]}
             top_k:
               type: integer
               default: 5
-              description: 返回結果數量
+              description: 返回結果數量（不分頁時）
+            page_size:
+              type: integer
+              description: 每頁結果數量（1-100）；設置後開始分頁會話
+            cursor:
+              type: string
+              description: 上一頁返回的 next_cursor
     responses:
       200:
         description: 推薦成功
@@ -339,6 +845,12 @@ def recommend():
               type: boolean
             count:
               type: integer
+            next_cursor:
+              type: string
+              description: 下一頁的游標（僅分頁時返回；沒有更多結果時為 null）
+            metadata:
+              type: object
+              description: 推薦統計（數據庫大小、匹配數、送進 AI 的候選數 candidates_considered 等）
             recommendations:
               type: array
               items:
@@ -360,6 +872,8 @@ def recommend():
                       type: string
       400:
         description: 請求參數錯誤
+      410:
+        description: 游標已失效（會話過期或數據庫已更新），需要帶 criteria 重新搜索
       500:
         description: 服務器內部錯誤
     """
@@ -377,20 +891,59 @@ def recommend():
                 'error': '無效的 JSON 數據'
             }), 400
 
+        page_size = data.get('page_size')
+        if page_size is not None and (not isinstance(page_size, int) or page_size < 1 or page_size > 100):
+            page_size = 20
+
+        # 翻頁：直接從會話中保存的排序結果切片
+        if data.get('cursor'):
+            try:
+                recommendations, next_cursor, metadata = rec_system.next_page(data['cursor'], page_size or 20)
+            except SessionExpired as e:
+                return jsonify({'success': False, 'error': f'游標已失效，請重新搜索: {e.args[0]}'}), 410
+            return jsonify({
+                'success': True,
+                'recommendations': recommendations,
+                'count': len(recommendations),
+                'next_cursor': next_cursor,
+                'metadata': metadata
+            })
+
         criteria = data.get('criteria', {})
         top_k = data.get('top_k', 5)
+        deadline = _request_deadline('recommend')
+
+        query_error = _check_query(criteria)
+        if query_error:
+            return jsonify({'success': False, 'error': query_error}), 400
         
         # 驗證 top_k
         if not isinstance(top_k, int) or top_k < 1 or top_k > 100:
             top_k = 50
 
-        # 執行推薦
-        recommendations = rec_system.recommend(criteria, top_k=top_k, use_ai_ranking=True)
+        # 分頁：排序前 N 名保存為會話，返回第一頁
+        if page_size is not None:
+            recommendations, next_cursor, metadata = rec_system.recommend_session(
+                criteria, page_size=page_size, use_ai_ranking=True, deadline=deadline
+            )
+            return jsonify({
+                'success': True,
+                'recommendations': recommendations,
+                'count': len(recommendations),
+                'next_cursor': next_cursor,
+                'metadata': metadata
+            })
+
+        # 執行推薦（時間預算用完時返回當時最好的結果）
+        recommendations, metadata = rec_system.recommend_with_metadata(
+            criteria, top_k=top_k, use_ai_ranking=True, deadline=deadline
+        )
 
         return jsonify({
             'success': True,
             'recommendations': recommendations,
-            'count': len(recommendations)
+            'count': len(recommendations),
+            'metadata': metadata
         })
 
     except Exception as e:
@@ -401,6 +954,183 @@ def recommend():
         }), 500
 
 
+
+@app.route('/api/recommend/stream', methods=['POST'])
+def recommend_stream():
+    """
+    流式推薦接口（Server-Sent Events）
+    ---
+    tags:
+      - Recommendation
+    description: |
+      與 /api/recommend 相同的輸入，以 text/event-stream 返回：
+      先推送 metadata 事件（推薦統計），Gemini 每排好一個用戶就推送一個 user 事件（data 為用戶），
+      最後推送 done 事件（data 為 {"count", "ranking"}）；出錯時推送 error 事件
+    parameters:
+      - name: X-Request-Deadline
+        in: header
+        type: number
+        required: false
+        description: 客戶端可接受的最長等待時間（秒），不超過服務端為接口配置的時間預算
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - criteria
+          properties:
+            criteria:
+              type: object
+              description: 篩選條件（同 /api/recommend）
+            top_k:
+              type: integer
+              default: 5
+              description: 返回結果數量
+    produces:
+      - text/event-stream
+    responses:
+      200:
+        description: 事件流
+      400:
+        description: 請求參數錯誤
+      500:
+        description: 推薦系統未初始化
+    """
+    if not rec_system:
+        return jsonify({
+            'success': False,
+            'error': '推薦系統未初始化'
+        }), 500
+
+    data = request.json
+    if not data:
+        return jsonify({
+            'success': False,
+            'error': '無效的 JSON 數據'
+        }), 400
+
+    criteria = data.get('criteria', {})
+    top_k = data.get('top_k', 5)
+    deadline = _request_deadline('recommend')
+
+    query_error = _check_query(criteria)
+    if query_error:
+        return jsonify({'success': False, 'error': query_error}), 400
+
+    # 驗證 top_k
+    if not isinstance(top_k, int) or top_k < 1 or top_k > 100:
+        top_k = 50
+
+    def events():
+        try:
+            for event, payload in rec_system.recommend_stream(criteria, top_k=top_k, deadline=deadline):
+                yield _sse(event, payload)
+        except Exception as e:
+            print(f"流式推薦過程出錯: {e}")
+            yield _sse('error', {'error': str(e)})
+
+    return _sse_response(events())
+
+
+@app.route('/api/recommend/batch', methods=['POST'])
+def recommend_batch():
+    """
+    批量推薦接口（NDJSON）
+    ---
+    tags:
+      - Recommendation
+    description: |
+      一次提交多組條件，以 application/x-ndjson 逐行返回，每組條件完成後立即輸出一行（按完成順序，不按提交順序）：
+      {"index": 條件下標, "success": true, "count": N, "recommendations": [...], "metadata": {...}}
+      出錯的條件輸出 {"index": 條件下標, "success": false, "error": "..."}，不影響同批其他條件。
+      相同的條件只計算一次，過濾共享單條件查詢，AI 排序在有界線程池中並行。
+    parameters:
+      - name: X-Request-Deadline
+        in: header
+        type: number
+        required: false
+        description: 整批可接受的最長等待時間（秒），不超過 RECOMMEND_BATCH_DEADLINE
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - criteria_list
+          properties:
+            criteria_list:
+              type: array
+              description: 篩選條件列表（每項格式同 /api/recommend 的 criteria）
+              items:
+                type: object
+            top_k:
+              type: integer
+              default: 5
+              description: 每組條件返回的結果數量
+            use_ai_ranking:
+              type: boolean
+              default: true
+              description: 是否使用 AI 排序（false 時只做本地排序，適合預熱等大批量任務）
+    produces:
+      - application/x-ndjson
+    responses:
+      200:
+        description: 逐行返回每組條件的推薦結果
+      400:
+        description: 請求參數錯誤
+      500:
+        description: 推薦系統未初始化
+    """
+    if not rec_system:
+        return jsonify({'success': False, 'error': '推薦系統未初始化'}), 500
+
+    data = request.get_json(silent=True)
+    criteria_list = data.get('criteria_list') if isinstance(data, dict) else None
+    if not isinstance(criteria_list, list) or not criteria_list:
+        return jsonify({'success': False, 'error': 'criteria_list 必須是非空列表'}), 400
+    if len(criteria_list) > RECOMMEND_BATCH_MAX:
+        return jsonify({'success': False, 'error': f'一次最多提交 {RECOMMEND_BATCH_MAX} 組條件'}), 400
+    if not all(isinstance(criteria, dict) for criteria in criteria_list):
+        return jsonify({'success': False, 'error': 'criteria_list 的每一項必須是對象'}), 400
+
+    top_k = data.get('top_k', 5)
+    if not isinstance(top_k, int) or top_k < 1 or top_k > 100:
+        top_k = 50
+    use_ai_ranking = data.get('use_ai_ranking', True) is not False
+    deadline = _request_deadline('recommend_batch')
+
+    def lines():
+        try:
+            for index, recommendations, metadata in rec_system.recommend_many(
+                criteria_list,
+                top_k=top_k,
+                use_ai_ranking=use_ai_ranking,
+                max_workers=RECOMMEND_BATCH_WORKERS,
+                deadline=deadline
+            ):
+                if 'error' in metadata:
+                    item = {'index': index, 'success': False, 'error': metadata['error']}
+                else:
+                    item = {
+                        'index': index,
+                        'success': True,
+                        'count': len(recommendations),
+                        'recommendations': recommendations,
+                        'metadata': metadata
+                    }
+                yield json.dumps(item, ensure_ascii=False) + '\n'
+        except Exception as e:
+            print(f"批量推薦過程出錯: {e}")
+            yield json.dumps({'success': False, 'error': str(e)}, ensure_ascii=False) + '\n'
+
+    return Response(
+        stream_with_context(lines()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 if __name__ == '__main__':
     import os
     port = int(os.environ.get('PORT', 8000))
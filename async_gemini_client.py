@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Gemini API 異步客戶端
+與 GeminiClient 使用相同的請求構建、響應緩存與 extract_text，
+方法簽名一致但需要 await；進程內用信號量限制同時在途的請求數，
+單個核心即可並發發出上百個模型調用
+"""
+
+import asyncio
+import json
+import os
+import time
+import weakref
+from typing import Optional, List, Dict, Any
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp 為可選依賴，只有使用異步客戶端時才需要
+    aiohttp = None
+
+from gemini_client import GeminiClient
+from response_cache import ResponseCache
+from gemini_resilience import CircuitBreaker, RetryPolicy, QuotaLimiter
+
+
+# 每個事件循環一個信號量（asyncio.Semaphore 綁定事件循環，通常一個進程只有一個循環）
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _process_semaphore(limit: int) -> asyncio.Semaphore:
+    """獲取當前事件循環共享的並發信號量（上限以第一次創建時為準）"""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(limit)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+
+class AsyncGeminiClient(GeminiClient):
+    """Gemini API 異步客戶端"""
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        cache: Optional[ResponseCache] = None,
+        max_concurrency: Optional[int] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        retry: Optional[RetryPolicy] = None,
+        quota: Optional[QuotaLimiter] = None
+    ):
+        """
+        初始化異步客戶端
+
+        Args:
+            api_key: Gemini API key，如果不提供則從環境變量 GEMINI_API_KEY 讀取
+            cache: 響應持久化緩存；不提供時，若設置了環境變量 GEMINI_CACHE_PATH 則使用該路徑
+            max_concurrency: 進程內同時在途的最大請求數，默認讀取 GEMINI_MAX_CONCURRENCY（64）
+            breaker: 熔斷器，默認與同步客戶端共用進程內的熔斷器
+            retry: 重試策略（同 GeminiClient）
+            quota: 配額令牌桶，默認與同步客戶端共用
+        """
+        if aiohttp is None:
+            raise ImportError("異步客戶端需要 aiohttp，請先執行 pip install aiohttp")
+
+        super().__init__(api_key=api_key, cache=cache, breaker=breaker, retry=retry, quota=quota)
+        self.max_concurrency = max_concurrency or int(os.getenv('GEMINI_MAX_CONCURRENCY', 64))
+        self._session: Optional["aiohttp.ClientSession"] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def __aenter__(self) -> "AsyncGeminiClient":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        """關閉底層 HTTP 會話"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+
+    async def generate_text(
+        self,
+        prompt: str,
+        model: str = "gemini-2.0-flash-001",
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        use_cache: bool = True,
+        response_mime_type: Optional[str] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        生成文本（參數與 GeminiClient.generate_text 相同）
+
+        Returns:
+            API 響應結果
+        """
+        url, payload = self._generate_text_request(
+            prompt, model, temperature, max_tokens, response_mime_type, response_schema
+        )
+        return await self._make_request_async(url, payload, use_cache=use_cache)
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        model: str = "gemini-2.0-flash-001",
+        temperature: float = 0.7,
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        對話功能（參數與 GeminiClient.chat 相同）
+
+        Returns:
+            API 響應結果
+        """
+        url, payload = self._chat_request(messages, model, temperature)
+        return await self._make_request_async(url, payload, use_cache=use_cache)
+
+    async def analyze_image(
+        self,
+        image_path: str,
+        prompt: str = "描述這張圖片",
+        model: str = "gemini-2.0-flash-001",
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        圖像分析（參數與 GeminiClient.analyze_image 相同）
+
+        Returns:
+            API 響應結果
+        """
+        # 讀取圖片是阻塞 IO，放到線程中執行
+        url, payload = await asyncio.to_thread(self._analyze_image_request, image_path, prompt, model)
+        return await self._make_request_async(url, payload, use_cache=use_cache)
+
+    async def count_tokens(
+        self,
+        text: str,
+        model: str = "gemini-2.0-flash-001",
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        計算 token 數量（參數與 GeminiClient.count_tokens 相同）
+
+        Returns:
+            Token 計數結果
+        """
+        url, payload = self._count_tokens_request(text, model)
+        return await self._make_request_async(url, payload, use_cache=use_cache)
+
+    async def embed_texts(
+        self,
+        texts: List[str],
+        model: str = "text-embedding-004",
+        task_type: Optional[str] = None,
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        批量生成文本向量（參數與 GeminiClient.embed_texts 相同）
+
+        Returns:
+            API 響應結果
+        """
+        url, payload = self._embed_request(texts, model, task_type)
+        return await self._make_request_async(url, payload, use_cache=use_cache)
+
+    async def _make_request_async(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        發送 API 請求（受進程級並發信號量與配額令牌桶限制，429 / 5xx 自動退避重試）
+
+        取消等待中的任務會立即中止 HTTP 請求並釋放並發名額
+
+        Args:
+            url: 請求 URL
+            payload: 請求負載
+            use_cache: 是否允許使用響應緩存
+
+        Returns:
+            API 響應（與同步客戶端格式相同，失敗時包含 error）
+        """
+        cache_entry, cached = self._cache_lookup(url, payload, use_cache)
+        if cached is not None:
+            return cached
+
+        estimated = self._estimate_request_tokens(url, payload)
+        attempt = 0
+        while True:
+            error, wait = self._admit(estimated, None)
+            if error is not None:
+                return error
+            if wait:
+                await asyncio.sleep(wait)
+
+            async with _process_semaphore(self.max_concurrency):
+                # 排隊等待並發名額的時間不計入請求耗時（否則扇出時會被當成慢調用打開熔斷）
+                started = time.monotonic()
+                result = await self._send_request_async(url, payload)
+            attempt += 1
+            delay = self._after_attempt(result, time.monotonic() - started, estimated, attempt, None)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+
+        self._cache_store(cache_entry, result)
+        return result
+
+    async def _get_session(self) -> "aiohttp.ClientSession":
+        """獲取綁定當前事件循環的 HTTP 會話"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._session_loop = loop
+        return self._session
+
+    async def _send_request_async(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        發送 HTTP 請求
+
+        Args:
+            url: 請求 URL
+            payload: 請求負載
+
+        Returns:
+            API 響應；失敗時返回包含 error 的 dict
+        """
+        session = await self._get_session()
+        timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+
+        try:
+            async with session.post(
+                url,
+                params={"key": self.api_key},
+                headers={"Content-Type": "application/json"},
+                json=payload,
+                timeout=timeout
+            ) as response:
+                text = await response.text()
+                if response.status >= 400:
+                    return {
+                        "error": f"{response.status} Error: {response.reason} for url: {url}",
+                        "status_code": response.status,
+                        "response": text,
+                        "retry_after": response.headers.get("Retry-After")
+                    }
+                return json.loads(text)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            return {
+                "error": str(e) or type(e).__name__,
+                "status_code": None,
+                "response": None
+            }
+
+
+async def _demo():
+    """示例：並發計算多段文本的 token 數"""
+    texts = [f"第 {i} 段測試文本，用來演示並發調用。" for i in range(10)]
+    async with AsyncGeminiClient() as client:
+        responses = await asyncio.gather(*(client.count_tokens(text) for text in texts))
+    for text, response in zip(texts, responses):
+        print(f"{text} -> {json.dumps(response, ensure_ascii=False)}")
+
+
+def main():
+    """示例用法"""
+    try:
+        asyncio.run(_demo())
+    except (ValueError, ImportError) as e:
+        print(f"錯誤: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+位圖索引
+每個字段的每個取值對應一個 Python 大整數（第 i 位 = 數據庫中第 i 個用戶），
+條件組合變成整數的 & | ~ 運算，計數是一次 popcount；
+大整數運算按機器字並行，百萬用戶的位圖也只有 125 KB
+"""
+
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from user_index import APPEARANCE_TERM_FIELDS, TermCache
+
+
+# 建立位圖的類別字段
+CATEGORY_FIELDS = ("location", "gender", "occupation", "hobby") + APPEARANCE_TERM_FIELDS
+
+# 每個字節值中置位的位偏移，用於把位圖轉換回位置列表
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+def popcount(mask: int) -> int:
+    """位圖中的用戶數"""
+    return mask.bit_count() if hasattr(mask, "bit_count") else bin(mask).count("1")
+
+
+def to_mask(positions: Iterable[int], size: int) -> int:
+    """位置列表轉位圖（先寫 bytearray 再一次性轉整數，避免反覆分配大整數）"""
+    buffer = bytearray((size + 7) // 8)
+    for pos in positions:
+        buffer[pos >> 3] |= 1 << (pos & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def mask_positions(mask: int, size: int) -> List[int]:
+    """位圖轉從小到大排列的位置列表（size 為位圖的位數）"""
+    result = []
+    data = mask.to_bytes((size + 7) // 8, "little")
+    for index, byte in enumerate(data):
+        if byte:
+            base = index << 3
+            result.extend(base + bit for bit in _BYTE_BITS[byte])
+    return result
+
+
+class BitsetIndex:
+    """用戶位圖索引（匹配規則與 UserIndex 一致）"""
+
+    def __init__(self, users: List[Dict]):
+        """
+        建立位圖
+
+        Args:
+            users: 用戶列表（位序即數據庫順序）
+        """
+        self.users = users
+        self.size = len(users)
+        # 所有用戶的位圖（NOT 運算以此為全集）
+        self.all = (1 << self.size) - 1
+
+        positions = {field: defaultdict(list) for field in CATEGORY_FIELDS}
+        labels = {field: {} for field in CATEGORY_FIELDS}
+        hobby_text = defaultdict(list)
+        ages = defaultdict(list)
+
+        for pos, user in enumerate(users):
+            looks = user.get("appearance") or {}
+            values = {
+                "location": [user["location"]],
+                "gender": [user["gender"]],
+                "occupation": [user["occupation"]],
+                "hobby": user["hobby"],
+            }
+            for field in APPEARANCE_TERM_FIELDS:
+                values[field] = [looks[field]] if looks.get(field) else []
+            for field, raw_values in values.items():
+                for raw in raw_values:
+                    key = raw.lower()
+                    positions[field][key].append(pos)
+                    # 對外展示時使用第一次出現的原始寫法
+                    labels[field].setdefault(key, raw)
+            hobby_text[" ".join(user["hobby"]).lower()].append(pos)
+            ages[user["age"]].append(pos)
+
+        self._bits: Dict[str, Dict[str, int]] = {
+            field: {value: to_mask(plist, self.size) for value, plist in postings.items()}
+            for field, postings in positions.items()
+        }
+        self._labels = labels
+        self._hobby_text = {text: to_mask(plist, self.size) for text, plist in hobby_text.items()}
+        self._age_bits = {age: to_mask(plist, self.size) for age, plist in ages.items()}
+        # 按請求中的詞 / 字段名緩存的位圖每個都與數據庫一樣大（百萬用戶約 125 KB），按 LRU 限制條目數
+        self._generic = TermCache()
+        self._term_cache = TermCache()
+
+    # ------------------------------------------------------------------
+    # 單條件
+    # ------------------------------------------------------------------
+
+    def values(self, field: str) -> Dict[str, int]:
+        """字段的 取值（小寫）-> 位圖"""
+        return self._bits.get(field, {})
+
+    def label(self, field: str, value: str) -> str:
+        """取值的原始寫法"""
+        return self._labels[field].get(value, value)
+
+    def lookup(self, key: str, value: Any) -> int:
+        """
+        滿足單個條件的用戶位圖
+
+        Args:
+            key: 條件名稱
+            value: 條件值
+
+        Returns:
+            位圖
+        """
+        if key in ("location", "gender") or key in APPEARANCE_TERM_FIELDS:
+            return self._bits[key].get(str(value).lower(), 0)
+        if key == "hobby":
+            targets = [value] if isinstance(value, str) else value
+            mask = 0
+            for target in targets:
+                mask |= self.hobby_term(target)
+            return mask
+        if key == "occupation":
+            return self.occupation_term(str(value))
+        if key == "age_min":
+            return self.age_range(lo=value)
+        if key == "age_max":
+            return self.age_range(hi=value)
+        return self._lookup_generic(key, value)
+
+    def hobby_term(self, term: str) -> int:
+        """興趣子字符串匹配（與 `term in " ".join(hobbies).lower()` 等價）"""
+        term = term.lower()
+        cache_key = ("hobby", term)
+        cached = self._term_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        mask = 0
+        # 不含空格的詞不可能跨越兩個興趣，只需掃描單個興趣的詞彙表
+        source = self._bits["hobby"] if term and " " not in term else self._hobby_text
+        for text, bits in source.items():
+            if term in text:
+                mask |= bits
+        self._term_cache.put(cache_key, mask)
+        return mask
+
+    def occupation_term(self, term: str) -> int:
+        """職業雙向子字符串匹配"""
+        term = term.lower()
+        cache_key = ("occupation", term)
+        cached = self._term_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        mask = 0
+        for occupation, bits in self._bits["occupation"].items():
+            if term in occupation or occupation in term:
+                mask |= bits
+        self._term_cache.put(cache_key, mask)
+        return mask
+
+    def age_range(self, lo: Optional[int] = None, hi: Optional[int] = None) -> int:
+        """年齡在 [lo, hi] 內的用戶位圖（不同年齡值只有幾十個）"""
+        mask = 0
+        for age, bits in self._age_bits.items():
+            if (lo is None or age >= lo) and (hi is None or age <= hi):
+                mask |= bits
+        return mask
+
+    def _lookup_generic(self, key: str, value: Any) -> int:
+        """其他條件直接比對字符串（按字段懶加載位圖）"""
+        bits = self._generic.get(key)
+        if bits is None:
+            grouped = defaultdict(list)
+            for pos, user in enumerate(self.users):
+                grouped[str(user.get(key, "")).lower()].append(pos)
+            bits = {k: to_mask(v, self.size) for k, v in grouped.items()}
+            self._generic.put(key, bits)
+        return bits.get(str(value).lower(), 0)
+
+    # ------------------------------------------------------------------
+    # 組合與轉換
+    # ------------------------------------------------------------------
+
+    def match(self, criteria: Dict[str, Any], strict: bool = True) -> int:
+        """
+        按扁平條件求位圖（嚴格模式為交集，放寬模式為並集；沒有有效條件時為空）
+
+        Args:
+            criteria: 過濾條件
+            strict: 是否嚴格匹配
+
+        Returns:
+            位圖
+        """
+        active = [(k, v) for k, v in criteria.items() if v is not None and v != ""]
+        if not active:
+            return 0
+        if strict:
+            mask = self.all
+            for key, value in active:
+                mask &= self.lookup(key, value)
+                if not mask:
+                    break
+            return mask
+        mask = 0
+        for key, value in active:
+            mask |= self.lookup(key, value)
+        return mask
+
+    def positions(self, mask: int) -> List[int]:
+        """位圖轉按數據庫順序排列的位置列表"""
+        return mask_positions(mask, self.size)
+
+    def filter(self, criteria: Dict[str, Any], strict: bool = True) -> List[int]:
+        """按條件過濾，返回位置列表（與 UserIndex.filter 的結果相同）"""
+        return self.positions(self.match(criteria, strict))
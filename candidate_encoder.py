@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+排序提示詞的緊湊候選編碼
+載入數據庫時為每個用戶預先生成一行緊湊片段（欄位用 | 分隔，不帶中文標籤），
+興趣與外觀值換成短代碼，提示詞中只附上本次用到的代碼圖例；
+名字默認省略，只有描述中提到候選人名字時才加上
+"""
+
+import re
+from collections import Counter
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+from gemini_resilience import estimate_tokens
+
+
+# 外觀欄位與圖例中的說明後綴（與 _format_candidate 的描述方式一致）
+LOOK_FIELDS = (
+    ("style", "style"),
+    ("hair_length", "hair"),
+    ("hair_color", "hair"),
+    ("hairstyle", "hairstyle"),
+    ("eye_color", "eyes"),
+)
+
+LOOK_SUFFIXES = dict(LOOK_FIELDS)
+
+# 候選行的欄位說明
+COLUMNS = "ID|年齡|性別|職業|地區|興趣代碼|外觀代碼"
+
+
+def _short_codes(alphabet: str) -> Iterator[str]:
+    """依次生成 a, b, ..., z, aa, ab, ... 形式的代碼"""
+    length = 1
+    while True:
+        indices = [0] * length
+        while True:
+            yield "".join(alphabet[i] for i in indices)
+            pos = length - 1
+            while pos >= 0 and indices[pos] == len(alphabet) - 1:
+                indices[pos] = 0
+                pos -= 1
+            if pos < 0:
+                break
+            indices[pos] += 1
+        length += 1
+
+
+def _assign_codes(counts: Counter, alphabet: str) -> Dict[Any, str]:
+    """出現次數越多的值分到越短的代碼"""
+    codes = _short_codes(alphabet)
+    return {value: next(codes) for value, _ in sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))}
+
+
+class CandidateEncoder:
+    """預先計算的緊湊候選片段"""
+
+    def __init__(self, users: Optional[List[Dict]] = None, counts: Optional[Tuple[Counter, Counter, Counter]] = None):
+        """
+        為所有用戶生成片段
+
+        Args:
+            users: 用戶列表
+            counts: 已統計好的 (興趣出現次數, (外觀欄位, 值) 出現次數, 性別出現次數)；
+                    提供時只分配代碼，片段在用到時才生成（不為整個數據庫預先生成）
+        """
+        users = users or []
+        # 只有代碼表時，片段在取用時現場生成
+        self._on_demand = counts is not None
+        if counts is None:
+            counts = (
+                Counter(hobby for user in users for hobby in user.get("hobby", [])),
+                Counter((field, value) for user in users for field, value in self._look_values(user)),
+                Counter(user.get("gender", "") for user in users),
+            )
+        hobby_counts, look_counts, gender_counts = counts
+
+        # 興趣用大寫字母、外觀用小寫字母，兩組代碼不會混淆
+        self.hobby_codes = _assign_codes(hobby_counts, "ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+        self.look_codes = _assign_codes(look_counts, "abcdefghijklmnopqrstuvwxyz")
+        self.gender_codes = self._gender_codes(gender_counts)
+
+        self.hobby_legend = {code: hobby for hobby, code in self.hobby_codes.items()}
+        self.look_legend = {
+            code: f"{value} {LOOK_SUFFIXES[field]}"
+            for (field, value), code in self.look_codes.items()
+        }
+
+        # id -> (片段, 興趣代碼, 外觀代碼, 估算 token 數)
+        self._fragments: Dict[Any, Tuple[str, Tuple[str, ...], Tuple[str, ...], int]] = {}
+        for user in users:
+            self._fragments[user["id"]] = self._encode(user)
+
+    @staticmethod
+    def _look_values(user: Dict) -> Iterator[Tuple[str, str]]:
+        """用戶的 (外觀欄位, 值)，忽略缺失的欄位"""
+        appearance = user.get("appearance") or {}
+        for field, _ in LOOK_FIELDS:
+            value = appearance.get(field)
+            if value:
+                yield field, value
+
+    @staticmethod
+    def _gender_codes(counts: Counter) -> Dict[str, str]:
+        """性別取首字母；首字母衝突時保留原值"""
+        initials = Counter(gender[:1].upper() for gender in counts if gender)
+        return {
+            gender: gender[:1].upper() if initials[gender[:1].upper()] == 1 else gender
+            for gender in counts
+        }
+
+    def _encode(self, user: Dict) -> Tuple[str, Tuple[str, ...], Tuple[str, ...], int]:
+        """生成單個用戶的片段"""
+        hobby_codes = tuple(self.hobby_codes[hobby] for hobby in user.get("hobby", []))
+        look_codes = tuple(self.look_codes[item] for item in self._look_values(user))
+        fragment = "|".join((
+            str(user["id"]),
+            str(user["age"]),
+            self.gender_codes.get(user.get("gender", ""), user.get("gender", "")),
+            user["occupation"],
+            user["location"],
+            ",".join(hobby_codes),
+            ",".join(look_codes),
+        ))
+        return fragment, hobby_codes, look_codes, estimate_tokens(fragment)
+
+    def _entry(self, user: Dict) -> Tuple[str, Tuple[str, ...], Tuple[str, ...], int]:
+        """取出用戶的片段（不在數據庫中的用戶不使用代碼，直接寫出原值）"""
+        entry = self._fragments.get(user["id"])
+        if entry is None and self._on_demand:
+            try:
+                return self._encode(user)
+            except KeyError:
+                pass
+        if entry is None:
+            fragment = "|".join((
+                str(user["id"]),
+                str(user["age"]),
+                user.get("gender", ""),
+                user["occupation"],
+                user["location"],
+                ",".join(user.get("hobby", [])),
+                ",".join(f"{value} {LOOK_SUFFIXES[field]}" for field, value in self._look_values(user)),
+            ))
+            entry = (fragment, (), (), estimate_tokens(fragment))
+        return entry
+
+    def fragment_tokens(self, user: Dict) -> int:
+        """單個用戶片段的估算 token 數"""
+        return self._entry(user)[3]
+
+    def mentioned_names(self, users: Iterable[Dict], text: str) -> bool:
+        """
+        描述中是否提到了某個候選人的名字（提到時名字才對排序有意義）
+
+        Args:
+            users: 候選用戶
+            text: 用戶描述
+
+        Returns:
+            是否需要在片段中保留名字
+        """
+        words = set(re.findall(r"[a-z]+", text.lower()))
+        for user in users:
+            if words.intersection(re.findall(r"[a-z]+", user.get("name", "").lower())):
+                return True
+        return False
+
+    def encode(self, users: List[Dict], include_names: bool = False) -> str:
+        """
+        生成提示詞中的候選區塊：欄位說明、本次用到的代碼圖例、每行一個候選
+
+        Args:
+            users: 候選用戶
+            include_names: 是否在每行開頭加上名字
+
+        Returns:
+            候選區塊文本
+        """
+        lines = []
+        used_hobbies = set()
+        used_looks = set()
+        genders = set()
+        for user in users:
+            fragment, hobby_codes, look_codes, _ = self._entry(user)
+            used_hobbies.update(hobby_codes)
+            used_looks.update(look_codes)
+            genders.add(user.get("gender", ""))
+            lines.append(f"{user.get('name', '')}|{fragment}" if include_names else fragment)
+
+        header = [f"格式：{'名字|' if include_names else ''}{COLUMNS}"]
+        gender_legend = [
+            f"{self.gender_codes[g]}={g}"
+            for g in sorted(genders)
+            if g in self.gender_codes and self.gender_codes[g] != g
+        ]
+        if gender_legend:
+            header.append("性別：" + " ".join(gender_legend))
+        if used_hobbies:
+            header.append("興趣：" + " ".join(
+                f"{code}={self.hobby_legend[code]}"
+                for code in sorted(used_hobbies, key=lambda c: (len(c), c))
+            ))
+        if used_looks:
+            header.append("外觀：" + " ".join(
+                f"{code}={self.look_legend[code]}"
+                for code in sorted(used_looks, key=lambda c: (len(c), c))
+            ))
+
+        return "\n".join(header + lines)
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+用戶目錄：數據庫的快照與熱重載
+CatalogSnapshot 是某個版本數據庫的不可變快照（用戶列表 + 倒排索引 / 列式存儲 / 位圖與分面計數 /
+提示詞片段 / 描述解析器 / 語義索引視圖 / 選項列表），建好後不再修改；
+sqlite 後端的快照只持有一個固定數據版本的只讀連接，用戶留在磁盤上，建立快照不需要讀取整表；
+Catalog 在後台線程監視數據庫（JSON 文件、SQLite 存儲的數據版本或版本標記文件），變更時在後台建好新快照再一次性替換，
+處理中的請求繼續使用開始時拿到的快照，請求線程永遠不會等待重載
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from functools import cached_property
+from typing import Callable, List, Dict, Any, FrozenSet, Optional
+
+import requests
+
+from user_index import UserIndex
+from columnar_store import ColumnarUserStore
+from candidate_encoder import CandidateEncoder
+from description_parser import DescriptionParser, DEFAULT_CONFIDENCE
+from embedding_index import EmbeddingIndex
+from local_ranker import LocalRanker
+from bitset_index import BitsetIndex
+from facets import FacetEngine, SQLiteFacets
+from query_compiler import from_criteria
+from sqlite_store import SQLiteSnapshot, SQLiteUserStore, is_sqlite_path
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 為可選依賴，只有 sqlite 後端啟用語義召回時才用到
+    np = None
+
+
+# sqlite 後端本地排序時每批從磁盤讀取的候選數
+SQL_RANK_BATCH = 2000
+
+
+class CatalogSnapshot:
+    """一個數據庫版本的不可變快照"""
+
+    def __init__(
+        self,
+        users: Optional[List[Dict]],
+        version: str,
+        backend: str = "index",
+        embeddings: Optional[EmbeddingIndex] = None,
+        parse_confidence: float = DEFAULT_CONFIDENCE,
+        sql: Optional[SQLiteSnapshot] = None,
+        embedding_positions: Optional[List[int]] = None
+    ):
+        """
+        建立快照上的所有派生結構
+
+        Args:
+            users: 用戶列表（sqlite 後端為 None，用戶留在磁盤上）
+            version: 數據庫版本標識
+            backend: 過濾後端，"index"=倒排索引，"columnar"=NumPy 列式存儲，"sqlite"=SQLite 索引查詢，
+                     "bitset"=位圖上的布爾查詢
+            embeddings: 已與用戶同步的語義索引視圖（None=只用關鍵詞召回）
+            parse_confidence: 描述解析器的置信度閾值
+            sql: backend 為 "sqlite" 時固定在快照數據版本上的只讀視圖
+            embedding_positions: sqlite 後端語義索引每一行對應的用戶位置
+        """
+        if backend == "sqlite" and sql is None:
+            raise ValueError("sqlite 過濾後端需要 SQLite 用戶存儲")
+        self.version = version
+        self.backend = backend
+        self.embeddings = embeddings
+        self.parse_confidence = parse_confidence
+        self.sql = sql if backend == "sqlite" else None
+        self._users = users
+        self._embedding_positions = None
+        if self.sql is not None:
+            # 用戶留在磁盤上：過濾、檢索、布爾查詢的位圖與分面計數都在視圖上查詢，
+            # 提示詞代碼表與解析器詞彙在第一次用到時按 SQL 統計生成，建立快照不讀取任何用戶
+            self.index = None
+            self.store = None
+            self.bitsets = self.sql
+            self.facets = SQLiteFacets(self.sql)
+            if embeddings is not None and embedding_positions is not None:
+                self._embedding_positions = np.asarray(embedding_positions, dtype=np.int64)
+            return
+
+        # 一次性建立倒排索引，過濾時只做集合運算
+        self.index = UserIndex(users)
+        # 可選的列式存儲，過濾時做向量化掩碼運算
+        self.store = ColumnarUserStore(users) if backend == "columnar" else None
+        # 每個用戶的緊湊提示詞片段只在載入時生成一次
+        self.encoder = CandidateEncoder(users)
+        # 描述解析器的詞彙表來自當前數據庫
+        self.parser = DescriptionParser(users, min_confidence=parse_confidence)
+        # 位圖索引上的分面計數；不帶條件的計數在這裡一次算好
+        self.bitsets = BitsetIndex(users)
+        self.facets = FacetEngine(self.bitsets)
+
+    # 以下三項只在 sqlite 後端上懶加載；其他後端在 __init__ 中直接賦值，不會走到這裡
+
+    @cached_property
+    def encoder(self) -> CandidateEncoder:
+        """提示詞候選編碼（sqlite 後端按取值次數分配代碼，片段在用到時生成）"""
+        return CandidateEncoder(counts=self.sql.value_counts())
+
+    @cached_property
+    def parser(self) -> DescriptionParser:
+        """描述解析器（sqlite 後端的詞彙表來自 DISTINCT 查詢）"""
+        return DescriptionParser(min_confidence=self.parse_confidence, vocabulary=self.sql.vocabulary())
+
+    @cached_property
+    def options(self) -> Dict[str, List[str]]:
+        """/api/options 的地區 / 職業 / 興趣列表"""
+        return self.facets.options()
+
+    @property
+    def users(self) -> List[Dict]:
+        """用戶列表（sqlite 後端不在內存中保存用戶，每次訪問都從磁盤讀取整表）"""
+        if self.sql is not None:
+            return self.sql.positioned_users()[1]
+        return self._users
+
+    @property
+    def size(self) -> int:
+        """用戶數"""
+        if self.sql is not None:
+            return self.sql.size
+        return len(self._users)
+
+    def filter(self, criteria: Dict[str, Any], strict: bool = True) -> List[int]:
+        """
+        過濾用戶，返回用戶在數據庫中的位置
+
+        Args:
+            criteria: 過濾條件
+            strict: 是否嚴格匹配（True=必須完全匹配，False=部分匹配即可）
+
+        Returns:
+            按數據庫順序排列的用戶位置列表
+
+        Raises:
+            QueryError: criteria["query"] 格式錯誤
+        """
+        if criteria.get("query") or self.backend == "bitset":
+            # 布爾查詢只能在位圖上求值（sqlite 後端的位圖由視圖按條件查詢生成）；其他條件經兼容層與查詢組合
+            return self.bitsets.positions(from_criteria(criteria, strict=strict).evaluate(self.bitsets))
+        if self.sql is not None:
+            return self.sql.filter(criteria, strict=strict)
+        engine = self.store if self.store is not None else self.index
+        return engine.filter(criteria, strict=strict)
+
+    def lookup(self, key: str, value: Any) -> FrozenSet[int]:
+        """滿足單個條件的用戶位置集合"""
+        if self.sql is not None:
+            return frozenset(self.sql.positions(self.sql.lookup(key, value)))
+        return self.index.lookup(key, value)
+
+    def search_text(self, text: str, limit: int, within: Optional[FrozenSet[int]] = None) -> List[int]:
+        """
+        關鍵詞召回（sqlite 後端使用 FTS5 全文索引，其他後端使用內存倒排表）
+
+        Args:
+            text: 自由描述
+            limit: 最多返回的用戶數
+            within: 只在這些位置中召回（例如性別硬過濾後的集合）
+
+        Returns:
+            用戶位置列表（命中多的在前，不足 limit 時按數據庫順序補足）
+        """
+        if self.sql is None:
+            return self.index.search_text(text, limit, within=within)
+
+        # 全文索引不知道 within，多取一些再按 within 過濾
+        result = []
+        for pos in self.sql.search_text(text, limit * 2 if within is not None else limit):
+            if within is None or pos in within:
+                result.append(pos)
+                if len(result) >= limit:
+                    return result
+        chosen = set(result)
+        pool = self.sql.first_positions(limit + len(chosen)) if within is None else sorted(within)
+        for pos in pool:
+            if len(result) >= limit:
+                break
+            if pos not in chosen:
+                result.append(pos)
+        return result
+
+    def search_embeddings(self, text: str, limit: int, within: Optional[FrozenSet[int]] = None, deadline=None) -> List[int]:
+        """
+        語義召回（需要 embeddings；sqlite 後端的位置不一定連續，在這裡與索引行號互相轉換）
+
+        Raises:
+            requests.exceptions.RequestException: 查詢嵌入失敗
+        """
+        rows_of = self._embedding_positions
+        if rows_of is None:
+            return self.embeddings.search(text, limit, within=within, deadline=deadline)
+        rows = None if within is None else frozenset(np.searchsorted(rows_of, sorted(within)).tolist())
+        return [int(rows_of[row]) for row in self.embeddings.search(text, limit, within=rows, deadline=deadline)]
+
+    def users_at(self, positions: List[int]) -> List[Dict]:
+        """根據位置物化用戶"""
+        if self.sql is not None:
+            return self.sql.users_at(positions)
+        engine = self.store if self.store is not None else self.index
+        return engine.users_at(positions)
+
+    def rank_local(self, positions: List[int], criteria: Dict[str, Any], top_n: int, ranker: LocalRanker) -> List[Dict]:
+        """
+        本地排序候選並返回分數最高的 top_n 個用戶
+
+        列式後端在數組上向量化打分，只物化返回的行；sqlite 後端分批讀取候選，內存中只保留一批和目前最好的 top_n 個；
+        其他後端逐個用戶打分
+
+        Args:
+            positions: 候選用戶位置
+            criteria: 搜索條件
+            top_n: 返回數量
+            ranker: 本地排序器（提供權重與打分規則）
+
+        Returns:
+            按分數從高到低排列的用戶列表
+        """
+        if self.store is not None:
+            return self.store.users_at(self.store.rank(positions, ranker.prepare(criteria), ranker.weights, top_n))
+        if self.sql is not None:
+            # 目前最好的在前、新一批在後，同分時仍按候選原順序
+            best: List[Dict] = []
+            for start in range(0, len(positions), SQL_RANK_BATCH):
+                best = ranker.rank(best + self.sql.users_at(positions[start:start + SQL_RANK_BATCH]), criteria, top_n)
+            return best
+        return ranker.rank(self.users_at(positions), criteria, top_n)
+
+    def sample_remaining(self, positions: List[int], needed: int) -> List[int]:
+        """
+        從未被選中的用戶中隨機抽取補充用戶
+
+        Args:
+            positions: 已選中的用戶位置
+            needed: 需要補充的數量
+
+        Returns:
+            補充的用戶位置列表
+        """
+        if self.sql is not None:
+            return self.sql.sample(positions, needed)
+        taken = set(positions)
+        needed = min(needed, self.size - len(taken))
+        extra = []
+        # 已選中的用戶很少（不足 top_k），拒絕採樣即可，不必打亂整個數據庫
+        while len(extra) < needed:
+            pos = random.randrange(self.size)
+            if pos not in taken:
+                taken.add(pos)
+                extra.append(pos)
+        return extra
+
+
+class SharedLookups:
+    """
+    批量推薦使用的快照視圖：同一批條件共享單條件查詢的結果
+    過濾在位圖上求值（結果與各過濾後端相同），批內重複出現的 (字段, 取值) 只查一次；
+    其他屬性直接讀取底層快照。只在準備候選的單個線程中使用
+    """
+
+    def __init__(self, snapshot: CatalogSnapshot):
+        self.snapshot = snapshot
+        # 表達式樹求值時把本視圖當作位圖索引：需要 all 與 lookup
+        self.all = snapshot.bitsets.all
+        self._masks: Dict[str, int] = {}
+        self.lookups = 0
+        self.shared = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.snapshot, name)
+
+    def lookup(self, key: str, value: Any) -> int:
+        """單個條件的用戶位圖（批內緩存）"""
+        self.lookups += 1
+        memo_key = json.dumps([key, value], sort_keys=True, ensure_ascii=False, default=str).lower()
+        mask = self._masks.get(memo_key)
+        if mask is None:
+            mask = self._masks[memo_key] = self.snapshot.bitsets.lookup(key, value)
+        else:
+            self.shared += 1
+        return mask
+
+    def filter(self, criteria: Dict[str, Any], strict: bool = True) -> List[int]:
+        """
+        過濾用戶（與 CatalogSnapshot.filter 的結果相同）
+
+        Raises:
+            QueryError: criteria["query"] 格式錯誤
+        """
+        node = from_criteria(criteria, strict=strict)
+        return self.snapshot.bitsets.positions(node.evaluate(self))
+
+
+class Catalog:
+    """可熱重載的用戶目錄（當前快照的讀取是無鎖的一次屬性訪問）"""
+
+    def __init__(
+        self,
+        database_path: str = "users_database.json",
+        backend: str = "index",
+        embedding_index: Optional[EmbeddingIndex] = None,
+        parse_confidence: float = DEFAULT_CONFIDENCE,
+        version_path: Optional[str] = None
+    ):
+        """
+        載入數據庫並建立第一個快照（啟動時同步執行）
+
+        Args:
+            database_path: 用戶數據庫路徑（JSON 文件，或 .db / .sqlite / .sqlite3 結尾的 SQLite 存儲）
+            backend: 過濾後端，"index"=倒排索引，"columnar"=NumPy 列式存儲，"sqlite"=SQLite 索引查詢，
+                     "bitset"=位圖上的布爾查詢
+            embedding_index: 描述搜索的語義索引（每次重載只重新嵌入變化的用戶）
+            parse_confidence: 描述解析器的置信度閾值
+            version_path: 版本標記文件（可選）；設置後只在標記變化時重載，
+                          適合先寫完數據庫再更新標記的發布流程，避免讀到寫了一半的文件
+        """
+        if backend not in ("index", "columnar", "sqlite", "bitset"):
+            raise ValueError(f"不支持的過濾後端: {backend}")
+
+        # SQLite 存儲原地更新時數據版本加一，監視線程據此重載
+        self.sql_store = SQLiteUserStore(database_path) if is_sqlite_path(database_path) else None
+        if backend == "sqlite" and self.sql_store is None:
+            raise ValueError(f"sqlite 過濾後端需要 SQLite 數據庫文件: {database_path}")
+
+        self.database_path = database_path
+        self.backend = backend
+        self.embedding_index = embedding_index
+        self.parse_confidence = parse_confidence
+        self.version_path = version_path
+
+        self._listeners: List[Callable[[CatalogSnapshot], None]] = []
+        self._reload_lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._failed_version: Optional[str] = None
+
+        self.reloads = 0
+        self.failed_reloads = 0
+        self.last_error: Optional[str] = None
+        self.loaded_at = time.time()
+
+        self._snapshot = self._build(self.fingerprint())
+
+    def snapshot(self) -> CatalogSnapshot:
+        """當前快照；一次請求應只取一次並在整個請求中使用它"""
+        return self._snapshot
+
+    @property
+    def version(self) -> str:
+        """當前快照的版本標識"""
+        return self._snapshot.version
+
+    def subscribe(self, callback: Callable[[CatalogSnapshot], None]):
+        """
+        註冊快照替換後的回調（在重載線程中調用，用於讓緩存等失效）
+
+        Args:
+            callback: 接收新快照的函數
+        """
+        self._listeners.append(callback)
+
+    def fingerprint(self) -> str:
+        """數據庫版本標識：版本標記文件的內容、SQLite 存儲的數據版本，或數據庫文件的修改時間 + 大小"""
+        try:
+            if self.version_path:
+                with open(self.version_path, "r", encoding="utf-8") as f:
+                    return "marker-" + f.read().strip()
+            if self.sql_store is not None:
+                return f"sqlite-{self.sql_store.version()}"
+            stat = os.stat(self.database_path)
+        except FileNotFoundError as e:
+            raise FileNotFoundError(f"找不到用戶數據庫文件: {e.filename}")
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def _load(self) -> List[Dict]:
+        """讀取整個數據庫（內存後端使用）"""
+        if self.sql_store is not None:
+            return self.sql_store.versioned_users()[1]
+        try:
+            with open(self.database_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"找不到用戶數據庫文件: {self.database_path}")
+
+    def _build(self, version: str) -> CatalogSnapshot:
+        """載入數據庫並建立新快照（不影響當前快照）"""
+        sql = None
+        positions = None
+        if self.backend == "sqlite":
+            # 只打開一個固定在當前數據版本上的只讀視圖；只有語義索引需要同步時才讀取整表
+            sql = self.sql_store.snapshot()
+            users = None
+            if self.embedding_index is not None:
+                positions, users = sql.positioned_users()
+        else:
+            users = self._load()
+
+        embeddings = None
+        if self.embedding_index is not None:
+            # 語義索引只重新嵌入變化的用戶；快照持有同步後的只讀視圖
+            try:
+                self.embedding_index.sync(users)
+                embeddings = self.embedding_index.frozen()
+            except requests.exceptions.RequestException as e:
+                print(f"⚠️  語義索引更新失敗，描述搜索改用關鍵詞召回: {e}")
+        return CatalogSnapshot(
+            None if sql is not None else users,
+            version,
+            backend=self.backend,
+            embeddings=embeddings,
+            parse_confidence=self.parse_confidence,
+            sql=sql,
+            embedding_positions=positions
+        )
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        版本變化時建立新快照並原子替換（同一時間只有一個重載在執行）
+
+        Args:
+            force: 版本沒有變化也強制重建
+
+        Returns:
+            是否替換了快照
+        """
+        with self._reload_lock:
+            try:
+                version = self.fingerprint()
+                if not force and (version == self._snapshot.version or version == self._failed_version):
+                    return False
+
+                print(f"🔄 用戶數據庫已變更，後台重新載入（版本 {version}）...")
+                started = time.monotonic()
+                snapshot = self._build(version)
+            except Exception as e:
+                # 文件寫到一半、JSON 無效等：保留舊快照，同一版本不再重試
+                self.failed_reloads += 1
+                self.last_error = str(e)
+                self._failed_version = locals().get("version")
+                print(f"❌ 用戶數據庫重新載入失敗，繼續使用舊版本: {e}")
+                return False
+
+            # 單次屬性賦值即原子替換：之後開始的請求看到新快照，處理中的請求不受影響
+            self._snapshot = snapshot
+            self._failed_version = None
+            self.reloads += 1
+            self.last_error = None
+            self.loaded_at = time.time()
+            print(f"✅ 用戶數據庫已更新: {snapshot.size} 個用戶，耗時 {time.monotonic() - started:.2f}s")
+
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"⚠️  快照替換回調失敗: {e}")
+        return True
+
+    def start(self, interval: float = 5.0):
+        """
+        啟動後台監視線程（重複調用無效）
+
+        Args:
+            interval: 檢查版本的間隔（秒）
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="catalog-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        """停止後台監視線程"""
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+
+    def _watch(self, interval: float):
+        """定期檢查版本，變化時在本線程中重建快照"""
+        while not self._stop.wait(interval):
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"⚠️  用戶數據庫監視出錯: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """返回當前版本與重載統計"""
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version,
+            "users": snapshot.size,
+            "backend": self.backend,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+            "last_error": self.last_error,
+            "watching": self._watcher is not None and self._watcher.is_alive(),
+        }
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+列式用戶存儲（可選後端，依賴 NumPy）
+年齡存成整數數組，類別字段字典編碼成整數代碼，興趣存成 CSR 矩陣，
+過濾、匹配計數與本地排序打分都變成向量化的數組運算；只有最終返回的行才物化成 dict
+"""
+
+from typing import List, Dict, Any, Iterable, Tuple
+
+from local_ranker import AGE_FALLOFF_YEARS, LocalRanker
+from user_index import TermCache
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 為可選依賴，只有使用列式後端時才需要
+    np = None
+
+
+# 外觀特征中做字典編碼的字段
+APPEARANCE_FIELDS = ("style", "hair_length", "hair_color", "hairstyle", "eye_color")
+
+
+def _appearance_value(user: Dict, field: str):
+    """取出小寫的外觀特征值，沒有則返回 None"""
+    value = (user.get("appearance") or {}).get(field)
+    return value.lower() if value else None
+
+
+class _Categorical:
+    """字典編碼的類別列（值統一小寫，缺失值編碼為 -1）"""
+
+    def __init__(self, values: Iterable[Any]):
+        self.vocab: Dict[str, int] = {}
+        codes = []
+        for value in values:
+            if value is None:
+                codes.append(-1)
+                continue
+            codes.append(self.vocab.setdefault(value, len(self.vocab)))
+        self.codes = np.asarray(codes, dtype=np.int32)
+
+    def code_of(self, value: str) -> int:
+        return self.vocab.get(value, -1)
+
+    def codes_where(self, predicate) -> "np.ndarray":
+        """返回詞彙表中滿足條件的所有代碼"""
+        return np.fromiter(
+            (code for value, code in self.vocab.items() if predicate(value)),
+            dtype=np.int32
+        )
+
+    def equals(self, value: str) -> "np.ndarray":
+        code = self.code_of(value)
+        if code < 0:
+            return np.zeros(len(self.codes), dtype=bool)
+        return self.codes == code
+
+    def isin(self, codes: "np.ndarray") -> "np.ndarray":
+        if len(codes) == 0:
+            return np.zeros(len(self.codes), dtype=bool)
+        return np.isin(self.codes, codes)
+
+
+class ColumnarUserStore:
+    """列式用戶存儲"""
+
+    def __init__(self, users: List[Dict]):
+        """
+        將用戶列表轉換為列式存儲
+
+        Args:
+            users: 用戶列表
+        """
+        if np is None:
+            raise ImportError("列式後端需要 NumPy，請先執行 pip install numpy")
+
+        self._records = users
+        self.size = len(users)
+
+        self.age = np.fromiter((u["age"] for u in users), dtype=np.int32, count=self.size)
+        self.location = _Categorical(u["location"].lower() for u in users)
+        self.gender = _Categorical(u["gender"].lower() for u in users)
+        self.occupation = _Categorical(u["occupation"].lower() for u in users)
+        # 與原本的過濾邏輯一致：興趣拼接字符串也編碼一份，用於含空格的子字符串匹配
+        self.hobby_text = _Categorical(" ".join(u["hobby"]).lower() for u in users)
+
+        # 興趣 CSR 矩陣：indptr / indices，外加每個非零元素所在的行號
+        self.hobby_vocab: Dict[str, int] = {}
+        indptr = [0]
+        indices = []
+        for user in users:
+            for hobby in user["hobby"]:
+                indices.append(self.hobby_vocab.setdefault(hobby.lower(), len(self.hobby_vocab)))
+            indptr.append(len(indices))
+        self.hobby_indptr = np.asarray(indptr, dtype=np.int64)
+        self.hobby_indices = np.asarray(indices, dtype=np.int32)
+        self.hobby_rows = np.repeat(
+            np.arange(self.size, dtype=np.int32), np.diff(self.hobby_indptr)
+        )
+
+        self.appearance = {
+            field: _Categorical(_appearance_value(u, field) for u in users)
+            for field in APPEARANCE_FIELDS
+        }
+
+        # 其他條件（通用字段）按需編碼；字段名與子字符串詞都來自請求，緩存按 LRU 限制條目數
+        self._generic = TermCache()
+
+        self._hobby_term_cache = TermCache()
+        self._occupation_term_cache = TermCache()
+
+    # ------------------------------------------------------------------
+    # 單條件掩碼
+    # ------------------------------------------------------------------
+
+    def mask(self, key: str, value: Any) -> "np.ndarray":
+        """
+        計算單個條件的布爾掩碼
+
+        Args:
+            key: 條件名稱
+            value: 條件值
+
+        Returns:
+            長度為用戶數的布爾數組
+        """
+        if key == "location":
+            return self.location.equals(value.lower())
+        if key == "gender":
+            return self.gender.equals(value.lower())
+        if key == "hobby":
+            targets = [value] if isinstance(value, str) else value
+            result = np.zeros(self.size, dtype=bool)
+            for target in targets:
+                result |= self._hobby_term_mask(target.lower())
+            return result
+        if key == "occupation":
+            return self.occupation.isin(self._occupation_codes(value.lower()))
+        if key == "age_min":
+            return self.age >= value
+        if key == "age_max":
+            return self.age <= value
+        if key in self.appearance:
+            return self.appearance[key].equals(str(value).lower())
+        return self._generic_column(key).equals(str(value).lower())
+
+    def _hobby_term_mask(self, term: str) -> "np.ndarray":
+        """興趣子字符串匹配（與 `term in " ".join(hobbies).lower()` 等價）"""
+        if not term or " " in term:
+            # 可能跨越兩個興趣，改用拼接字符串列
+            return self.hobby_text.isin(self.hobby_text.codes_where(lambda text: term in text))
+        return self._hobby_rows_mask(self._hobby_codes(term))
+
+    def _hobby_codes(self, term: str) -> "np.ndarray":
+        """包含該子字符串的單個興趣的代碼集合"""
+        codes = self._hobby_term_cache.get(term)
+        if codes is None:
+            codes = np.fromiter(
+                (code for hobby, code in self.hobby_vocab.items() if term in hobby),
+                dtype=np.int32
+            )
+            self._hobby_term_cache.put(term, codes)
+        return codes
+
+    def _hobby_rows_mask(self, codes: "np.ndarray") -> "np.ndarray":
+        """至少有一個興趣在 codes 中的用戶"""
+        result = np.zeros(self.size, dtype=bool)
+        if len(codes):
+            result[self.hobby_rows[np.isin(self.hobby_indices, codes)]] = True
+        return result
+
+    def _occupation_codes(self, term: str) -> "np.ndarray":
+        """職業雙向子字符串匹配的代碼集合"""
+        codes = self._occupation_term_cache.get(term)
+        if codes is None:
+            codes = self.occupation.codes_where(lambda occ: term in occ or occ in term)
+            self._occupation_term_cache.put(term, codes)
+        return codes
+
+    def _generic_column(self, key: str) -> _Categorical:
+        column = self._generic.get(key)
+        if column is None:
+            column = _Categorical(str(u.get(key, "")).lower() for u in self._records)
+            self._generic.put(key, column)
+        return column
+
+    # ------------------------------------------------------------------
+    # 組合查詢
+    # ------------------------------------------------------------------
+
+    def match_counts(self, criteria: Dict[str, Any]) -> Tuple["np.ndarray", int]:
+        """
+        向量化計算每個用戶匹配的條件數
+
+        Args:
+            criteria: 過濾條件
+
+        Returns:
+            (每個用戶的匹配數, 有效條件數)
+        """
+        counts = np.zeros(self.size, dtype=np.int16)
+        total = 0
+        for key, value in criteria.items():
+            if value is None or value == "":
+                continue
+            total += 1
+            counts += self.mask(key, value)
+        return counts, total
+
+    def filter(self, criteria: Dict[str, Any], strict: bool = True) -> List[int]:
+        """
+        按條件過濾用戶
+
+        Args:
+            criteria: 過濾條件
+            strict: 是否嚴格匹配（True=全部匹配，False=至少匹配一個）
+
+        Returns:
+            按原始順序排列的用戶位置列表
+        """
+        counts, total = self.match_counts(criteria)
+        if total == 0:
+            return []
+        selected = counts == total if strict else counts > 0
+        return np.flatnonzero(selected).tolist()
+
+    def rank(self, positions: List[int], query: Dict[str, Any], weights: Dict[str, float], top_n: int) -> List[int]:
+        """
+        向量化的本地排序：與 LocalRanker.score 逐項相同的加權分數，只返回前 top_n 個位置
+
+        Args:
+            positions: 候選用戶位置
+            query: LocalRanker.prepare() 返回的打分查詢
+            weights: 各匹配項的權重（LocalRanker.weights）
+            top_n: 返回數量
+
+        Returns:
+            按分數從高到低排列的用戶位置（同分時保持候選中的順序；性別不符的候選被排除）
+        """
+        rows = np.asarray(positions, dtype=np.int64)
+        keep = np.ones(len(rows), dtype=bool)
+        score = np.zeros(len(rows), dtype=np.float64)
+
+        gender = query.get("gender")
+        if gender:
+            keep &= self.gender.codes[rows] == self.gender.code_of(gender)
+
+        wanted = query["appearance"]
+        if wanted:
+            hits = np.zeros(len(rows), dtype=np.int64)
+            for field, value in wanted.items():
+                column = self.appearance[field]
+                code = column.code_of(value)
+                if code >= 0:
+                    hits += column.codes[rows] == code
+            score += weights["appearance"] * hits / len(wanted)
+
+        if "location" in query:
+            code = self.location.code_of(query["location"])
+            if code >= 0:
+                score += np.where(self.location.codes[rows] == code, weights["location"], 0.0)
+
+        if "hobby" in query and query["hobby"]:
+            overlap = np.zeros(len(rows), dtype=np.int64)
+            for term in query["hobby"]:
+                overlap += self._hobby_rows_mask(self._hobby_codes(term))[rows]
+            score += weights["hobby"] * overlap / len(query["hobby"])
+
+        if "age_min" in query or "age_max" in query:
+            ages = self.age[rows]
+            distance = np.zeros(len(rows), dtype=np.int64)
+            below = np.zeros(len(rows), dtype=bool)
+            if query.get("age_min") is not None:
+                below = ages < query["age_min"]
+                distance = np.where(below, query["age_min"] - ages, distance)
+            if query.get("age_max") is not None:
+                distance = np.where(~below & (ages > query["age_max"]), ages - query["age_max"], distance)
+            score += weights["age"] * np.maximum(0.0, 1.0 - distance / AGE_FALLOFF_YEARS)
+
+        if "occupation" in query:
+            target = query["occupation"]
+            relatedness = np.zeros(len(self.occupation.vocab), dtype=np.float64)
+            for occupation, code in self.occupation.vocab.items():
+                relatedness[code] = LocalRanker._occupation_relatedness(occupation, target)
+            score += weights["occupation"] * relatedness[self.occupation.codes[rows]]
+
+        order = np.flatnonzero(keep)
+        # 分數降序，同分按候選順序；只排序保留的候選
+        order = order[np.lexsort((order, -score[order]))][:top_n]
+        return rows[order].tolist()
+
+    def users_at(self, positions: Iterable[int]) -> List[Dict]:
+        """只把需要返回的行物化成用戶 dict"""
+        return [self._records[p] for p in positions]
@@ -21,6 +21,7 @@ export const API_BASE_URL = isLocalhost ? API_CONFIG.development : API_CONFIG.pr
 export const API_ENDPOINTS = {
     options: `${API_BASE_URL}/api/options`,
     generateQuestion: `${API_BASE_URL}/api/generate-question`,
+    prefetchQuestion: `${API_BASE_URL}/api/generate-question/prefetch`,
     recommend: `${API_BASE_URL}/api/recommend`,
     health: `${API_BASE_URL}/api/health`
 };
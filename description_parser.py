@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+本地描述解析器
+把自由描述（如 "blonde woman who likes hiking in Seattle"）轉成結構化條件：
+詞彙表從數據庫中的地區、職業、興趣、性別、外觀值生成，再加上同義詞表；
+每個描述得到一個置信度（有意義的詞中被識別的比例），
+置信度足夠時推薦系統直接用索引過濾 + 本地排序回答，不再調用 Gemini
+"""
+
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+from local_ranker import APPEARANCE_KEYS, GENDER_WORDS, HAIR_COLORS, EYE_COLORS, HAIRSTYLES, STYLES
+
+# 默認的置信度閾值：幾乎所有有意義的詞都被識別時才跳過 Gemini
+DEFAULT_CONFIDENCE = 0.8
+
+# 不影響匹配的詞（計算置信度時忽略）
+STOPWORDS = frozenset("""
+a an the and or with who whos that which is are was be being to of for in at on from near around by
+i im me my we our you your someone somebody person people one partner date match matches
+looking look seeking search searching find want wants would like likes liked love loves enjoy enjoys
+into also has have having lives living live based who's really very pretty quite
+her his their she he they them
+hair haired eye eyes eyed style styled looks looking character avatar
+year years old aged age yo between than under over below above older younger less more plus
+early mid late fan lover enthusiast
+""".split())
+
+# 否定詞：解析器無法表達「排除」，出現時交給 Gemini
+NEGATIONS = frozenset("not no without except never dont don't doesn't isn't hate hates dislike dislikes".split())
+
+# 興趣同義詞 -> 數據庫中的興趣（只保留數據庫裡存在的）
+HOBBY_SYNONYMS = {
+    "hike": "Hiking", "hikes": "Hiking", "hiker": "Hiking", "hiking": "Hiking",
+    "read": "Reading", "reads": "Reading", "reader": "Reading", "books": "Reading", "bookworm": "Reading",
+    "run": "Running", "runs": "Running", "runner": "Running", "jogging": "Running",
+    "cook": "Cooking", "cooks": "Cooking", "foodie": "Cooking",
+    "dance": "Dancing", "dances": "Dancing", "dancer": "Dancing",
+    "sing": "Singing", "sings": "Singing", "singer": "Singing",
+    "swim": "Swimming", "swims": "Swimming", "swimmer": "Swimming",
+    "surf": "Surfing", "surfs": "Surfing", "surfer": "Surfing",
+    "traveling": "Travel", "travelling": "Travel", "traveler": "Travel", "traveller": "Travel", "travels": "Travel",
+    "game": "Gaming", "games": "Gaming", "gamer": "Gaming", "video games": "Gaming",
+    "movie": "Movies", "film": "Movies", "films": "Movies", "cinema": "Movies",
+    "paint": "Painting", "paints": "Painting", "painter": "Painting",
+    "photos": "Photography",
+    "meditate": "Meditation", "meditates": "Meditation",
+    "wine": "Wine Tasting",
+    "coding": "Programming", "code": "Programming",
+    "dog": "Pets", "dogs": "Pets", "cat": "Pets", "cats": "Pets", "animals": "Pets",
+    "garden": "Gardening",
+    "camp": "Camping",
+    "bike": "Cycling", "biking": "Cycling", "cyclist": "Cycling",
+    "golfer": "Golf",
+    "gym": "Fitness", "workout": "Fitness", "working out": "Fitness",
+    "sporty": "Sports", "athletic": "Sports",
+    "crafting": "Crafts", "diy": "Crafts",
+    "music lover": "Music", "musician": "Music",
+}
+
+# 地區別名 -> 數據庫中的地區
+LOCATION_ALIASES = {
+    "nyc": "New York", "ny": "New York", "la": "Los Angeles", "sf": "San Francisco",
+    "vegas": "Las Vegas", "philly": "Philadelphia", "atx": "Austin",
+}
+
+# 職業同義詞 -> 職業查詢詞（職業過濾是雙向子字符串匹配，"engineer" 可命中所有工程師）
+OCCUPATION_SYNONYMS = {
+    "physician": "Doctor", "attorney": "Lawyer", "educator": "Teacher",
+    "programmer": "Developer", "coder": "Developer", "dev": "Developer",
+    "founder": "Entrepreneur", "influencer": "Content Creator", "creator": "Content Creator",
+}
+
+# 發長詞（後面三個詞內出現 hair 才算發長，避免 "long walks" 被誤判）
+HAIR_LENGTH_WORDS = {
+    ("very", "long"): "very long", ("long",): "long", ("medium",): "medium",
+    ("short",): "short", ("buzz", "cut"): "buzz cut", ("buzzcut",): "buzz cut",
+}
+
+HAIR_NOUNS = ("hair", "haired")
+EYE_NOUNS = ("eye", "eyes", "eyed")
+
+DECADE_PARTS = {"early": (0, 3), "mid": (4, 6), "late": (7, 9)}
+
+_AGE_PATTERNS = (
+    # between 25 and 35 / 25-35 / 25 to 35
+    (re.compile(r"\b(?:between\s+)?(\d{2})\s*(?:-|to|and)\s*(\d{2})\b"), "range"),
+    # (early / mid / late) 20s
+    (re.compile(r"\b(?:(early|mid|late)[\s-]+)?(\d)0'?s\b"), "decade"),
+    # under 30 / younger than 30
+    (re.compile(r"\b(?:under|below|younger than|less than)\s+(\d{2})\b"), "max"),
+    # over 40 / older than 40 / 40+
+    (re.compile(r"\b(?:over|above|older than)\s+(\d{2})\b|\b(\d{2})\s*\+"), "min"),
+    # 28 years old / aged 28
+    (re.compile(r"\b(\d{2})\s*(?:years?\s*old|yo|y/o)\b|\baged?\s+(\d{2})\b"), "exact"),
+)
+
+_WORD = re.compile(r"[a-z0-9]+(?:['-][a-z0-9]+)*")
+
+
+def _phrase(text: str) -> Tuple[str, ...]:
+    """把詞彙表中的值切成詞序列"""
+    return tuple(_WORD.findall(text.lower()))
+
+
+def parser_vocabulary(users: List[Dict]) -> Dict[str, Any]:
+    """
+    解析器需要的數據庫詞彙：各字段的不同取值與年齡範圍
+
+    Args:
+        users: 用戶列表
+
+    Returns:
+        {"location" / "hobby" / "occupation" / "gender" / 外觀字段: 取值集合, "age": (最小年齡, 最大年齡)}
+    """
+    vocabulary: Dict[str, Any] = {
+        "location": {user["location"] for user in users},
+        "hobby": {hobby for user in users for hobby in user.get("hobby", [])},
+        "occupation": {user["occupation"] for user in users},
+        "gender": {user["gender"] for user in users},
+        "age": (
+            min((user["age"] for user in users), default=18),
+            max((user["age"] for user in users), default=99),
+        ),
+    }
+    for key in APPEARANCE_KEYS:
+        vocabulary[key] = {
+            (user.get("appearance") or {}).get(key)
+            for user in users
+            if (user.get("appearance") or {}).get(key)
+        }
+    return vocabulary
+
+
+class DescriptionParser:
+    """基於數據庫詞彙表的描述解析器"""
+
+    def __init__(
+        self,
+        users: Optional[List[Dict]] = None,
+        min_confidence: float = DEFAULT_CONFIDENCE,
+        vocabulary: Optional[Dict[str, Any]] = None
+    ):
+        """
+        從數據庫生成詞彙表
+
+        Args:
+            users: 用戶列表
+            min_confidence: 置信度不低於此值時 parse() 的結果標記為 confident
+            vocabulary: 已統計好的詞彙（parser_vocabulary 的格式；提供時不再掃描 users）
+        """
+        self.min_confidence = min_confidence
+
+        if vocabulary is None:
+            vocabulary = parser_vocabulary(users or [])
+        locations = vocabulary["location"]
+        hobbies = vocabulary["hobby"]
+        occupations = vocabulary["occupation"]
+        genders = {gender.lower(): gender for gender in sorted(vocabulary["gender"])}
+        appearance_values = {key: vocabulary[key] for key in APPEARANCE_KEYS}
+
+        # 詞序列 -> (條件鍵, 值)；掃描時取最長匹配
+        phrases: Dict[Tuple[str, ...], Tuple[str, str]] = {}
+
+        for word, gender in GENDER_WORDS.items():
+            if gender in genders:
+                phrases[_phrase(word)] = ("gender", genders[gender])
+
+        for location in locations:
+            phrases[_phrase(location)] = ("location", location)
+        for alias, location in LOCATION_ALIASES.items():
+            if location in locations:
+                phrases[_phrase(alias)] = ("location", location)
+
+        for hobby in hobbies:
+            phrases[_phrase(hobby)] = ("hobby", hobby)
+        for synonym, hobby in HOBBY_SYNONYMS.items():
+            if hobby in hobbies:
+                phrases.setdefault(_phrase(synonym), ("hobby", hobby))
+
+        # 職業：完整名稱，以及結尾的職位詞（engineer / designer / manager ...）
+        for occupation in occupations:
+            words = _phrase(occupation)
+            phrases[words] = ("occupation", occupation)
+            if len(words) > 1:
+                phrases.setdefault(words[-1:], ("occupation", occupation.split()[-1]))
+                phrases.setdefault((words[-1] + "s",), ("occupation", occupation.split()[-1]))
+        for synonym, occupation in OCCUPATION_SYNONYMS.items():
+            if any(occupation.lower() in existing.lower() for existing in occupations):
+                phrases.setdefault(_phrase(synonym), ("occupation", occupation))
+
+        # 風格與髮型不會和其他詞衝突，直接放進詞組表
+        for word, style in STYLES.items():
+            if style in appearance_values["style"]:
+                phrases[(word, "style")] = ("style", style)
+                phrases[(word, "styled")] = ("style", style)
+                if word != "real":
+                    # 單獨的 "real" 太常見（a real gentleman），必須跟著 style 才算
+                    phrases.setdefault((word,), ("style", style))
+        for hairstyle in HAIRSTYLES:
+            if hairstyle in appearance_values["hairstyle"]:
+                phrases[_phrase(hairstyle)] = ("hairstyle", hairstyle)
+
+        self._phrases = phrases
+        self._max_phrase = max((len(p) for p in phrases), default=1)
+        self._hair_colors = {
+            word: color for word, color in HAIR_COLORS.items() if color in appearance_values["hair_color"]
+        }
+        self._eye_colors = {
+            word: ("gray" if word == "grey" else word)
+            for word in EYE_COLORS
+            if ("gray" if word == "grey" else word) in appearance_values["eye_color"]
+        }
+        self._hair_lengths = {
+            words: length for words, length in HAIR_LENGTH_WORDS.items() if length in appearance_values["hair_length"]
+        }
+        self._age_bounds = tuple(vocabulary["age"])
+
+    def parse(self, description: str) -> Dict[str, Any]:
+        """
+        解析自由描述
+
+        Args:
+            description: 用戶描述
+
+        Returns:
+            {"criteria": 結構化條件, "confidence": 0~1, "confident": 是否可跳過 Gemini,
+             "unmatched": 未識別的詞}
+        """
+        text = description.lower()
+        tokens = [(m.group(), m.start(), m.end()) for m in _WORD.finditer(text)]
+        words = [token for token, _, _ in tokens]
+        consumed = [False] * len(words)
+        criteria: Dict[str, Any] = {}
+        conflicts = 0
+
+        def assign(key: str, value: Any):
+            nonlocal conflicts
+            if key == "hobby":
+                hobbies = criteria.setdefault("hobby", [])
+                if value not in hobbies:
+                    hobbies.append(value)
+            elif key in criteria and criteria[key] != value:
+                # 單值條件出現兩個不同的值（如 "man or woman"），無法用交集表達
+                conflicts += 1
+            else:
+                criteria[key] = value
+
+        # 年齡：先在原文上匹配，覆蓋到的詞標記為已識別
+        for key, value, start, end in self._parse_ages(text):
+            assign(key, value)
+            for i, (_, token_start, token_end) in enumerate(tokens):
+                if token_start >= start and token_end <= end:
+                    consumed[i] = True
+
+        i = 0
+        while i < len(words):
+            if consumed[i]:
+                i += 1
+                continue
+            matched = self._match_appearance(words, i) or self._match_phrase(words, i)
+            if matched:
+                length, key, value = matched
+                assign(key, value)
+                for j in range(i, i + length):
+                    consumed[j] = True
+                i += length
+            else:
+                i += 1
+
+        content = [
+            (word, used) for word, used in zip(words, consumed)
+            if used or (word not in STOPWORDS and not word.isdigit())
+        ]
+        unmatched = [word for word, used in content if not used]
+        negated = any(word in NEGATIONS for word in words)
+
+        if not content or conflicts or negated or not criteria:
+            confidence = 0.0
+        else:
+            confidence = round(1 - len(unmatched) / len(content), 4)
+
+        return {
+            "criteria": criteria,
+            "confidence": confidence,
+            "confident": confidence >= self.min_confidence,
+            "unmatched": unmatched,
+        }
+
+    def _match_phrase(self, words: List[str], i: int) -> Optional[Tuple[int, str, str]]:
+        """從位置 i 開始取詞組表中的最長匹配"""
+        for length in range(min(self._max_phrase, len(words) - i), 0, -1):
+            entry = self._phrases.get(tuple(words[i:i + length]))
+            if entry:
+                return length, entry[0], entry[1]
+        return None
+
+    def _match_appearance(self, words: List[str], i: int) -> Optional[Tuple[int, str, str]]:
+        """髮色、瞳色、發長依賴上下文（後面是 hair 還是 eyes）"""
+        word = words[i]
+        following = words[i + 1] if i + 1 < len(words) else ""
+
+        # blue eyes / blue-eyed
+        if following in EYE_NOUNS and word in self._eye_colors:
+            return 2, "eye_color", self._eye_colors[word]
+        if word.endswith("-eyed") and word[:-5] in self._eye_colors:
+            return 1, "eye_color", self._eye_colors[word[:-5]]
+
+        # long hair / long wavy red hair / short-haired
+        for length_words, length in self._hair_lengths.items():
+            n = len(length_words)
+            if tuple(words[i:i + n]) == length_words and any(
+                noun in words[i + n:i + n + 3] for noun in HAIR_NOUNS
+            ):
+                return n, "hair_length", length
+        if word.endswith("-haired") and (word[:-7],) in self._hair_lengths:
+            return 1, "hair_length", self._hair_lengths[(word[:-7],)]
+
+        # blonde / red-haired（後面不是 eyes）
+        if word in self._hair_colors:
+            return 1, "hair_color", self._hair_colors[word]
+        if word.endswith("-haired") and word[:-7] in self._hair_colors:
+            return 1, "hair_color", self._hair_colors[word[:-7]]
+        return None
+
+    def _parse_ages(self, text: str) -> List[Tuple[str, int, int, int]]:
+        """
+        提取年齡條件
+
+        Returns:
+            [(age_min / age_max, 值, 原文起點, 原文終點)]
+        """
+        low, high = self._age_bounds
+        found: List[Tuple[str, int, int, int]] = []
+        taken: List[Tuple[int, int]] = []
+
+        for pattern, kind in _AGE_PATTERNS:
+            for match in pattern.finditer(text):
+                start, end = match.span()
+                if any(start < t_end and end > t_start for t_start, t_end in taken):
+                    continue
+                if kind == "range":
+                    a, b = sorted(int(g) for g in match.groups())
+                    if not (low - 10 <= a and b <= high + 10):
+                        continue
+                    bounds = [("age_min", a), ("age_max", b)]
+                elif kind == "decade":
+                    decade = int(match.group(2)) * 10
+                    first, last = DECADE_PARTS.get(match.group(1), (0, 9))
+                    bounds = [("age_min", decade + first), ("age_max", decade + last)]
+                elif kind == "max":
+                    bounds = [("age_max", int(match.group(1)) - 1)]
+                elif kind == "min":
+                    value = match.group(1) or match.group(2)
+                    bounds = [("age_min", int(value) + (1 if match.group(1) else 0))]
+                else:
+                    value = int(match.group(1) or match.group(2))
+                    bounds = [("age_min", value), ("age_max", value)]
+                taken.append((start, end))
+                found.extend((key, value, start, end) for key, value in bounds)
+        return found
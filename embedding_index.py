@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+用戶資料的語義向量索引
+為每個用戶的資料文本生成向量（Gemini 嵌入端點，或本地特征哈希替身），保存到磁盤；
+數據庫變更時只重新嵌入新增或資料有變化的用戶。
+描述搜索時用 NumPy 矩陣乘法暴力檢索，或在大數據庫上用 IVF（k-means 分桶）近似檢索，
+毫秒級召回語義最接近的幾百個候選
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import zlib
+from typing import List, Dict, Any, Optional, FrozenSet
+
+import requests
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 為可選依賴，只有啟用語義召回時才需要
+    np = None
+
+
+# 參與嵌入的外觀字段（與關鍵詞索引一致）
+APPEARANCE_TEXT_FIELDS = ("style", "hair_length", "hair_color", "hairstyle", "eye_color")
+
+# Gemini batchEmbedContents 單次請求的條數上限
+GEMINI_EMBED_BATCH = 100
+
+
+def profile_text(user: Dict) -> str:
+    """
+    用戶資料的嵌入文本（不含名字與頭像等與匹配無關的字段）
+
+    Args:
+        user: 用戶資料
+
+    Returns:
+        一段英文描述
+    """
+    parts = [
+        f"{user.get('age', '')} year old {user.get('gender', '')}".strip(),
+        f"{user.get('occupation', '')} in {user.get('location', '')}",
+    ]
+    if user.get("hobby"):
+        parts.append("hobbies: " + ", ".join(user["hobby"]))
+    appearance = user.get("appearance") or {}
+    looks = [appearance.get(field) for field in APPEARANCE_TEXT_FIELDS if appearance.get(field)]
+    if looks:
+        parts.append("looks: " + ", ".join(looks))
+    if appearance.get("tags"):
+        parts.append("vibe: " + ", ".join(appearance["tags"]))
+    return "; ".join(parts)
+
+
+def _fingerprint(text: str) -> str:
+    """嵌入文本的摘要，用於判斷用戶資料是否變化"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _normalize(vectors: "np.ndarray") -> "np.ndarray":
+    """按行做 L2 歸一化，之後內積即餘弦相似度"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+class HashingEmbedder:
+    """本地替身嵌入器：詞與字符三元組的特征哈希（確定性、無需網絡，用於測試與離線環境）"""
+
+    def __init__(self, dim: int = 256):
+        """
+        初始化嵌入器
+
+        Args:
+            dim: 向量維度
+        """
+        if np is None:
+            raise ImportError("語義召回需要 NumPy，請先執行 pip install numpy")
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _vector(self, text: str) -> "np.ndarray":
+        """單段文本的哈希向量（詞權重 1，字符三元組權重 0.5，讓 hike / hiking 也能相近）"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            features = [(word, 1.0)]
+            padded = f"#{word}#"
+            features.extend((padded[i:i + 3], 0.5) for i in range(len(padded) - 2))
+            for feature, weight in features:
+                # crc32 不受 PYTHONHASHSEED 影響，向量可以跨進程保存
+                h = zlib.crc32(feature.encode("utf-8"))
+                vector[h % self.dim] += weight if h & 0x80000000 else -weight
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> "np.ndarray":
+        """嵌入用戶資料文本，返回 (n, dim) 的歸一化矩陣"""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return _normalize(np.stack([self._vector(text) for text in texts]))
+
+    def embed_query(self, text: str, deadline=None) -> "np.ndarray":
+        """嵌入查詢描述，返回歸一化向量（deadline 僅為與 GeminiEmbedder 接口一致）"""
+        return _normalize(self._vector(text))
+
+
+class GeminiEmbedder:
+    """通過 GeminiClient 調用嵌入端點"""
+
+    def __init__(self, client, model: str = "text-embedding-004", batch_size: int = GEMINI_EMBED_BATCH):
+        """
+        初始化嵌入器
+
+        Args:
+            client: GeminiClient 實例
+            model: 嵌入模型名稱
+            batch_size: 每次請求嵌入的文本數（不超過 100）
+        """
+        if np is None:
+            raise ImportError("語義召回需要 NumPy，請先執行 pip install numpy")
+        self.client = client
+        self.model = model
+        self.batch_size = max(1, min(batch_size, GEMINI_EMBED_BATCH))
+        self.name = f"gemini-{model}"
+
+    def _embed(self, texts: List[str], task_type: str, deadline=None) -> "np.ndarray":
+        """分批請求嵌入，任一批失敗時拋出 RequestException"""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            response = self.client.embed_texts(batch, model=self.model, task_type=task_type, deadline=deadline)
+            if "error" in response:
+                raise requests.exceptions.RequestException(response["error"])
+            embeddings = response.get("embeddings", [])
+            if len(embeddings) != len(batch):
+                raise requests.exceptions.RequestException(
+                    f"嵌入結果數量不符: 請求 {len(batch)} 條，返回 {len(embeddings)} 條"
+                )
+            vectors.extend(item["values"] for item in embeddings)
+        return _normalize(np.asarray(vectors, dtype=np.float32))
+
+    def embed_documents(self, texts: List[str]) -> "np.ndarray":
+        """嵌入用戶資料文本，返回 (n, dim) 的歸一化矩陣"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._embed(texts, "RETRIEVAL_DOCUMENT")
+
+    def embed_query(self, text: str, deadline=None) -> "np.ndarray":
+        """嵌入查詢描述，返回歸一化向量"""
+        return self._embed([text], "RETRIEVAL_QUERY", deadline=deadline)[0]
+
+
+class EmbeddingIndex:
+    """用戶資料向量索引（行號與最近一次 sync 的用戶位置一一對應）"""
+
+    def __init__(self, embedder, path: Optional[str] = None, nlist: int = 0, nprobe: int = 8):
+        """
+        初始化索引
+
+        Args:
+            embedder: 嵌入器（HashingEmbedder / GeminiEmbedder）
+            path: 向量保存路徑（.npz，None=只保存在內存）
+            nlist: IVF 分桶數（0=暴力檢索；用戶數不到 nlist 的 8 倍時也使用暴力檢索）
+            nprobe: IVF 檢索時探查的桶數
+        """
+        if np is None:
+            raise ImportError("語義召回需要 NumPy，請先執行 pip install numpy")
+        self.embedder = embedder
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+
+        self._ids: List[str] = []
+        self._fingerprints: List[str] = []
+        self._vectors: Optional["np.ndarray"] = None
+        self._centroids: Optional["np.ndarray"] = None
+        self._lists: List["np.ndarray"] = []
+        self._lock = threading.Lock()
+
+        self.embedded = 0
+        self.reused = 0
+
+        if path and os.path.exists(path):
+            self._load()
+
+    @property
+    def size(self) -> int:
+        """索引中的用戶數"""
+        return len(self._ids)
+
+    def sync(self, users: List[Dict]) -> int:
+        """
+        讓索引與用戶列表一致：只嵌入新增或資料變化的用戶，刪除已不存在的用戶
+
+        Args:
+            users: 當前的用戶列表（行號將與列表位置對應）
+
+        Returns:
+            本次新嵌入的用戶數
+        """
+        ids = [str(user["id"]) for user in users]
+        texts = [profile_text(user) for user in users]
+        fingerprints = [_fingerprint(text) for text in texts]
+
+        known = {user_id: row for row, user_id in enumerate(self._ids)}
+        keep_positions, keep_rows, missing = [], [], []
+        for pos, (user_id, fingerprint) in enumerate(zip(ids, fingerprints)):
+            row = known.get(user_id)
+            if row is not None and self._fingerprints[row] == fingerprint:
+                keep_positions.append(pos)
+                keep_rows.append(row)
+            else:
+                missing.append(pos)
+
+        if not missing and ids == self._ids:
+            if self._centroids is None and self.nlist > 0 and self._vectors is not None:
+                # 從磁盤載入的向量沒有分桶信息
+                centroids, lists = self._train_ivf(self._vectors)
+                with self._lock:
+                    self._centroids, self._lists = centroids, lists
+            return 0
+
+        if missing:
+            new_vectors = self.embedder.embed_documents([texts[pos] for pos in missing])
+            dim = new_vectors.shape[1]
+        else:
+            dim = self._vectors.shape[1] if self._vectors is not None else 0
+        vectors = np.empty((len(users), dim), dtype=np.float32)
+        if keep_rows:
+            vectors[keep_positions] = self._vectors[keep_rows]
+        if missing:
+            vectors[missing] = new_vectors
+
+        centroids, lists = self._train_ivf(vectors)
+        with self._lock:
+            self._ids = ids
+            self._fingerprints = fingerprints
+            self._vectors = vectors
+            self._centroids = centroids
+            self._lists = lists
+            self.embedded += len(missing)
+            self.reused += len(keep_rows)
+
+        print(f"🧭 語義索引: 新嵌入 {len(missing)} 個用戶，復用 {len(keep_rows)} 個向量")
+        if self.path:
+            self._save()
+        return len(missing)
+
+    def frozen(self) -> "EmbeddingIndex":
+        """
+        當前內容的只讀視圖（共享向量數組，不複製）
+        sync 總是建立新數組再整體替換，所以視圖的行號始終與同步時的用戶列表對應
+
+        Returns:
+            不保存到磁盤的索引副本
+        """
+        view = EmbeddingIndex(self.embedder, path=None, nlist=self.nlist, nprobe=self.nprobe)
+        with self._lock:
+            view._ids = self._ids
+            view._fingerprints = self._fingerprints
+            view._vectors = self._vectors
+            view._centroids = self._centroids
+            view._lists = self._lists
+        return view
+
+    def search(
+        self,
+        text: str,
+        limit: int,
+        within: Optional[FrozenSet[int]] = None,
+        deadline=None
+    ) -> List[int]:
+        """
+        語義召回：按描述與用戶資料向量的餘弦相似度排序
+
+        Args:
+            text: 自由描述
+            limit: 最多返回的用戶數
+            within: 只在這些位置中召回（例如性別硬過濾後的集合）
+            deadline: 查詢嵌入的截止時間（GeminiEmbedder 才會用到）
+
+        Returns:
+            用戶位置列表（相似度高的在前）
+
+        Raises:
+            requests.exceptions.RequestException: 查詢嵌入失敗
+        """
+        with self._lock:
+            vectors, centroids, lists = self._vectors, self._centroids, self._lists
+        if vectors is None or len(vectors) == 0 or limit <= 0:
+            return []
+
+        query = self.embedder.embed_query(text, deadline=deadline)
+        allowed = None if within is None else np.fromiter(sorted(within), dtype=np.int64, count=len(within))
+
+        rows = None
+        if centroids is not None:
+            probes = np.argsort(-(centroids @ query))[:self.nprobe]
+            rows = np.sort(np.concatenate([lists[c] for c in probes]))
+            if allowed is not None:
+                rows = np.intersect1d(rows, allowed, assume_unique=True)
+            if len(rows) < limit:
+                # 探查的桶裡候選不足，退回暴力檢索
+                rows = None
+        if rows is None:
+            rows = allowed if allowed is not None else np.arange(len(vectors))
+
+        if len(rows) == 0:
+            return []
+        scores = vectors[rows] @ query
+        if len(rows) > limit:
+            top = np.argpartition(-scores, limit - 1)[:limit]
+        else:
+            top = np.arange(len(rows))
+        # 相似度相同時按位置排序，結果穩定
+        order = np.lexsort((rows[top], -scores[top]))
+        return [int(rows[top[i]]) for i in order]
+
+    def _train_ivf(self, vectors: "np.ndarray"):
+        """
+        球面 k-means 分桶（用戶數太少時不分桶）
+
+        Returns:
+            (桶中心矩陣或 None, 每個桶的行號數組)
+        """
+        if self.nlist <= 0 or len(vectors) < self.nlist * 8:
+            return None, []
+
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(len(vectors), self.nlist, replace=False)].copy()
+        for _ in range(10):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            counts = np.bincount(assignments, minlength=self.nlist)
+            # 空桶保留原中心
+            nonempty = counts > 0
+            centroids[nonempty] = _normalize(sums[nonempty])
+
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        lists = [np.flatnonzero(assignments == c) for c in range(self.nlist)]
+        return centroids, lists
+
+    def _save(self):
+        """原子寫入磁盤（先寫臨時文件再替換，避免多個 worker 讀到半個文件）"""
+        with self._lock:
+            ids, fingerprints, vectors = self._ids, self._fingerprints, self._vectors
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    signature=np.array([self.embedder.name]),
+                    ids=np.array(ids, dtype=str),
+                    fingerprints=np.array(fingerprints, dtype=str),
+                    vectors=vectors,
+                )
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️  無法保存語義索引: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _load(self):
+        """從磁盤載入向量（嵌入器不同或文件損壞時忽略，下次 sync 全量重建）"""
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data["signature"][0]) != self.embedder.name:
+                    print(f"⚠️  語義索引由其他嵌入器生成，將重新嵌入: {self.path}")
+                    return
+                self._ids = [str(user_id) for user_id in data["ids"]]
+                self._fingerprints = [str(fp) for fp in data["fingerprints"]]
+                self._vectors = data["vectors"].astype(np.float32)
+        except (OSError, KeyError, ValueError) as e:
+            print(f"⚠️  無法載入語義索引，將重新嵌入: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """返回索引規模與嵌入次數統計"""
+        with self._lock:
+            return {
+                "embedder": self.embedder.name,
+                "size": len(self._ids),
+                "dim": int(self._vectors.shape[1]) if self._vectors is not None else 0,
+                "ivf_lists": len(self._lists),
+                "embedded": self.embedded,
+                "reused": self.reused,
+                "path": self.path,
+            }
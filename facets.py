@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+分面計數
+在位圖索引上回答「在這些已選條件下，每個地區 / 職業 / 興趣還有多少用戶」：
+每個分面先求除去自身條件以外的條件位圖，再與每個取值的位圖做一次 & + popcount；
+不帶條件的計數在建立快照時算好，/api/options 直接返回；
+SQLite 快照沒有內存位圖，SQLiteFacets 用每個分面一條 GROUP BY 查詢得到相同的結果
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from bitset_index import BitsetIndex, popcount
+from user_index import APPEARANCE_TERM_FIELDS
+
+
+# 分面名稱 -> 位圖字段；分面名稱與推薦條件的鍵一致
+FACET_FIELDS = ("location", "occupation", "hobby", "gender") + APPEARANCE_TERM_FIELDS
+
+# /api/options 兼容的列表字段
+OPTION_LISTS = {"locations": "location", "occupations": "occupation", "hobbies": "hobby"}
+
+
+def _active_criteria(criteria: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """參與分面過濾的條件（忽略空值與 description）"""
+    return {
+        k: v for k, v in (criteria or {}).items()
+        if v is not None and v != "" and v != [] and k != "description"
+    }
+
+
+class FacetEngine:
+    """基於位圖索引的分面計數"""
+
+    def __init__(self, bitsets: BitsetIndex, fields: Tuple[str, ...] = FACET_FIELDS):
+        """
+        預先計算不帶條件的計數
+
+        Args:
+            bitsets: 當前快照的位圖索引
+            fields: 參與計數的分面
+        """
+        self.bitsets = bitsets
+        self.fields = fields
+        self._totals = {field: self._count(field, bitsets.all) for field in fields}
+
+    def counts(self, criteria: Optional[Dict[str, Any]] = None, fields: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        計算各分面的取值與用戶數
+
+        每個分面不受自身條件限制（選了 location=Miami 時，location 分面仍列出其他地區的數量，
+        方便切換），其他條件正常生效
+
+        Args:
+            criteria: 已選條件（推薦條件格式，description 等非分面條件中只有年齡參與過濾）
+            fields: 只計算這些分面（None=全部）
+
+        Returns:
+            {分面: [{"value": 取值, "count": 用戶數}, ...]}，按用戶數從多到少排列，不含 0
+        """
+        fields = [f for f in (fields or self.fields) if f in self.fields]
+        active = _active_criteria(criteria)
+        if not active:
+            return {field: self._totals[field] for field in fields}
+
+        # 每個條件只查一次位圖，各分面的基礎位圖由它們組合而成
+        masks = {key: self.bitsets.lookup(key, value) for key, value in active.items()}
+        result = {}
+        for field in fields:
+            base = self.bitsets.all
+            for key, mask in masks.items():
+                if key != field:
+                    base &= mask
+            result[field] = self._count(field, base)
+        return result
+
+    def options(self) -> Dict[str, List[str]]:
+        """按名稱排序的地區 / 職業 / 興趣列表（/api/options 原有的字段）"""
+        return {
+            name: sorted(item["value"] for item in self._totals[field])
+            for name, field in OPTION_LISTS.items()
+        }
+
+    def _count(self, field: str, base: int) -> List[Dict[str, Any]]:
+        """單個分面在基礎位圖內的計數"""
+        items = []
+        if base:
+            for value, bits in self.bitsets.values(field).items():
+                count = popcount(bits & base)
+                if count:
+                    items.append({"value": self.bitsets.label(field, value), "count": count})
+        items.sort(key=lambda item: (-item["count"], item["value"]))
+        return items
+
+
+class SQLiteFacets:
+    """SQLite 快照上的分面計數（接口與結果同 FacetEngine；不帶條件的計數在第一次用到時查詢並緩存）"""
+
+    def __init__(self, snapshot, fields: Tuple[str, ...] = FACET_FIELDS):
+        """
+        Args:
+            snapshot: 固定數據版本的 SQLiteSnapshot
+            fields: 參與計數的分面
+        """
+        self.snapshot = snapshot
+        self.fields = fields
+        self._totals: Dict[str, List[Dict[str, Any]]] = {}
+
+    def counts(self, criteria: Optional[Dict[str, Any]] = None, fields: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """計算各分面的取值與用戶數（規則見 FacetEngine.counts）"""
+        fields = [f for f in (fields or self.fields) if f in self.fields]
+        active = _active_criteria(criteria)
+        if not active:
+            return {field: self._total(field) for field in fields}
+        return {
+            field: self._count(field, {k: v for k, v in active.items() if k != field})
+            for field in fields
+        }
+
+    def options(self) -> Dict[str, List[str]]:
+        """按名稱排序的地區 / 職業 / 興趣列表"""
+        return {
+            name: sorted(item["value"] for item in self._total(field))
+            for name, field in OPTION_LISTS.items()
+        }
+
+    def _total(self, field: str) -> List[Dict[str, Any]]:
+        totals = self._totals.get(field)
+        if totals is None:
+            totals = self._totals[field] = self._count(field, {})
+        return totals
+
+    def _count(self, field: str, criteria: Dict[str, Any]) -> List[Dict[str, Any]]:
+        items = [
+            {"value": value, "count": count}
+            for value, count in self.snapshot.facet_counts(field, criteria)
+            if count
+        ]
+        items.sort(key=lambda item: (-item["count"], item["value"]))
+        return items
@@ -6,38 +6,249 @@ Gemini API Client - 通用調用腳本
 
 import os
 import json
+import threading
+import time
 import requests
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Iterator
 from pathlib import Path
 import base64
 from dotenv import load_dotenv
+from response_cache import ResponseCache, DEFAULT_MAX_TEMPERATURE
+from single_flight import SingleFlight
+from gemini_resilience import (
+    Deadline, deadline_timeouts, CircuitBreaker, CircuitOpenError,
+    RetryPolicy, QuotaLimiter, QuotaExceededError, estimate_tokens
+)
 
 # 加載 .env 文件
 load_dotenv()
 
 
+API_HOST = "https://generativelanguage.googleapis.com"
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    獲取進程內共享的 HTTP 會話（keep-alive 連接池，避免每次調用都重新做 TCP+TLS 握手）
+
+    連接池大小由環境變量 GEMINI_POOL_SIZE 配置（默認 10）
+
+    Returns:
+        共享的 requests.Session
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = int(os.getenv('GEMINI_POOL_SIZE', 10))
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=pool_size
+                )
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def warm_up_session(connections: int = 1, timeout: float = 5) -> bool:
+    """
+    預熱連接池：提前與 Gemini API 建立連接，讓第一個真實請求不用等握手
+
+    Args:
+        connections: 預先建立的連接數
+        timeout: 每個預熱請求的超時（秒）
+
+    Returns:
+        是否全部預熱成功
+    """
+    session = get_session()
+
+    def _touch():
+        try:
+            # 只為建立連接，響應狀態碼無關緊要
+            session.head(API_HOST, timeout=timeout)
+            return True
+        except requests.exceptions.RequestException:
+            return False
+
+    if connections <= 1:
+        return _touch()
+
+    # 並發發起，連接池才會保留多個連接
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(_touch())) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return all(results)
+
+
+_response_caches: Dict[str, ResponseCache] = {}
+_response_caches_lock = threading.Lock()
+
+
+def _shared_response_cache(path: str) -> ResponseCache:
+    """同一進程中相同路徑的客戶端共用一個緩存連接"""
+    with _response_caches_lock:
+        if path not in _response_caches:
+            _response_caches[path] = ResponseCache(path)
+        return _response_caches[path]
+
+
+_breaker: Optional[CircuitBreaker] = None
+_breaker_lock = threading.Lock()
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """
+    獲取進程內共享的熔斷器（所有客戶端共用同一份 Gemini 健康狀態）
+
+    參數由環境變量配置：GEMINI_BREAKER_FAILURE_RATE（0.5）、GEMINI_BREAKER_MIN_CALLS（5）、
+    GEMINI_BREAKER_WINDOW（30 秒）、GEMINI_BREAKER_SLOW_CALL（10 秒）、GEMINI_BREAKER_OPEN_SECONDS（15 秒）
+
+    Returns:
+        共享的 CircuitBreaker
+    """
+    global _breaker
+    if _breaker is None:
+        with _breaker_lock:
+            if _breaker is None:
+                _breaker = CircuitBreaker(
+                    failure_rate=float(os.getenv('GEMINI_BREAKER_FAILURE_RATE', 0.5)),
+                    min_calls=int(os.getenv('GEMINI_BREAKER_MIN_CALLS', 5)),
+                    window_seconds=float(os.getenv('GEMINI_BREAKER_WINDOW', 30)),
+                    slow_call_seconds=float(os.getenv('GEMINI_BREAKER_SLOW_CALL', 10)),
+                    open_seconds=float(os.getenv('GEMINI_BREAKER_OPEN_SECONDS', 15))
+                )
+    return _breaker
+
+
+_quota: Optional[QuotaLimiter] = None
+_quota_lock = threading.Lock()
+
+
+def get_quota_limiter() -> QuotaLimiter:
+    """
+    獲取進程內共享的配額令牌桶
+
+    由環境變量配置：GEMINI_RPM（每分鐘請求數）、GEMINI_TPM（每分鐘 token 數），
+    未設置時不限制；GEMINI_QUOTA_MAX_WAIT（默認 10 秒）為排隊上限，超過則丟棄請求。
+    多個 gunicorn worker 時每個進程各有一個令牌桶，配額需按 worker 數平分
+
+    Returns:
+        共享的 QuotaLimiter
+    """
+    global _quota
+    if _quota is None:
+        with _quota_lock:
+            if _quota is None:
+                _quota = QuotaLimiter(
+                    requests_per_minute=int(os.getenv('GEMINI_RPM', 0)),
+                    tokens_per_minute=int(os.getenv('GEMINI_TPM', 0)),
+                    max_wait=float(os.getenv('GEMINI_QUOTA_MAX_WAIT', 10))
+                )
+    return _quota
+
+
+_flights: Optional[SingleFlight] = None
+_flights_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """
+    獲取進程內共享的請求合併器（所有客戶端的相同請求合併為一次調用）
+
+    Returns:
+        共享的 SingleFlight
+    """
+    global _flights
+    if _flights is None:
+        with _flights_lock:
+            if _flights is None:
+                _flights = SingleFlight()
+    return _flights
+
+
+def is_outage(status_code: Optional[int]) -> bool:
+    """
+    判斷一次失敗是否說明 Gemini 服務不可用（網絡錯誤、超時、429、5xx），
+    其他 4xx 是請求本身的問題，不計入熔斷
+
+    Args:
+        status_code: HTTP 狀態碼，網絡錯誤時為 None
+
+    Returns:
+        是否計為服務故障
+    """
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
 class GeminiClient:
     """Gemini API 客戶端"""
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        cache: Optional[ResponseCache] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        retry: Optional[RetryPolicy] = None,
+        quota: Optional[QuotaLimiter] = None,
+        flights: Optional[SingleFlight] = None
+    ):
         """
         初始化 Gemini 客戶端
 
         Args:
             api_key: Gemini API key，如果不提供則從環境變量 GEMINI_API_KEY 讀取
+            cache: 響應持久化緩存；不提供時，若設置了環境變量 GEMINI_CACHE_PATH 則使用該路徑
+            breaker: 熔斷器，默認使用進程內共享的熔斷器
+            retry: 重試策略，默認讀取 GEMINI_MAX_RETRIES / GEMINI_RETRY_BASE_DELAY / GEMINI_RETRY_MAX_DELAY
+            quota: 配額令牌桶，默認使用進程內共享的令牌桶
+            flights: 請求合併器，默認使用進程內共享的合併器；設置 GEMINI_COALESCE=0 時不合併
         """
         self.api_key = api_key or os.getenv('GEMINI_API_KEY')
         if not self.api_key:
             raise ValueError("請提供 API key 或設置環境變量 GEMINI_API_KEY")
 
-        self.base_url = "https://generativelanguage.googleapis.com/v1"
+        self.base_url = f"{API_HOST}/v1"
+
+        # 連接 / 讀取超時（秒），可由環境變量配置
+        self.connect_timeout = float(os.getenv('GEMINI_CONNECT_TIMEOUT', 5))
+        self.read_timeout = float(os.getenv('GEMINI_READ_TIMEOUT', 60))
+
+        if cache is None and os.getenv('GEMINI_CACHE_PATH'):
+            cache = _shared_response_cache(os.getenv('GEMINI_CACHE_PATH'))
+        self.cache = cache
+        # 設置 GEMINI_CACHE_BYPASS=1 可臨時跳過緩存（仍會發送真實請求）
+        self.cache_bypass = os.getenv('GEMINI_CACHE_BYPASS', '').lower() in ('1', 'true', 'yes')
+
+        self.breaker = breaker or get_circuit_breaker()
+        self.retry = retry or RetryPolicy(
+            max_retries=int(os.getenv('GEMINI_MAX_RETRIES', 2)),
+            base_delay=float(os.getenv('GEMINI_RETRY_BASE_DELAY', 0.5)),
+            max_delay=float(os.getenv('GEMINI_RETRY_MAX_DELAY', 8))
+        )
+        self.quota = quota or get_quota_limiter()
+        if flights is None and os.getenv('GEMINI_COALESCE', '1').lower() in ('1', 'true', 'yes'):
+            flights = get_single_flight()
+        self.flights = flights
 
     def generate_text(
         self,
         prompt: str,
         model: str = "gemini-2.0-flash-001",
         temperature: float = 0.7,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        use_cache: bool = True,
+        deadline: Optional[Deadline] = None,
+        response_mime_type: Optional[str] = None,
+        response_schema: Optional[Dict[str, Any]] = None,
+        coalesce: bool = True
     ) -> Dict[str, Any]:
         """
         生成文本
@@ -47,31 +258,137 @@ class GeminiClient:
             model: 模型名稱，默認 gemini-pro
             temperature: 溫度參數 (0.0-1.0)
             max_tokens: 最大生成 token 數
+            use_cache: 是否允許使用響應緩存
+            deadline: 端到端截止時間，HTTP 超時不會超過剩餘時間
+            response_mime_type: 輸出格式，如 "application/json"
+            response_schema: 輸出的 JSON Schema（OpenAPI 子集），需配合 response_mime_type="application/json"
+            coalesce: 是否與進行中的相同請求合併（共享同一個響應；需要獨立採樣時傳 False）；
+                      與響應緩存相同，溫度高於 max_temperature 的請求總是獨立採樣
 
         Returns:
-            API 響應結果
+            API 響應結果（合併時與其他調用者共享，只讀）
         """
-        url = f"{self.base_url}/models/{model}:generateContent"
+        url, payload = self._generate_text_request(
+            prompt, model, temperature, max_tokens, response_mime_type, response_schema
+        )
+        max_temperature = self.cache.max_temperature if self.cache is not None else DEFAULT_MAX_TEMPERATURE
+        if self.flights is None or not coalesce or temperature > max_temperature:
+            return self._make_request(url, payload, use_cache=use_cache, deadline=deadline)
+
+        key = json.dumps([url, payload, use_cache], sort_keys=True, ensure_ascii=False)
+        # 錯誤響應（包括 leader 自己的截止時間用完）不共享，follower 按自己的截止時間重新請求
+        response, _ = self.flights.do(
+            key,
+            lambda: self._make_request(url, payload, use_cache=use_cache, deadline=deadline),
+            timeout=deadline.remaining() if deadline is not None else None,
+            shareable=lambda result: "error" not in result
+        )
+        return response
+
+    def stream_text(
+        self,
+        prompt: str,
+        model: str = "gemini-2.0-flash-001",
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        deadline: Optional[Deadline] = None,
+        response_mime_type: Optional[str] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """
+        流式生成文本（:streamGenerateContent），每收到一段文本就立即產出
 
-        payload = {
-            "contents": [{
-                "parts": [{"text": prompt}]
-            }],
-            "generationConfig": {
-                "temperature": temperature,
-            }
-        }
+        Args:
+            prompt: 輸入提示詞
+            model: 模型名稱
+            temperature: 溫度參數 (0.0-1.0)
+            max_tokens: 最大生成 token 數
+            deadline: 端到端截止時間，時間用完後停止產出
+            response_mime_type: 輸出格式，如 "application/json"
+            response_schema: 輸出的 JSON Schema
 
-        if max_tokens:
-            payload["generationConfig"]["maxOutputTokens"] = max_tokens
+        Yields:
+            增量文本片段
 
-        return self._make_request(url, payload)
+        Raises:
+            requests.exceptions.RequestException: 請求失敗、熔斷中（CircuitOpenError）、
+                超出本地配額（QuotaExceededError）或開始前截止時間已到時
+        """
+        url, payload = self._generate_text_request(
+            prompt, model, temperature, max_tokens, response_mime_type, response_schema
+        )
+        url = url.replace(":generateContent", ":streamGenerateContent")
+        if deadline is not None and deadline.expired():
+            raise requests.exceptions.Timeout("請求截止時間已到")
+
+        estimated = self._estimate_request_tokens(url, payload)
+        error, wait = self._admit(estimated, deadline)
+        if error is not None:
+            if error.get("circuit_open"):
+                raise CircuitOpenError(error["error"])
+            raise QuotaExceededError(error["error"])
+        if wait:
+            time.sleep(wait)
+
+        timeout = deadline_timeouts(deadline, self.connect_timeout, self.read_timeout)
+        started = time.monotonic()
+        try:
+            response = get_session().post(
+                url,
+                params={"key": self.api_key, "alt": "sse"},
+                headers={"Content-Type": "application/json"},
+                json=payload,
+                timeout=timeout,
+                stream=True
+            )
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            status_code = getattr(e.response, 'status_code', None)
+            if e.response is not None:
+                e.response.close()
+            latency = time.monotonic() - started
+            self._record_outcome(
+                {"error": str(e), "status_code": status_code},
+                latency,
+                self._deadline_limited(timeout, deadline, latency)
+            )
+            self.quota.settle(estimated, 0)
+            raise
+        # 流式請求以收到響應頭的耗時計入熔斷統計
+        self.breaker.record(True, time.monotonic() - started)
+
+        usage = None
+        try:
+            with response:
+                # text/event-stream 沒有聲明 charset 時 requests 會按 ISO-8859-1 解碼
+                response.encoding = "utf-8"
+                for line in response.iter_lines(decode_unicode=True):
+                    # SSE 格式：每個事件是一行 "data: {...}"
+                    if not line or not line.startswith("data:"):
+                        continue
+                    try:
+                        chunk = json.loads(line[len("data:"):].strip())
+                    except ValueError:
+                        continue
+                    usage = chunk.get("usageMetadata", usage)
+                    candidates = chunk.get("candidates") or [{}]
+                    parts = candidates[0].get("content", {}).get("parts", [])
+                    text = "".join(part.get("text", "") for part in parts)
+                    if text:
+                        yield text
+                    if deadline is not None and deadline.expired():
+                        break
+        finally:
+            # 調用方提前停止迭代、截止時間已到或中途出錯時同樣結算：
+            # 按已收到的用量修正，一次用量都沒收到時按估算值計
+            self.quota.settle(estimated, usage.get("totalTokenCount", estimated) if usage else estimated)
 
     def chat(
         self,
         messages: List[Dict[str, str]],
         model: str = "gemini-2.0-flash-001",
-        temperature: float = 0.7
+        temperature: float = 0.7,
+        use_cache: bool = True
     ) -> Dict[str, Any]:
         """
         對話功能
@@ -80,10 +397,121 @@ class GeminiClient:
             messages: 對話歷史，格式：[{"role": "user", "content": "..."}, ...]
             model: 模型名稱
             temperature: 溫度參數
+            use_cache: 是否允許使用響應緩存
 
         Returns:
             API 響應結果
         """
+        url, payload = self._chat_request(messages, model, temperature)
+        return self._make_request(url, payload, use_cache=use_cache)
+
+    def analyze_image(
+        self,
+        image_path: str,
+        prompt: str = "描述這張圖片",
+        model: str = "gemini-2.0-flash-001",
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        圖像分析
+
+        Args:
+            image_path: 圖片文件路徑
+            prompt: 分析提示詞
+            model: 模型名稱，默認 gemini-pro-vision
+            use_cache: 是否允許使用響應緩存
+
+        Returns:
+            API 響應結果
+        """
+        url, payload = self._analyze_image_request(image_path, prompt, model)
+        return self._make_request(url, payload, use_cache=use_cache)
+
+    def count_tokens(
+        self,
+        text: str,
+        model: str = "gemini-2.0-flash-001",
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        計算 token 數量
+
+        Args:
+            text: 要計算的文本
+            model: 模型名稱
+            use_cache: 是否允許使用響應緩存
+
+        Returns:
+            Token 計數結果
+        """
+        url, payload = self._count_tokens_request(text, model)
+        return self._make_request(url, payload, use_cache=use_cache)
+
+    def embed_texts(
+        self,
+        texts: List[str],
+        model: str = "text-embedding-004",
+        task_type: Optional[str] = None,
+        use_cache: bool = True,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
+        """
+        批量生成文本向量（:batchEmbedContents，一次最多 100 條）
+
+        Args:
+            texts: 要嵌入的文本列表
+            model: 嵌入模型名稱
+            task_type: 任務類型，如 RETRIEVAL_DOCUMENT（建庫）/ RETRIEVAL_QUERY（查詢）
+            use_cache: 是否允許使用響應緩存（嵌入結果是確定的，可以安全復用）
+            deadline: 端到端截止時間
+
+        Returns:
+            API 響應結果，向量在 response["embeddings"][i]["values"]
+        """
+        url, payload = self._embed_request(texts, model, task_type)
+        return self._make_request(url, payload, use_cache=use_cache, deadline=deadline)
+
+    # ------------------------------------------------------------------
+    # 請求構建（同步與異步客戶端共用）
+    # ------------------------------------------------------------------
+
+    def _generate_text_request(
+        self,
+        prompt: str,
+        model: str,
+        temperature: float,
+        max_tokens: Optional[int],
+        response_mime_type: Optional[str] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """構建文本生成請求的 URL 與負載"""
+        url = f"{self.base_url}/models/{model}:generateContent"
+
+        payload = {
+            "contents": [{
+                "parts": [{"text": prompt}]
+            }],
+            "generationConfig": {
+                "temperature": temperature,
+            }
+        }
+
+        if max_tokens:
+            payload["generationConfig"]["maxOutputTokens"] = max_tokens
+        if response_mime_type:
+            payload["generationConfig"]["responseMimeType"] = response_mime_type
+        if response_schema:
+            payload["generationConfig"]["responseSchema"] = response_schema
+
+        return url, payload
+
+    def _chat_request(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float
+    ) -> Tuple[str, Dict[str, Any]]:
+        """構建對話請求的 URL 與負載"""
         url = f"{self.base_url}/models/{model}:generateContent"
 
         # 轉換消息格式為 Gemini 格式
@@ -102,25 +530,15 @@ class GeminiClient:
             }
         }
 
-        return self._make_request(url, payload)
+        return url, payload
 
-    def analyze_image(
+    def _analyze_image_request(
         self,
         image_path: str,
-        prompt: str = "描述這張圖片",
-        model: str = "gemini-2.0-flash-001"
-    ) -> Dict[str, Any]:
-        """
-        圖像分析
-
-        Args:
-            image_path: 圖片文件路徑
-            prompt: 分析提示詞
-            model: 模型名稱，默認 gemini-pro-vision
-
-        Returns:
-            API 響應結果
-        """
+        prompt: str,
+        model: str
+    ) -> Tuple[str, Dict[str, Any]]:
+        """構建圖像分析請求的 URL 與負載（會讀取圖片文件）"""
         url = f"{self.base_url}/models/{model}:generateContent"
 
         # 讀取並編碼圖片
@@ -144,19 +562,10 @@ class GeminiClient:
             }]
         }
 
-        return self._make_request(url, payload)
+        return url, payload
 
-    def count_tokens(self, text: str, model: str = "gemini-2.0-flash-001") -> Dict[str, Any]:
-        """
-        計算 token 數量
-
-        Args:
-            text: 要計算的文本
-            model: 模型名稱
-
-        Returns:
-            Token 計數結果
-        """
+    def _count_tokens_request(self, text: str, model: str) -> Tuple[str, Dict[str, Any]]:
+        """構建 token 計數請求的 URL 與負載"""
         url = f"{self.base_url}/models/{model}:countTokens"
 
         payload = {
@@ -165,19 +574,239 @@ class GeminiClient:
             }]
         }
 
-        return self._make_request(url, payload)
+        return url, payload
+
+    def _embed_request(
+        self,
+        texts: List[str],
+        model: str,
+        task_type: Optional[str]
+    ) -> Tuple[str, Dict[str, Any]]:
+        """構建批量嵌入請求的 URL 與負載"""
+        url = f"{self.base_url}/models/{model}:batchEmbedContents"
+
+        items = []
+        for text in texts:
+            item = {
+                "model": f"models/{model}",
+                "content": {"parts": [{"text": text}]}
+            }
+            if task_type:
+                item["taskType"] = task_type
+            items.append(item)
 
-    def _make_request(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return url, {"requests": items}
+
+    def _make_request(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        use_cache: bool = True,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
         """
-        發送 API 請求
+        發送 API 請求（命中響應緩存時不發送網絡請求）
 
         Args:
             url: 請求 URL
             payload: 請求負載
+            use_cache: 是否允許使用響應緩存
+            deadline: 端到端截止時間；已過期時不發送請求，直接返回錯誤
 
         Returns:
             API 響應
         """
+        cache_entry, cached = self._cache_lookup(url, payload, use_cache)
+        if cached is not None:
+            return cached
+
+        if deadline is not None and deadline.expired():
+            return {
+                "error": "請求截止時間已到",
+                "status_code": None,
+                "response": None
+            }
+
+        estimated = self._estimate_request_tokens(url, payload)
+        attempt = 0
+        while True:
+            error, wait = self._admit(estimated, deadline)
+            if error is not None:
+                return error
+            if wait:
+                time.sleep(wait)
+
+            timeout = deadline_timeouts(deadline, self.connect_timeout, self.read_timeout)
+            started = time.monotonic()
+            result = self._send_request(url, payload, timeout)
+            latency = time.monotonic() - started
+            attempt += 1
+            delay = self._after_attempt(
+                result, latency, estimated, attempt, deadline,
+                deadline_limited=self._deadline_limited(timeout, deadline, latency)
+            )
+            if delay is None:
+                break
+            print(f"🔁 Gemini 請求失敗（{result.get('status_code')}），{delay:.1f} 秒後第 {attempt} 次重試")
+            time.sleep(delay)
+
+        self._cache_store(cache_entry, result)
+        return result
+
+    def _admit(self, estimated: int, deadline: Optional[Deadline]):
+        """
+        發送前的准入檢查：熔斷器放行並預約配額
+
+        Args:
+            estimated: 請求的估算 token 數
+            deadline: 端到端截止時間（排隊時間不會超過剩餘時間）
+
+        Returns:
+            (錯誤 dict 或 None, 需要等待的秒數)
+        """
+        if not self.breaker.allow():
+            return self._circuit_open_error(), 0.0
+
+        max_wait = deadline.remaining() if deadline is not None else None
+        wait = self.quota.reserve(estimated, max_wait)
+        if wait is None:
+            self.breaker.cancel()
+            return {
+                "error": "超出本地配額限制（GEMINI_RPM / GEMINI_TPM），請求已丟棄",
+                "status_code": None,
+                "response": None,
+                "quota_shed": True
+            }, 0.0
+        return None, wait
+
+    def _after_attempt(
+        self,
+        result: Dict[str, Any],
+        latency: float,
+        estimated: int,
+        attempt: int,
+        deadline: Optional[Deadline],
+        deadline_limited: bool = False
+    ) -> Optional[float]:
+        """
+        記錄一次請求的結果，並決定是否重試
+
+        Args:
+            result: 響應或錯誤 dict
+            latency: 請求耗時（不含排隊）
+            estimated: 預約配額時的估算 token 數
+            attempt: 已經發送的次數
+            deadline: 端到端截止時間
+            deadline_limited: 本次調用的超時是否被調用方的截止時間縮短
+
+        Returns:
+            重試前需要等待的秒數；不重試時返回 None
+        """
+        self._record_outcome(result, latency, deadline_limited)
+
+        if "error" in result:
+            # 失敗的請求不消耗 token 配額
+            self.quota.settle(estimated, 0)
+            delay = self.retry.delay(attempt, result.get("status_code"), result.get("retry_after"))
+            if delay is None or (deadline is not None and deadline.remaining() <= delay):
+                return None
+            return delay
+
+        usage = result.get("usageMetadata")
+        if usage:
+            self.quota.settle(estimated, usage.get("totalTokenCount", estimated))
+        return None
+
+    @staticmethod
+    def _estimate_request_tokens(url: str, payload: Dict[str, Any]) -> int:
+        """估算一次請求消耗的 token 數（輸入文本 + 最大輸出；countTokens 不消耗生成配額）"""
+        if url.endswith(":countTokens"):
+            return 0
+        contents = payload.get("contents") or [item["content"] for item in payload.get("requests", [])]
+        tokens = sum(
+            estimate_tokens(part.get("text", ""))
+            for content in contents
+            for part in content.get("parts", [])
+        )
+        return tokens + (payload.get("generationConfig", {}).get("maxOutputTokens") or 0)
+
+    @staticmethod
+    def _circuit_open_error() -> Dict[str, Any]:
+        """熔斷中時返回的錯誤（不發送請求）"""
+        return {
+            "error": "Gemini 暫時不可用（熔斷中）",
+            "status_code": None,
+            "response": None,
+            "circuit_open": True
+        }
+
+    def _deadline_limited(self, timeout: Tuple[float, float], deadline: Optional[Deadline], latency: float) -> bool:
+        """
+        本次調用是否被調用方的截止時間提前截斷
+
+        只有讀取超時被截止時間縮短、截止時間確實已到，且耗時還沒超過熔斷器的慢調用閾值時才算；
+        超過慢調用閾值仍未返回說明 Gemini 本身已經掛起，無論截止時間多短都要記為失敗
+        """
+        return (
+            deadline is not None
+            and timeout[1] < self.read_timeout
+            and deadline.expired()
+            and latency < self.breaker.slow_call_seconds
+        )
+
+    def _record_outcome(self, result: Dict[str, Any], latency: float, deadline_limited: bool = False):
+        """
+        把一次請求的結果與耗時記入熔斷器
+
+        調用方自己的截止時間縮短了超時而導致的網絡錯誤 / 超時不說明 Gemini 有故障，
+        只釋放名額、不計入統計，否則一個帶極短 X-Request-Deadline 的客戶端就能打開熔斷
+        """
+        if "error" in result and result.get("status_code") is None and deadline_limited:
+            self.breaker.cancel()
+            return
+        failed = "error" in result and is_outage(result.get("status_code"))
+        self.breaker.record(not failed, latency)
+
+    def _cache_lookup(self, url: str, payload: Dict[str, Any], use_cache: bool):
+        """
+        查詢響應緩存
+
+        Returns:
+            (寫入緩存所需的 (key, model, endpoint)，不可緩存時為 None；命中的響應或 None)
+        """
+        if self.cache is None or not use_cache or self.cache_bypass:
+            return None, None
+
+        model, endpoint = self._parse_model_endpoint(url)
+        if not self.cache.is_cacheable(endpoint, payload):
+            return None, None
+
+        key = self.cache.make_key(model, endpoint, payload)
+        return (key, model, endpoint), self.cache.get(key)
+
+    def _cache_store(self, cache_entry, result: Dict[str, Any]):
+        """把成功的響應寫入緩存"""
+        if cache_entry is not None and "error" not in result:
+            key, model, endpoint = cache_entry
+            self.cache.put(key, model, endpoint, result)
+
+    def _send_request(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        timeout: Optional[Tuple[float, float]] = None
+    ) -> Dict[str, Any]:
+        """
+        發送 HTTP 請求
+
+        Args:
+            url: 請求 URL
+            payload: 請求負載
+            timeout: (連接超時, 讀取超時)，默認使用客戶端配置
+
+        Returns:
+            API 響應；失敗時返回包含 error 的 dict
+        """
         headers = {
             "Content-Type": "application/json"
         }
@@ -187,12 +816,12 @@ class GeminiClient:
         }
 
         try:
-            response = requests.post(
+            response = get_session().post(
                 url,
                 params=params,
                 headers=headers,
                 json=payload,
-                timeout=60
+                timeout=timeout or (self.connect_timeout, self.read_timeout)
             )
             response.raise_for_status()
             return response.json()
@@ -201,9 +830,17 @@ class GeminiClient:
             return {
                 "error": str(e),
                 "status_code": getattr(e.response, 'status_code', None),
-                "response": getattr(e.response, 'text', None)
+                "response": getattr(e.response, 'text', None),
+                "retry_after": e.response.headers.get("Retry-After") if e.response is not None else None
             }
 
+    @staticmethod
+    def _parse_model_endpoint(url: str):
+        """從 URL（.../models/{model}:{endpoint}）中解析模型名稱與端點"""
+        model_endpoint = url.rsplit("/models/", 1)[-1]
+        model, _, endpoint = model_endpoint.partition(":")
+        return model, endpoint
+
     def _get_mime_type(self, file_path: str) -> str:
         """獲取文件 MIME 類型"""
         extension = Path(file_path).suffix.lower()
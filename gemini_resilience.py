@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Gemini 調用的容錯工具
+Deadline：端到端請求截止時間，從 API 層一路傳到 HTTP 調用，
+把剩餘時間拆成連接與讀取兩個超時，時間用完時調用方直接返回手上最好的結果
+CircuitBreaker：按最近調用的失敗率與慢調用率熔斷，熔斷期間直接走本地降級，
+定期放行探測請求（半開），恢復後自動閉合
+RetryPolicy：對 429 / 5xx 做帶抖動的指數退避重試，遵守 Retry-After
+QuotaLimiter：進程內 RPM / TPM 令牌桶，在觸發 API 配額前排隊或丟棄請求
+"""
+
+import email.utils
+import random
+import threading
+import time
+from collections import deque
+from typing import Optional, Tuple, Dict, Any, Iterable
+
+import requests
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 數：ASCII 約 4 個字符一個 token，其他字符（如中文）約一字一個"""
+    ascii_chars = len(text) if text.isascii() else len(text.encode("ascii", "ignore"))
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+class Deadline:
+    """端到端請求截止時間（基於單調時鐘）"""
+
+    def __init__(self, seconds: float):
+        """
+        初始化截止時間
+
+        Args:
+            seconds: 從現在開始的時間預算（秒）
+        """
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """剩餘時間（秒），已過期時為 0"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """是否已經沒有剩餘時間"""
+        return self.remaining() <= 0
+
+    def timeouts(self, connect: float, read: float) -> Tuple[float, float]:
+        """
+        把剩餘時間換算成 HTTP 請求的 (連接超時, 讀取超時)
+
+        Args:
+            connect: 默認連接超時
+            read: 默認讀取超時
+
+        Returns:
+            不超過剩餘時間的 (connect, read)
+        """
+        remaining = self.remaining()
+        return min(connect, remaining), min(read, remaining)
+
+
+def deadline_timeouts(
+    deadline: Optional[Deadline],
+    connect: float,
+    read: float
+) -> Tuple[float, float]:
+    """
+    計算一次 HTTP 調用的超時（沒有截止時間時使用默認值）
+
+    Args:
+        deadline: 截止時間，可以為 None
+        connect: 默認連接超時
+        read: 默認讀取超時
+
+    Returns:
+        (connect, read)
+    """
+    if deadline is None:
+        return connect, read
+    return deadline.timeouts(connect, read)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """熔斷器打開時拒絕調用（是 RequestException 的子類，調用方按請求失敗處理即可）"""
+
+
+class QuotaExceededError(requests.exceptions.RequestException):
+    """本地配額令牌桶排隊超時，請求被丟棄"""
+
+
+class CircuitBreaker:
+    """
+    基於滑動時間窗口的熔斷器（線程安全）
+
+    closed：正常放行，窗口內調用數達到 min_calls 且失敗率（含慢調用）達到閾值時打開
+    open：直接拒絕，open_seconds 後進入 half_open
+    half_open：只放行一個探測請求，成功則閉合，失敗則重新打開
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        min_calls: int = 5,
+        window_seconds: float = 30,
+        slow_call_seconds: float = 10,
+        open_seconds: float = 15
+    ):
+        """
+        初始化熔斷器
+
+        Args:
+            failure_rate: 打開熔斷的失敗率閾值 (0.0-1.0)
+            min_calls: 窗口內至少有多少次調用才計算失敗率
+            window_seconds: 統計窗口長度（秒）
+            slow_call_seconds: 超過此耗時的成功調用也算作失敗
+            open_seconds: 打開後多久放行探測請求（秒）
+        """
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self._probe_in_flight = False
+        # (時間, 是否失敗, 耗時)
+        self._calls: "deque[Tuple[float, bool, float]]" = deque()
+        self._lock = threading.Lock()
+
+        self.rejected = 0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        """
+        判斷是否允許發起調用（允許後調用方必須調用 record）
+
+        Returns:
+            是否允許
+        """
+        with self._lock:
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+
+            if self._state == self.HALF_OPEN:
+                now = time.monotonic()
+                # 探測請求遲遲沒有結果（例如調用方異常退出）時允許重新探測
+                if self._probe_in_flight and now - self._probe_started < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self._probe_in_flight = True
+                self._probe_started = now
+
+            return True
+
+    def record(self, success: bool, latency: float):
+        """
+        記錄一次調用結果
+
+        Args:
+            success: 調用是否成功
+            latency: 調用耗時（秒）
+        """
+        failed = not success or latency > self.slow_call_seconds
+        now = time.monotonic()
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probe_in_flight = False
+                if failed:
+                    self._open(now)
+                else:
+                    self._state = self.CLOSED
+                    self._calls.clear()
+                    self._calls.append((now, False, latency))
+                return
+
+            self._calls.append((now, failed, latency))
+            self._trim(now)
+            if self._state == self.CLOSED and len(self._calls) >= self.min_calls:
+                failures = sum(1 for _, f, _ in self._calls if f)
+                if failures / len(self._calls) >= self.failure_rate:
+                    self._open(now)
+
+    def cancel(self):
+        """allow 之後沒有真正發出請求時調用（釋放半開狀態的探測名額，不計入統計）"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def _open(self, now: float):
+        """打開熔斷（調用方持有鎖）"""
+        self._state = self.OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self.times_opened += 1
+
+    def _trim(self, now: float):
+        """丟棄窗口外的記錄（調用方持有鎖）"""
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
+
+    @property
+    def state(self) -> str:
+        """當前狀態（open 已到期時報告為 half_open）"""
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def stats(self) -> Dict[str, Any]:
+        """返回熔斷器狀態與窗口統計"""
+        state = self.state
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = len(self._calls)
+            failures = sum(1 for _, f, _ in self._calls if f)
+            latency = sum(l for _, _, l in self._calls) / calls if calls else 0.0
+            retry_in = 0.0
+            if self._state == self.OPEN:
+                retry_in = max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+            return {
+                "state": state,
+                "window_calls": calls,
+                "failure_rate": round(failures / calls, 4) if calls else 0.0,
+                "avg_latency_seconds": round(latency, 3),
+                "rejected": self.rejected,
+                "times_opened": self.times_opened,
+                "retry_in_seconds": round(retry_in, 1),
+            }
+
+
+# 值得重試的 HTTP 狀態碼：配額限流與服務端臨時故障
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析 Retry-After 響應頭（秒數或 HTTP 日期）
+
+    Args:
+        value: 響應頭的值
+
+    Returns:
+        需要等待的秒數，無法解析時返回 None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """帶抖動的指數退避重試策略"""
+
+    def __init__(
+        self,
+        max_retries: int = 2,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        statuses: Iterable[int] = RETRY_STATUSES
+    ):
+        """
+        初始化重試策略
+
+        Args:
+            max_retries: 最多重試次數（不含第一次請求）
+            base_delay: 第一次重試的退避上限（秒），之後每次翻倍
+            max_delay: 單次等待上限（秒）；Retry-After 要求更久時放棄重試
+            statuses: 允許重試的 HTTP 狀態碼
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.statuses = set(statuses)
+
+    def delay(self, attempt: int, status_code: Optional[int], retry_after: Optional[str] = None) -> Optional[float]:
+        """
+        計算第 attempt 次失敗後的等待時間
+
+        Args:
+            attempt: 已經失敗的次數（從 1 開始）
+            status_code: 本次失敗的 HTTP 狀態碼
+            retry_after: 響應中的 Retry-After 頭
+
+        Returns:
+            等待秒數；不應重試時返回 None
+        """
+        if attempt > self.max_retries or status_code not in self.statuses:
+            return None
+
+        # full jitter：在 [0, 指數上限] 內隨機，避免大量客戶端同時重試
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        server_delay = parse_retry_after(retry_after)
+        if server_delay is None:
+            return backoff
+        if server_delay > self.max_delay:
+            return None
+        return server_delay + random.uniform(0, self.base_delay)
+
+
+class QuotaLimiter:
+    """
+    進程內的請求數 / token 數令牌桶（線程安全）
+
+    reserve() 預約配額並返回需要等待的時間（允許透支，後來的請求排在後面），
+    需要等待的時間超過上限時直接丟棄；同步與異步調用方各自決定怎麼等待
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        max_wait: float = 10.0
+    ):
+        """
+        初始化令牌桶
+
+        Args:
+            requests_per_minute: 每分鐘請求數上限（0=不限制）
+            tokens_per_minute: 每分鐘 token 數上限（0=不限制）
+            max_wait: 排隊等待的最長時間（秒），超過則丟棄請求
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait = max_wait
+
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.total_wait = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        """是否配置了任何限制"""
+        return self.requests_per_minute > 0 or self.tokens_per_minute > 0
+
+    def reserve(self, tokens: int, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        預約一次請求的配額
+
+        Args:
+            tokens: 本次請求的估算 token 數
+            max_wait: 本次最多願意等待的時間（秒），與 self.max_wait 取較小值
+
+        Returns:
+            需要等待的秒數（0 表示立即發送）；配額不足且等待超時時返回 None
+        """
+        if not self.enabled:
+            return 0.0
+
+        limit = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        with self._lock:
+            self._refill()
+            wait = 0.0
+            if self.requests_per_minute and self._requests < 1:
+                wait = (1 - self._requests) * 60 / self.requests_per_minute
+            needed = min(tokens, self.tokens_per_minute)
+            if self.tokens_per_minute and self._tokens < needed:
+                wait = max(wait, (needed - self._tokens) * 60 / self.tokens_per_minute)
+
+            if wait > limit:
+                self.shed += 1
+                return None
+
+            if self.requests_per_minute:
+                self._requests -= 1
+            self._tokens -= needed
+            self.admitted += 1
+            if wait > 0:
+                self.queued += 1
+                self.total_wait += wait
+            return wait
+
+    def settle(self, estimated: int, actual: int):
+        """
+        用響應中的實際 token 用量修正預約時的估算
+
+        Args:
+            estimated: 預約時的估算值
+            actual: 實際用量
+        """
+        if not self.tokens_per_minute:
+            return
+        with self._lock:
+            self._tokens = min(self.tokens_per_minute, self._tokens + estimated - actual)
+
+    def _refill(self):
+        """按經過的時間補充令牌（調用方持有鎖）"""
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(
+                self.requests_per_minute,
+                self._requests + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + elapsed * self.tokens_per_minute / 60
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        """返回限流統計"""
+        with self._lock:
+            self._refill()
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "available_requests": round(self._requests, 2),
+                "available_tokens": round(self._tokens),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "shed": self.shed,
+                "avg_wait_seconds": round(self.total_wait / self.queued, 3) if self.queued else 0.0,
+            }
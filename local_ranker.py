@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+本地確定性排序器
+按照 Gemini 排序提示詞中列出的匹配規則（性別硬過濾、外觀、地區、興趣、年齡、職業）
+在本地計算加權分數，用 heap 取 top-N；既可作為不使用 AI 時的完整排序器，
+也可作為 AI 排序前的預排序，限制送進提示詞的候選數量
+"""
+
+import heapq
+import re
+from typing import List, Dict, Any, Optional
+
+
+# 各匹配項的權重（順序與 _build_ranking_prompt 中的重要性一致）
+DEFAULT_WEIGHTS = {
+    "appearance": 3.0,
+    "location": 2.5,
+    "hobby": 2.0,
+    "age": 1.5,
+    "occupation": 1.0,
+}
+
+# 描述中的性別詞 -> 數據庫中的性別值（小寫）
+GENDER_WORDS = {
+    "female": "female", "woman": "female", "women": "female", "girl": "female",
+    "girls": "female", "lady": "female", "ladies": "female",
+    "male": "male", "man": "male", "men": "male", "guy": "male", "guys": "male",
+    "boy": "male", "boys": "male",
+    "non-binary": "non-binary", "nonbinary": "non-binary", "enby": "non-binary",
+}
+
+HAIR_COLORS = {
+    "blonde": "blonde", "blond": "blonde", "brown": "brown", "brunette": "brown",
+    "black": "black", "red": "red", "redhead": "red", "ginger": "red",
+    "gray": "gray", "grey": "gray", "silver": "silver", "pink": "pink",
+    "blue": "blue", "purple": "purple", "white": "white",
+}
+
+EYE_COLORS = ("blue", "green", "gray", "grey", "brown", "hazel", "red", "purple", "amber")
+
+HAIR_LENGTHS = {
+    "very long hair": "very long", "long hair": "long", "medium hair": "medium",
+    "short hair": "short", "buzz cut": "buzz cut", "buzzcut": "buzz cut",
+}
+
+HAIRSTYLES = (
+    "textured", "straight", "slicked back", "spiky", "messy",
+    "braided", "bun", "curly", "wavy", "ponytail",
+)
+
+STYLES = {"anime": "anime", "realistic": "realistic", "real": "realistic"}
+
+# 可直接作為搜索條件的外觀字段（與用戶 appearance 中的字段同名）
+APPEARANCE_KEYS = ("style", "hair_length", "hair_color", "hairstyle", "eye_color")
+
+# 年齡超出範圍時，每相差多少歲分數降為 0
+AGE_FALLOFF_YEARS = 10
+
+
+class LocalRanker:
+    """本地加權排序器"""
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None):
+        """
+        初始化排序器
+
+        Args:
+            weights: 各匹配項的權重，未提供的項使用 DEFAULT_WEIGHTS
+        """
+        self.weights = dict(DEFAULT_WEIGHTS)
+        if weights:
+            self.weights.update(weights)
+
+    def rank(self, users: List[Dict], criteria: Dict[str, Any], top_n: int) -> List[Dict]:
+        """
+        對用戶打分並返回分數最高的 top_n 個
+
+        Args:
+            users: 候選用戶列表
+            criteria: 搜索條件
+            top_n: 返回數量
+
+        Returns:
+            按分數從高到低排列的用戶列表（同分時保持原順序）
+        """
+        query = self.prepare(criteria)
+        scored = []
+        for pos, user in enumerate(users):
+            score = self.score(user, query)
+            if score is not None:
+                scored.append((score, -pos))
+
+        best = heapq.nlargest(top_n, scored)
+        return [users[-neg_pos] for _, neg_pos in best]
+
+    def prepare(self, criteria: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        把搜索條件整理成打分用的查詢（值統一小寫，並從描述中提取性別與外觀要求）
+
+        Args:
+            criteria: 搜索條件
+
+        Returns:
+            打分查詢
+        """
+        query: Dict[str, Any] = {"appearance": {}}
+
+        description = criteria.get("description")
+        if description:
+            query["gender"], query["appearance"] = self._parse_description(description)
+
+        for key, value in criteria.items():
+            if value is None or value == "":
+                continue
+            if key == "gender":
+                query["gender"] = value.lower()
+            elif key == "location":
+                query["location"] = value.lower()
+            elif key == "hobby":
+                hobbies = [value] if isinstance(value, str) else value
+                query["hobby"] = [h.lower() for h in hobbies]
+            elif key == "occupation":
+                query["occupation"] = value.lower()
+            elif key in ("age_min", "age_max"):
+                query[key] = value
+            elif key in APPEARANCE_KEYS:
+                query["appearance"][key] = str(value).lower()
+
+        return query
+
+    def score(self, user: Dict, query: Dict[str, Any]) -> Optional[float]:
+        """
+        計算用戶的加權匹配分數
+
+        Args:
+            user: 用戶
+            query: prepare() 返回的查詢
+
+        Returns:
+            分數；性別不符合（硬性條件）時返回 None
+        """
+        gender = query.get("gender")
+        if gender and user["gender"].lower() != gender:
+            return None
+
+        w = self.weights
+        score = 0.0
+
+        wanted = query["appearance"]
+        if wanted:
+            app = user.get("appearance") or {}
+            hits = sum(1 for field, value in wanted.items() if (app.get(field) or "").lower() == value)
+            score += w["appearance"] * hits / len(wanted)
+
+        if "location" in query and user["location"].lower() == query["location"]:
+            score += w["location"]
+
+        if "hobby" in query and query["hobby"]:
+            user_hobbies = [h.lower() for h in user["hobby"]]
+            overlap = sum(1 for term in query["hobby"] if any(term in h for h in user_hobbies))
+            score += w["hobby"] * overlap / len(query["hobby"])
+
+        if "age_min" in query or "age_max" in query:
+            score += w["age"] * self._age_closeness(user["age"], query.get("age_min"), query.get("age_max"))
+
+        if "occupation" in query:
+            score += w["occupation"] * self._occupation_relatedness(user["occupation"].lower(), query["occupation"])
+
+        return score
+
+    @staticmethod
+    def _age_closeness(age: int, age_min: Optional[int], age_max: Optional[int]) -> float:
+        """範圍內為 1，範圍外按相差歲數線性遞減"""
+        distance = 0
+        if age_min is not None and age < age_min:
+            distance = age_min - age
+        elif age_max is not None and age > age_max:
+            distance = age - age_max
+        return max(0.0, 1.0 - distance / AGE_FALLOFF_YEARS)
+
+    @staticmethod
+    def _occupation_relatedness(occupation: str, target: str) -> float:
+        """完全相同為 1，互相包含為 0.8，否則按詞重疊程度計分"""
+        if occupation == target:
+            return 1.0
+        if target in occupation or occupation in target:
+            return 0.8
+        a, b = set(occupation.split()), set(target.split())
+        if not a or not b:
+            return 0.0
+        return 0.5 * len(a & b) / len(a | b)
+
+    @staticmethod
+    def _parse_description(description: str):
+        """從自由描述中提取性別與外觀要求（與提示詞中的規則一致）"""
+        text = description.lower()
+        words = re.findall(r"[a-z]+(?:-[a-z]+)?", text)
+
+        gender = None
+        for word in words:
+            if word in GENDER_WORDS:
+                gender = GENDER_WORDS[word]
+                break
+
+        appearance: Dict[str, str] = {}
+        for phrase, length in HAIR_LENGTHS.items():
+            if phrase in text:
+                appearance["hair_length"] = length
+                break
+        for i, word in enumerate(words):
+            following = words[i + 1] if i + 1 < len(words) else ""
+            if following in ("eye", "eyes", "eyed") and word in EYE_COLORS:
+                appearance["eye_color"] = "gray" if word == "grey" else word
+            elif word in HAIR_COLORS and following not in ("eye", "eyes", "eyed"):
+                appearance.setdefault("hair_color", HAIR_COLORS[word])
+        style = re.search(r"\b(anime|realistic|real)[ -](style|styled|look|looking|character|avatar)", text)
+        if style:
+            appearance["style"] = STYLES[style.group(1)]
+        for hairstyle in HAIRSTYLES:
+            if hairstyle in text:
+                appearance["hairstyle"] = hairstyle
+                break
+
+        return gender, appearance
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+布爾查詢編譯器
+把 JSON 形式的查詢（AND / OR / NOT、「至少命中 N 個」、年齡範圍）編譯成表達式樹，
+在 BitsetIndex 上求值：每個節點是一次大整數的 & | ~ 運算，整個查詢只是幾次按字並行的位運算。
+原有的扁平條件 dict 通過 from_criteria() 轉成同樣的表達式樹
+
+查詢格式：
+    {"location": "Miami"}                              單個條件（值為列表時命中任意一個）
+    {"location": "Miami", "gender": "female"}          多個條件同時滿足
+    {"and": [...]} / {"or": [...]} / {"not": {...}}    布爾組合
+    {"at_least": 2, "hobby": ["Music", "Travel", "Hiking"]}   至少命中 2 個興趣
+    {"at_least": 2, "of": [{...}, {...}, {...}]}               至少滿足 2 個子查詢
+    {"age": {"min": 25, "max": 35}}                    年齡範圍（也可以用 age_min / age_max）
+"""
+
+from typing import Any, Dict, List
+
+from bitset_index import BitsetIndex
+
+
+OPERATORS = ("and", "or", "not", "at_least", "of")
+
+
+class QueryError(ValueError):
+    """查詢格式錯誤"""
+
+
+class Node:
+    """表達式樹節點"""
+
+    def evaluate(self, bitsets: BitsetIndex) -> int:
+        """在位圖索引上求值，返回滿足條件的用戶位圖"""
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        """可讀的查詢文本（用於日誌與排序提示詞）"""
+        raise NotImplementedError
+
+
+class Leaf(Node):
+    """單個條件（匹配規則與扁平條件相同）"""
+
+    def __init__(self, key: str, value: Any):
+        self.key = key
+        self.value = value
+
+    def evaluate(self, bitsets: BitsetIndex) -> int:
+        return bitsets.lookup(self.key, self.value)
+
+    def describe(self) -> str:
+        if self.key == "hobby" and not isinstance(self.value, str):
+            return f"hobby in ({', '.join(self.value)})"
+        if self.key == "age_min":
+            return f"age >= {self.value}"
+        if self.key == "age_max":
+            return f"age <= {self.value}"
+        return f"{self.key} = {self.value}"
+
+
+class And(Node):
+    """所有子節點同時滿足"""
+
+    def __init__(self, children: List[Node]):
+        self.children = children
+
+    def evaluate(self, bitsets: BitsetIndex) -> int:
+        mask = bitsets.all
+        for child in self.children:
+            mask &= child.evaluate(bitsets)
+            if not mask:
+                break
+        return mask
+
+    def describe(self) -> str:
+        return "(" + " AND ".join(child.describe() for child in self.children) + ")"
+
+
+class Or(Node):
+    """任意一個子節點滿足"""
+
+    def __init__(self, children: List[Node]):
+        self.children = children
+
+    def evaluate(self, bitsets: BitsetIndex) -> int:
+        mask = 0
+        for child in self.children:
+            mask |= child.evaluate(bitsets)
+        return mask
+
+    def describe(self) -> str:
+        return "(" + " OR ".join(child.describe() for child in self.children) + ")"
+
+
+class Not(Node):
+    """子節點不滿足"""
+
+    def __init__(self, child: Node):
+        self.child = child
+
+    def evaluate(self, bitsets: BitsetIndex) -> int:
+        return bitsets.all & ~self.child.evaluate(bitsets)
+
+    def describe(self) -> str:
+        return f"NOT {self.child.describe()}"
+
+
+class AtLeast(Node):
+    """至少 n 個子節點滿足"""
+
+    def __init__(self, n: int, children: List[Node]):
+        self.n = n
+        self.children = children
+
+    def evaluate(self, bitsets: BitsetIndex) -> int:
+        if self.n <= 0:
+            return bitsets.all
+        if self.n > len(self.children):
+            return 0
+        # reached[j] = 已處理的子節點中至少命中 j 個的用戶；每個子節點從高到低更新一次
+        reached = [bitsets.all] + [0] * self.n
+        for child in self.children:
+            mask = child.evaluate(bitsets)
+            for j in range(self.n, 0, -1):
+                reached[j] |= reached[j - 1] & mask
+        return reached[self.n]
+
+    def describe(self) -> str:
+        return f"AT LEAST {self.n} OF (" + ", ".join(child.describe() for child in self.children) + ")"
+
+
+class Nothing(Node):
+    """不匹配任何用戶（沒有有效條件時，與扁平條件的行為一致）"""
+
+    def evaluate(self, bitsets: BitsetIndex) -> int:
+        return 0
+
+    def describe(self) -> str:
+        return "NOTHING"
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == "" or value == []
+
+
+def compile_query(expr: Any) -> Node:
+    """
+    把 JSON 查詢編譯成表達式樹
+
+    Args:
+        expr: 查詢（dict，或表示 AND 的列表）
+
+    Returns:
+        表達式樹
+
+    Raises:
+        QueryError: 查詢格式錯誤
+    """
+    if isinstance(expr, list):
+        return And([compile_query(item) for item in expr]) if expr else Nothing()
+    if not isinstance(expr, dict) or not expr:
+        raise QueryError(f"查詢必須是非空的對象或列表: {expr!r}")
+
+    operators = [key for key in expr if key in OPERATORS]
+    if "and" in expr or "or" in expr or "not" in expr:
+        if len(expr) != 1:
+            raise QueryError(f"and / or / not 必須單獨使用: {sorted(expr)}")
+        if "not" in expr:
+            return Not(compile_query(expr["not"]))
+        children = expr.get("and", expr.get("or"))
+        if not isinstance(children, list) or not children:
+            raise QueryError(f"{operators[0]} 需要非空列表")
+        nodes = [compile_query(child) for child in children]
+        return And(nodes) if "and" in expr else Or(nodes)
+
+    if "at_least" in expr:
+        n = expr["at_least"]
+        if not isinstance(n, int) or isinstance(n, bool):
+            raise QueryError(f"at_least 必須是整數: {n!r}")
+        rest = {k: v for k, v in expr.items() if k != "at_least"}
+        if "of" in rest:
+            if len(rest) != 1 or not isinstance(rest["of"], list):
+                raise QueryError("at_least 與 of 一起使用時，of 必須是子查詢列表")
+            return AtLeast(n, [compile_query(child) for child in rest["of"]])
+        if len(rest) != 1:
+            raise QueryError("at_least 需要 of 或恰好一個字段，例如 {\"at_least\": 2, \"hobby\": [...]}")
+        key, values = next(iter(rest.items()))
+        values = [values] if not isinstance(values, list) else values
+        return AtLeast(n, [_compile_field(key, value) for value in values])
+
+    if "of" in expr:
+        raise QueryError("of 只能與 at_least 一起使用")
+
+    nodes = [_compile_field(key, value) for key, value in expr.items() if not _is_empty(value)]
+    if not nodes:
+        return Nothing()
+    return nodes[0] if len(nodes) == 1 else And(nodes)
+
+
+def _compile_field(key: str, value: Any) -> Node:
+    """字段條件：age 範圍展開為 age_min / age_max；非興趣字段的列表表示命中任意一個"""
+    if key == "age":
+        if not isinstance(value, dict) or not set(value) <= {"min", "max"}:
+            raise QueryError(f"age 必須是 {{\"min\": ..., \"max\": ...}}: {value!r}")
+        bounds = [Leaf(f"age_{bound}", value[bound]) for bound in ("min", "max") if value.get(bound) is not None]
+        for leaf in bounds:
+            if not isinstance(leaf.value, int) or isinstance(leaf.value, bool):
+                raise QueryError(f"年齡必須是整數: {leaf.value!r}")
+        if not bounds:
+            return Nothing()
+        return bounds[0] if len(bounds) == 1 else And(bounds)
+    if key in ("age_min", "age_max") and (not isinstance(value, int) or isinstance(value, bool)):
+        raise QueryError(f"{key} 必須是整數: {value!r}")
+    if isinstance(value, dict):
+        raise QueryError(f"{key} 的值不能是對象")
+    if key == "hobby":
+        hobbies = [value] if isinstance(value, str) else value
+        if not isinstance(hobbies, list) or not all(isinstance(h, str) for h in hobbies):
+            raise QueryError(f"hobby 必須是字符串或字符串列表: {value!r}")
+    elif isinstance(value, list):
+        leaves = [Leaf(key, item) for item in value if not _is_empty(item)]
+        return leaves[0] if len(leaves) == 1 else Or(leaves)
+    return Leaf(key, value)
+
+
+def from_criteria(criteria: Dict[str, Any], strict: bool = True) -> Node:
+    """
+    兼容層：扁平條件 dict 轉表達式樹（嚴格模式為 AND，放寬模式為 OR）
+    條件中的 "query" 鍵按查詢編譯，與其他條件按同樣的方式組合
+
+    Args:
+        criteria: 扁平條件（可帶 "query"）
+        strict: 是否嚴格匹配
+
+    Returns:
+        表達式樹
+
+    Raises:
+        QueryError: query 格式錯誤
+    """
+    nodes: List[Node] = []
+    for key, value in criteria.items():
+        if _is_empty(value):
+            continue
+        nodes.append(compile_query(value) if key == "query" else Leaf(key, value))
+    if not nodes:
+        return Nothing()
+    if len(nodes) == 1:
+        return nodes[0]
+    return And(nodes) if strict else Or(nodes)
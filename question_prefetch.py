@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Agent 問題的預取緩存
+每個問題正好 3 個選項，返回問題後在後台為每個選項預先生成下一題，
+結果按 (會話, 之前的回答, 問題編號) 存在短期緩存中；
+用戶點選後的請求直接從內存取出，不再等待一次完整的 Gemini 往返。
+預取的問題溫度高、不能緩存或合併，每次都是真實的 Gemini 調用：
+只為服務端真正返回過問題的會話預取，並按會話與客戶端地址限制預取次數
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+
+PrefetchKey = Tuple[str, Tuple[str, ...], int]
+
+
+def make_prefetch_key(session_id: str, previous_answers: List[Any], question_number: int) -> PrefetchKey:
+    """
+    生成預取緩存鍵
+
+    Args:
+        session_id: 前端會話 ID
+        previous_answers: 之前的回答
+        question_number: 問題編號
+
+    Returns:
+        緩存鍵
+    """
+    return str(session_id), tuple(str(answer) for answer in previous_answers), int(question_number)
+
+
+class QuestionPrefetcher:
+    """線程安全的問題預取器（後台線程池 + 按會話劃分的 TTL 緩存）"""
+
+    def __init__(
+        self,
+        generate: Callable[[List[Any], int], Dict[str, Any]],
+        max_workers: int = 4,
+        max_entries: int = 512,
+        ttl_seconds: float = 120,
+        max_per_session: int = 9,
+        max_per_client: int = 30,
+        client_window: float = 60,
+        max_sessions: int = 4096,
+        session_ttl: float = 1800
+    ):
+        """
+        初始化預取器
+
+        Args:
+            generate: 生成問題的函數 (previous_answers, question_number) -> {"question", "options"}，失敗時拋出異常
+            max_workers: 後台生成的最大並發數
+            max_entries: 最多保留的預取條目數（0=停用預取）
+            ttl_seconds: 條目存活時間（秒），用戶通常在這段時間內作答
+            max_per_session: 每個會話最多排入的預取任務數
+            max_per_client: 每個客戶端地址在 client_window 秒內最多排入的預取任務數
+            client_window: 客戶端限額的統計窗口（秒）
+            max_sessions: 最多記住的已服務會話數（超出時淘汰最久未活動的會話）
+            session_ttl: 會話自最後一次返回問題起的有效時間（秒）
+        """
+        self.generate = generate
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_per_session = max_per_session
+        self.max_per_client = max_per_client
+        self.client_window = client_window
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="question-prefetch")
+        self._entries: "OrderedDict[PrefetchKey, Tuple[float, Future]]" = OrderedDict()
+        # 會話 -> [過期時間, 已排入的預取數]；客戶端地址 -> [窗口開始時間, 窗口內已排入的預取數]
+        self._sessions: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._clients: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.scheduled = 0
+        self.refused = 0
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.discarded = 0
+
+    @property
+    def enabled(self) -> bool:
+        """是否啟用預取"""
+        return self.max_entries > 0
+
+    def mark_served(self, session_id: str):
+        """
+        記錄服務端已經為該會話返回過問題（之後才允許為它預取）
+
+        Args:
+            session_id: 前端會話 ID
+        """
+        if not self.enabled or not session_id:
+            return
+
+        session_id = str(session_id)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = [0.0, 0]
+            session[0] = time.monotonic() + self.session_ttl
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def prefetch(
+        self,
+        session_id: str,
+        previous_answers: List[Any],
+        question_number: int,
+        options: List[Any],
+        client: Optional[str] = None
+    ) -> int:
+        """
+        為當前問題的每個選項在後台生成下一題
+
+        會話沒有被 mark_served 記錄過（或已過期）時不預取；
+        會話或客戶端地址的預取限額用完後，剩下的選項不再預取
+
+        Args:
+            session_id: 前端會話 ID
+            previous_answers: 當前問題之前的回答
+            question_number: 當前問題編號
+            options: 當前問題的選項
+            client: 客戶端地址（None=不按地址限制）
+
+        Returns:
+            本次新排入後台的生成任務數
+        """
+        if not self.enabled or not session_id:
+            return 0
+
+        scheduled = 0
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            session = self._sessions.get(str(session_id))
+            if session is None or session[0] < now:
+                self.refused += len(options)
+                return 0
+            allowance = self.max_per_session - session[1]
+            usage = self._client_usage(client, now) if client else None
+            if usage is not None:
+                allowance = min(allowance, self.max_per_client - usage[1])
+
+            for option in options:
+                answers = list(previous_answers) + [option]
+                key = make_prefetch_key(session_id, answers, question_number + 1)
+                if key in self._entries:
+                    continue
+                if scheduled >= allowance:
+                    self.refused += 1
+                    continue
+                future = self._executor.submit(self._generate, answers, question_number + 1)
+                self._entries[key] = (now + self.ttl_seconds, future)
+                scheduled += 1
+
+            session[1] += scheduled
+            if usage is not None:
+                usage[1] += scheduled
+
+            while len(self._entries) > self.max_entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                evicted.cancel()
+                self.discarded += 1
+
+            self.scheduled += scheduled
+        return scheduled
+
+    def take(self, session_id: str, previous_answers: List[Any], question_number: int, timeout: float = 0) -> Optional[Dict[str, Any]]:
+        """
+        取出預取的問題；同一步中未被選中的其他選項一併丟棄
+
+        Args:
+            session_id: 前端會話 ID
+            previous_answers: 之前的回答
+            question_number: 問題編號
+            timeout: 預取仍在生成時最多等待的秒數
+
+        Returns:
+            預取的問題，未命中、已過期或生成失敗時返回 None
+        """
+        if not self.enabled or not session_id:
+            return None
+
+        key = make_prefetch_key(session_id, previous_answers, question_number)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # 用戶已經選定，兄弟選項的預取不會再被用到
+                for other in [k for k in self._entries if k[0] == key[0] and k[2] == key[2]]:
+                    _, sibling = self._entries.pop(other)
+                    sibling.cancel()
+                    self.discarded += 1
+
+        if entry is None or entry[0] < time.monotonic():
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            result = entry[1].result(timeout=max(0.0, timeout))
+        except FutureTimeoutError:
+            result = None
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return result
+
+    def _generate(self, previous_answers: List[Any], question_number: int) -> Optional[Dict[str, Any]]:
+        """後台生成單個問題，失敗時返回 None（不緩存備用問題，交給實時請求重新生成）"""
+        try:
+            return self.generate(previous_answers, question_number)
+        except Exception as e:
+            print(f"⚠️  預取問題失敗: {e}")
+            with self._lock:
+                self.failures += 1
+            return None
+
+    def _client_usage(self, client: str, now: float) -> List[float]:
+        """取客戶端地址當前窗口的用量（需持有鎖；窗口到期後重新計數）"""
+        usage = self._clients.get(client)
+        if usage is None or now - usage[0] >= self.client_window:
+            usage = self._clients[client] = [now, 0]
+        self._clients.move_to_end(client)
+        while len(self._clients) > self.max_sessions:
+            self._clients.popitem(last=False)
+        return usage
+
+    def _purge(self, now: float):
+        """刪除過期條目（需持有鎖）"""
+        for key in [k for k, (expires_at, _) in self._entries.items() if expires_at < now]:
+            _, future = self._entries.pop(key)
+            future.cancel()
+            self.discarded += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """返回預取統計，用於評估命中率與浪費的生成次數"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "pending": sum(1 for _, future in self._entries.values() if not future.done()),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "scheduled": self.scheduled,
+                "refused": self.refused,
+                "sessions": len(self._sessions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "failures": self.failures,
+                "discarded": self.discarded,
+            }
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+推薦結果緩存
+以規範化後的搜索條件為鍵，LRU + TTL 淘汰，按條目數與估算內存雙重限制，
+並綁定數據庫版本：數據庫變更後所有舊結果自動失效
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+
+def canonicalize_criteria(criteria: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    規範化搜索條件，使語義相同的條件得到相同的鍵
+
+    - 忽略空值（與過濾邏輯一致）
+    - 字符串去首尾空白並轉小寫
+    - hobby 單個字符串與列表等價，列表去重排序（興趣之間是「任一命中」關係）
+
+    Args:
+        criteria: 原始搜索條件
+
+    Returns:
+        規範化後的條件
+    """
+    canonical: Dict[str, Any] = {}
+    for key, value in criteria.items():
+        if value is None or value == "":
+            continue
+        if key == "hobby":
+            hobbies = [value] if isinstance(value, str) else value
+            canonical[key] = sorted({str(h).strip().lower() for h in hobbies})
+        elif isinstance(value, str):
+            canonical[key] = value.strip().lower()
+        else:
+            canonical[key] = value
+    return canonical
+
+
+def make_cache_key(criteria: Dict[str, Any], **options: Any) -> str:
+    """
+    生成緩存鍵
+
+    Args:
+        criteria: 搜索條件
+        **options: 其他影響結果的參數（如 top_k、use_ai_ranking）
+
+    Returns:
+        緩存鍵字符串
+    """
+    return json.dumps(
+        {"criteria": canonicalize_criteria(criteria), **options},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str
+    )
+
+
+class RankingCache:
+    """線程安全的 LRU/TTL 推薦結果緩存"""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 16 * 1024 * 1024,
+        ttl_seconds: float = 600
+    ):
+        """
+        初始化緩存
+
+        Args:
+            max_entries: 最多緩存的條目數（0=停用緩存）
+            max_bytes: 所有條目序列化後的估算總大小上限
+            ttl_seconds: 條目存活時間（秒）
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def bind_version(self, version: str):
+        """
+        綁定數據庫版本，版本變化時清空所有條目
+
+        Args:
+            version: 數據庫版本標識
+        """
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._bytes = 0
+                self._version = version
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        讀取緩存（命中時刷新 LRU 順序）
+
+        Args:
+            key: 緩存鍵
+
+        Returns:
+            緩存的值，未命中或已過期時返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, size, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._bytes -= size
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: str) -> Optional[Any]:
+        """
+        讀取緩存但不計入命中統計、不刷新 LRU 順序（用於計算前的二次檢查）
+
+        Args:
+            key: 緩存鍵
+
+        Returns:
+            緩存的值，未命中或已過期時返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[2]
+
+    def put(self, key: str, value: Any):
+        """
+        寫入緩存，超出條目數或內存上限時淘汰最久未使用的條目
+
+        Args:
+            key: 緩存鍵
+            value: 要緩存的值（需可 JSON 序列化，用於估算大小）
+        """
+        if self.max_entries <= 0:
+            return
+
+        size = len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """清空緩存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中統計，用於評估緩存大小是否合適"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "version": self._version,
+            }
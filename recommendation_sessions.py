@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+推薦會話
+一次搜索只排序一次：把較大的前 N 名排序結果保存在服務端，用游標分頁返回，
+後續頁直接從內存切片，不再過濾、不再調用 Gemini；
+會話按 LRU + TTL 淘汰，並綁定數據庫版本：數據庫變更後舊會話全部失效
+"""
+
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class SessionExpired(KeyError):
+    """游標無效、會話已過期或數據庫版本已變化"""
+
+
+class RecommendationSession:
+    """一次搜索的排序快照"""
+
+    def __init__(self, session_id: str, users: List[Dict], metadata: Dict[str, Any], version: str, expires_at: float):
+        self.session_id = session_id
+        self.users = users
+        self.metadata = metadata
+        self.version = version
+        self.expires_at = expires_at
+
+
+def encode_cursor(session_id: str, offset: int) -> str:
+    """游標 = 會話 ID + 下一頁的起始位置（同一個游標可重複請求，得到同一頁）"""
+    return f"{session_id}.{offset}"
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    解析游標
+
+    Raises:
+        SessionExpired: 游標格式錯誤
+    """
+    session_id, _, offset = str(cursor).rpartition(".")
+    if not session_id or not offset.isdigit():
+        raise SessionExpired(f"無效的游標: {cursor!r}")
+    return session_id, int(offset)
+
+
+class RecommendationSessionStore:
+    """線程安全的推薦會話存儲"""
+
+    def __init__(self, max_sessions: int = 2048, ttl_seconds: float = 900):
+        """
+        初始化會話存儲
+
+        Args:
+            max_sessions: 最多保留的會話數（超出時淘汰最久未訪問的會話）
+            ttl_seconds: 會話自最後一次訪問起的存活時間（秒）
+        """
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+
+        self._sessions: "OrderedDict[str, RecommendationSession]" = OrderedDict()
+        self._version: Optional[str] = None
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.pages_served = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def bind_version(self, version: str):
+        """
+        綁定數據庫版本，版本變化時丟棄所有會話
+
+        Args:
+            version: 數據庫版本標識
+        """
+        with self._lock:
+            if version != self._version:
+                if self._sessions:
+                    self.invalidations += 1
+                self._sessions.clear()
+                self._version = version
+
+    def create(
+        self,
+        users: List[Dict],
+        metadata: Dict[str, Any],
+        version: str,
+        page_size: int
+    ) -> Tuple[List[Dict], Optional[str], Dict[str, Any]]:
+        """
+        保存一次搜索的排序結果，並返回第一頁
+
+        Args:
+            users: 按排名排列的用戶列表（只保存引用，與目錄快照共享用戶對象）
+            metadata: 排序時的統計信息
+            version: 排序所用快照的數據庫版本
+            page_size: 第一頁的用戶數
+
+        Returns:
+            (第一頁用戶, 下一頁游標（沒有更多時為 None）, 會話信息)
+        """
+        session = RecommendationSession(
+            secrets.token_urlsafe(12), list(users), dict(metadata), version, time.monotonic() + self.ttl_seconds
+        )
+        with self._lock:
+            self.created += 1
+            # 排序期間數據庫已被替換時結果只返回給本次請求，不保存，也不給游標
+            if self.max_sessions <= 0 or version != self._version:
+                page, _, info = self._slice(session, 0, page_size)
+                return page, None, info
+            self._sessions[session.session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+        return self._slice(session, 0, page_size)
+
+    def page(self, cursor: str, page_size: int) -> Tuple[List[Dict], Optional[str], Dict[str, Any]]:
+        """
+        按游標讀取一頁（刷新會話的 TTL）
+
+        Args:
+            cursor: 上一頁返回的游標
+            page_size: 本頁的用戶數
+
+        Returns:
+            (本頁用戶, 下一頁游標（沒有更多時為 None）, 會話信息)
+
+        Raises:
+            SessionExpired: 游標無效、會話不存在或已過期
+        """
+        session_id, offset = decode_cursor(cursor)
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.version != self._version:
+                raise SessionExpired(f"會話不存在或已失效: {session_id}")
+            if session.expires_at < now:
+                del self._sessions[session_id]
+                self.expired += 1
+                raise SessionExpired(f"會話已過期: {session_id}")
+            session.expires_at = now + self.ttl_seconds
+            self._sessions.move_to_end(session_id)
+            self.pages_served += 1
+
+        return self._slice(session, offset, page_size)
+
+    def _slice(
+        self,
+        session: RecommendationSession,
+        offset: int,
+        page_size: int
+    ) -> Tuple[List[Dict], Optional[str], Dict[str, Any]]:
+        """從排序結果中切出一頁"""
+        end = offset + page_size
+        next_cursor = encode_cursor(session.session_id, end) if end < len(session.users) else None
+        info = dict(session.metadata, session_total=len(session.users), offset=offset)
+        return session.users[offset:end], next_cursor, info
+
+    def stats(self) -> Dict[str, Any]:
+        """返回會話統計"""
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "created": self.created,
+                "pages_served": self.pages_served,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "version": self._version,
+            }
@@ -5,37 +5,185 @@
 """
 
 import json
-from typing import List, Dict, Any
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+import requests
 from gemini_client import GeminiClient
+from local_ranker import LocalRanker, APPEARANCE_KEYS
+from catalog import Catalog, CatalogSnapshot, SharedLookups
+from embedding_index import EmbeddingIndex
+from description_parser import DEFAULT_CONFIDENCE
+from query_compiler import compile_query
+from ranking_cache import RankingCache, make_cache_key
+from recommendation_sessions import RecommendationSessionStore
+from single_flight import SingleFlight
+from gemini_resilience import Deadline, estimate_tokens
+
+
+# 排序結果的輸出結構：按匹配度從高到低排列的用戶 ID 數組
+RANKING_SCHEMA = {"type": "ARRAY", "items": {"type": "INTEGER"}}
+
+# 排序輸出的 token 上限按 top_k 估算：每個 ID（含分隔符）最多約 8 個 token
+RANKING_TOKENS_PER_ID = 8
+RANKING_TOKENS_BASE = 32
+
+
+def ranking_max_tokens(top_k: int) -> int:
+    """排序請求的 maxOutputTokens（只需容納 top_k 個 ID）"""
+    return RANKING_TOKENS_BASE + RANKING_TOKENS_PER_ID * top_k
+
+
+# 描述搜索時召回池相對於候選上限的倍數（召回後再由本地排序器精選）
+RETRIEVAL_POOL_FACTOR = 4
+
+
+def _parse_ranked_ids(text: str) -> List[int]:
+    """
+    從 AI 回應中取出排序後的 ID
+
+    優先按 JSON 解析（RANKING_SCHEMA 約束的 ID 數組，也接受 {"id": ...} 對象數組）；
+    輸出被截斷或不是 JSON 時，退回舊格式：取最後一行中的逗號分隔數字
+
+    Args:
+        text: AI 的回應文本
+
+    Returns:
+        ID 列表（可能為空）
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+
+    if isinstance(data, list):
+        ids = []
+        for item in data:
+            value = item.get("id") if isinstance(item, dict) else item
+            if isinstance(value, (int, str)) and str(value).strip().isdigit():
+                ids.append(int(value))
+        return ids
+
+    numbers_line = text.strip().split('\n')[-1] if text.strip() else ""
+    return [int(n) for n in re.findall(r"\d+", numbers_line)]
+
+
+def _scan_complete_ids(buffer: str, start: int, final: bool) -> Tuple[List[int], int]:
+    """
+    從流式輸出中掃描已經完整的數字 ID
+
+    Args:
+        buffer: 目前收到的全部文本
+        start: 上次掃描結束的位置
+        final: 流是否已結束（結束時末尾的數字也算完整）
+
+    Returns:
+        (新解析出的 ID 列表, 下次掃描的起始位置)
+    """
+    ids = []
+    for match in re.finditer(r"\d+", buffer[start:]):
+        # 數字後面還沒有其他字符時，可能還有後續位數在下一個片段裡
+        if start + match.end() == len(buffer) and not final:
+            return ids, start + match.start()
+        ids.append(int(match.group()))
+    return ids, len(buffer)
 
 
 class UserRecommendationSystem:
     """用戶推薦系統"""
 
-    def __init__(self, database_path: str = "users_database.json"):
+    def __init__(
+        self,
+        database_path: str = "users_database.json",
+        backend: str = "index",
+        candidate_limit: int = 50,
+        candidate_token_budget: Optional[int] = None,
+        cache: Optional[RankingCache] = None,
+        shard_size: Optional[int] = None,
+        max_shard_workers: int = 8,
+        prompt_encoding: str = "compact",
+        embedding_index: Optional[EmbeddingIndex] = None,
+        parse_descriptions: bool = True,
+        parse_confidence: float = DEFAULT_CONFIDENCE,
+        catalog: Optional[Catalog] = None,
+        sessions: Optional[RecommendationSessionStore] = None,
+        session_size: int = 100,
+        coalesce: bool = True
+    ):
         """
         初始化推薦系統
 
         Args:
-            database_path: 用戶數據庫 JSON 文件路徑
+            database_path: 用戶數據庫路徑（JSON 文件或 SQLite 存儲）
+            backend: 過濾後端，"index"=倒排索引，"columnar"=NumPy 列式存儲，"sqlite"=SQLite 索引查詢，
+                     "bitset"=位圖上的布爾查詢（帶 query 的條件在任何後端下都在位圖上求值）
+            candidate_limit: 送進 AI 排序提示詞的最大候選用戶數
+            candidate_token_budget: 候選用戶列表的估算 token 上限（None=不限制）
+            cache: 推薦結果緩存（None=使用默認配置）
+            shard_size: 分片排序時每個分片的候選數（None=不分片，一次性排序）
+            max_shard_workers: 分片並行排序的最大線程數
+            prompt_encoding: 候選在提示詞中的編碼，"compact"=緊湊片段+代碼圖例，"verbose"=逐項描述
+            embedding_index: 描述搜索的語義召回索引（None=只用關鍵詞召回）
+            parse_descriptions: 是否先用本地解析器把描述轉成結構化條件
+            parse_confidence: 解析置信度不低於此值時直接過濾 + 本地排序，不調用 Gemini
+            catalog: 共享的用戶目錄（None=按上面的參數創建一個不監視文件的目錄；
+                     傳入時 database_path / backend / embedding_index / parse_confidence 以目錄為準）
+            sessions: 分頁推薦的會話存儲（None=使用默認配置）
+            session_size: 分頁推薦時一次排序並保存的結果數（前 N 名）
+            coalesce: 是否合併相同條件的並發推薦（只計算一次，其他請求等待並共享結果）
         """
-        self.client = GeminiClient()
-        self.database_path = database_path
-        self.users = self._load_database()
+        if prompt_encoding not in ("compact", "verbose"):
+            raise ValueError(f"不支持的提示詞編碼: {prompt_encoding}")
 
-    def _load_database(self) -> List[Dict]:
-        """載入用戶數據庫"""
-        try:
-            with open(self.database_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            raise FileNotFoundError(f"找不到用戶數據庫文件: {self.database_path}")
+        self.client = GeminiClient()
+        # 本地排序器：不使用 AI 時的完整排序，使用 AI 時的預排序
+        self.ranker = LocalRanker()
+        self.candidate_limit = candidate_limit
+        self.candidate_token_budget = candidate_token_budget
+        self.shard_size = shard_size
+        self.max_shard_workers = max_shard_workers
+        self.prompt_encoding = prompt_encoding
+        self.parse_descriptions = parse_descriptions
+        # 用戶數據與索引都在目錄的快照裡；每個請求開始時取一次快照，整個請求只用它
+        self.catalog = catalog if catalog is not None else Catalog(
+            database_path,
+            backend=backend,
+            embedding_index=embedding_index,
+            parse_confidence=parse_confidence
+        )
+        # 推薦結果緩存，綁定數據庫版本；目錄替換快照時舊結果一起失效
+        self.cache = cache if cache is not None else RankingCache()
+        self.cache.bind_version(self.catalog.version)
+        self.catalog.subscribe(lambda snapshot: self.cache.bind_version(snapshot.version))
+        # 分頁推薦的排序快照，同樣隨數據庫版本失效
+        self.session_size = session_size
+        self.sessions = sessions if sessions is not None else RecommendationSessionStore()
+        self.sessions.bind_version(self.catalog.version)
+        self.catalog.subscribe(lambda snapshot: self.sessions.bind_version(snapshot.version))
+        # 相同條件的並發請求合併為一次計算
+        self.flights = SingleFlight() if coalesce else None
+
+    @property
+    def users(self) -> List[Dict]:
+        """當前快照的用戶列表"""
+        return self.catalog.snapshot().users
+
+    @property
+    def catalog_version(self) -> str:
+        """當前快照的數據庫版本"""
+        return self.catalog.version
+
+    @property
+    def embeddings(self) -> Optional[EmbeddingIndex]:
+        """共享的語義索引（用於統計；檢索使用快照中的只讀視圖）"""
+        return self.catalog.embedding_index
 
     def recommend(
         self,
         criteria: Dict[str, Any],
         top_k: int = 5,
-        use_ai_ranking: bool = True
+        use_ai_ranking: bool = True,
+        deadline: Optional[Deadline] = None
     ) -> List[Dict]:
         """
         根據條件推薦用戶
@@ -45,55 +193,550 @@ class UserRecommendationSystem:
                      或 {"description": "looking for someone who..."}
             top_k: 返回前 k 個推薦結果
             use_ai_ranking: 是否使用 AI 進行智能排序
+            deadline: 端到端截止時間，時間用完時返回當時最好的結果（如過濾後的順序）
 
         Returns:
             推薦的用戶列表
         """
+        ranked_users, _ = self.recommend_with_metadata(criteria, top_k, use_ai_ranking, deadline)
+        return ranked_users
+
+    def recommend_with_metadata(
+        self,
+        criteria: Dict[str, Any],
+        top_k: int = 5,
+        use_ai_ranking: bool = True,
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[List[Dict], Dict[str, Any]]:
+        """
+        根據條件推薦用戶，並返回本次推薦的統計信息
+
+        Args:
+            criteria: 推薦條件
+            top_k: 返回前 k 個推薦結果
+            use_ai_ranking: 是否使用 AI 進行智能排序
+            deadline: 端到端截止時間
+
+        Returns:
+            (推薦的用戶列表, 統計信息)
+        """
+        snapshot = self.catalog.snapshot()
+
+        # 鍵中帶上快照版本：重載前開始的請求寫入的舊結果不會被新版本讀到
+        cache_key = make_cache_key(criteria, top_k=top_k, use_ai_ranking=use_ai_ranking, version=snapshot.version)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            ranked_users, metadata = cached
+            return list(ranked_users), dict(metadata, cache="hit")
+
+        def compute() -> Tuple[List[Dict], Dict[str, Any], str]:
+            # 等到成為 leader 時前一次計算可能剛寫入緩存
+            cached = self.cache.peek(cache_key)
+            if cached is not None:
+                return cached[0], cached[1], "hit"
+            ranked_users, metadata = self._recommend_uncached(snapshot, criteria, top_k, use_ai_ranking, deadline)
+            # AI 排序失敗時的降級結果不緩存，避免在 TTL 內一直返回降級結果
+            if metadata.get("ranking") != "fallback":
+                self.cache.put(cache_key, (list(ranked_users), metadata))
+            return ranked_users, metadata, "miss"
+
+        if self.flights is None:
+            ranked_users, metadata, status = compute()
+            return list(ranked_users), dict(metadata, cache=status)
+
+        # 相同條件（同一版本）的並發請求只排序一次；等待不超過自己的截止時間。
+        # leader 的截止時間可能很短：降級或被截止時間截斷的結果不共享，follower 用自己的截止時間重算
+        (ranked_users, metadata, status), shared = self.flights.do(
+            cache_key, compute,
+            timeout=deadline.remaining() if deadline is not None else None,
+            shareable=lambda result: result[1].get("ranking") != "fallback" and not result[1].get("deadline_exceeded")
+        )
+        return list(ranked_users), dict(metadata, cache="coalesced" if shared else status)
+
+    def recommend_session(
+        self,
+        criteria: Dict[str, Any],
+        page_size: int = 20,
+        use_ai_ranking: bool = True,
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[List[Dict], Optional[str], Dict[str, Any]]:
+        """
+        開始一次分頁推薦：排序前 session_size 名並保存在服務端，返回第一頁和游標
+
+        Args:
+            criteria: 推薦條件
+            page_size: 每頁的用戶數
+            use_ai_ranking: 是否使用 AI 進行智能排序
+            deadline: 端到端截止時間
+
+        Returns:
+            (第一頁用戶, 下一頁游標（沒有更多時為 None）, 統計信息)
+        """
+        top_k = max(self.session_size, page_size)
+        ranked_users, metadata = self.recommend_with_metadata(criteria, top_k, use_ai_ranking, deadline)
+        return self.sessions.create(ranked_users, metadata, metadata["catalog_version"], page_size)
+
+    def next_page(self, cursor: str, page_size: int = 20) -> Tuple[List[Dict], Optional[str], Dict[str, Any]]:
+        """
+        按游標返回下一頁（從保存的排序結果中切片，不過濾、不調用 AI）
+
+        Args:
+            cursor: 上一頁返回的游標
+            page_size: 每頁的用戶數
+
+        Returns:
+            (本頁用戶, 下一頁游標（沒有更多時為 None）, 統計信息)
+
+        Raises:
+            SessionExpired: 游標無效、會話已過期或數據庫已變更，需要重新搜索
+        """
+        page, next_cursor, metadata = self.sessions.page(cursor, page_size)
+        return page, next_cursor, dict(metadata, cache="session")
+
+    def recommend_many(
+        self,
+        criteria_list: List[Dict[str, Any]],
+        top_k: int = 5,
+        use_ai_ranking: bool = True,
+        max_workers: int = 8,
+        deadline: Optional[Deadline] = None
+    ) -> Iterator[Tuple[int, List[Dict], Dict[str, Any]]]:
+        """
+        批量推薦：一批條件共用一個快照，按完成順序逐個產出結果
+
+        - 規範化後相同的條件只計算一次，結果分發給每個出現位置
+        - 過濾在同一個共享查詢視圖上進行，批內重複的單條件查詢只做一次
+        - 候選準備在當前線程依次完成，AI 排序提交到有界線程池並行執行
+        - 緩存命中與本地排序的結果立即產出，不等待 AI 排序
+
+        Args:
+            criteria_list: 推薦條件列表
+            top_k: 每組條件返回前 k 個推薦結果
+            use_ai_ranking: 是否使用 AI 進行智能排序
+            max_workers: 同時進行的 AI 排序調用數上限
+            deadline: 整批的截止時間，時間用完後未完成的排序使用本地降級結果
+
+        Yields:
+            (條件在列表中的下標, 推薦的用戶列表, 統計信息)；某組條件出錯時用戶列表為空，統計信息帶 "error"
+        """
+        snapshot = self.catalog.snapshot()
+        shared = SharedLookups(snapshot)
+
+        # 規範化後相同的條件歸為一組
+        groups: Dict[str, List[int]] = {}
+        for index, criteria in enumerate(criteria_list):
+            key = make_cache_key(criteria, top_k=top_k, use_ai_ranking=use_ai_ranking, version=snapshot.version)
+            groups.setdefault(key, []).append(index)
+        print(f"📦 批量推薦 {len(criteria_list)} 組條件，去重後 {len(groups)} 組")
+
+        def results(indexes: List[int], ranked_users: List[Dict], metadata: Dict[str, Any]):
+            for index in indexes:
+                yield index, list(ranked_users), dict(metadata, batch_duplicates=len(indexes) - 1)
+
+        pending = {}
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            for key, indexes in groups.items():
+                criteria = criteria_list[indexes[0]]
+                cached = self.cache.get(key)
+                if cached is not None:
+                    ranked_users, metadata = cached
+                    yield from results(indexes, ranked_users, dict(metadata, cache="hit"))
+                    continue
+
+                try:
+                    parsed = self._parse_description(shared, criteria)
+                    if parsed is not None:
+                        ranked_users, metadata = self._recommend_parsed(shared, *parsed, top_k)
+                    else:
+                        positions, metadata = self._gather_candidates(shared, criteria, top_k, deadline)
+                        use_ai = use_ai_ranking and len(positions) > 0
+                        if use_ai:
+                            candidates, candidate_tokens = self._select_candidates(snapshot, positions, criteria, top_k)
+                            metadata["candidate_tokens"] = candidate_tokens
+                            metadata["candidates_considered"] = len(candidates)
+                            if candidates:
+                                future = pool.submit(self._rank_with_ai, snapshot, candidates, criteria, top_k, deadline)
+                                pending[future] = (key, indexes, metadata)
+                                continue
+                        else:
+                            metadata["candidates_considered"] = len(positions)
+                        # 與 recommend() 一致：候選全被預算裁掉時結果為空，沒有候選時走本地排序
+                        metadata["ranking"] = "ai" if use_ai else "local"
+                        ranked_users = [] if use_ai else snapshot.rank_local(positions, criteria, top_k, self.ranker)
+                except Exception as e:
+                    # 單組條件出錯（如布爾查詢格式錯誤）不影響同批其他條件
+                    print(f"⚠️  批量推薦中的條件出錯: {e}")
+                    yield from results(indexes, [], {"error": str(e)})
+                    continue
+
+                self.cache.put(key, (list(ranked_users), metadata))
+                yield from results(indexes, ranked_users, dict(metadata, cache="miss"))
+
+            for future in as_completed(pending):
+                key, indexes, metadata = pending[future]
+                try:
+                    ranked_users, ai_ok = future.result()
+                except Exception as e:
+                    print(f"⚠️  批量推薦中的排序出錯: {e}")
+                    yield from results(indexes, [], {"error": str(e)})
+                    continue
+                metadata["ranking"] = "ai" if ai_ok else "fallback"
+                if deadline is not None and deadline.expired():
+                    metadata["deadline_exceeded"] = True
+                if ai_ok:
+                    self.cache.put(key, (list(ranked_users), metadata))
+                yield from results(indexes, ranked_users, dict(metadata, cache="miss"))
+
+        print(f"📦 批量推薦完成：單條件查詢 {shared.lookups} 次，其中 {shared.shared} 次共享")
+
+    def _recommend_uncached(
+        self,
+        snapshot: CatalogSnapshot,
+        criteria: Dict[str, Any],
+        top_k: int,
+        use_ai_ranking: bool,
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[List[Dict], Dict[str, Any]]:
+        """執行過濾與排序（不經過緩存）"""
+        parsed = self._parse_description(snapshot, criteria)
+        if parsed is not None:
+            return self._recommend_parsed(snapshot, *parsed, top_k)
+
+        positions, metadata = self._gather_candidates(snapshot, criteria, top_k, deadline)
+
+        # 2. 使用 Gemini 進行智能排序
+        if use_ai_ranking and len(positions) > 0:
+            # 先按用戶數與 token 預算裁剪候選，提示詞大小不再隨數據庫增長
+            candidates, candidate_tokens = self._select_candidates(snapshot, positions, criteria, top_k)
+            metadata["candidates_considered"] = len(candidates)
+            metadata["candidate_tokens"] = candidate_tokens
+            if candidates:
+                ranked_users, ai_ok = self._rank_with_ai(snapshot, candidates, criteria, top_k, deadline)
+            else:
+                ranked_users, ai_ok = [], True
+            metadata["ranking"] = "ai" if ai_ok else "fallback"
+            if deadline is not None and deadline.expired():
+                metadata["deadline_exceeded"] = True
+        else:
+            metadata["candidates_considered"] = len(positions)
+            metadata["ranking"] = "local"
+            ranked_users = snapshot.rank_local(positions, criteria, top_k, self.ranker)
+
+        return ranked_users, metadata
+
+    def recommend_stream(
+        self,
+        criteria: Dict[str, Any],
+        top_k: int = 5,
+        deadline: Optional[Deadline] = None
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        流式推薦：邊接收 Gemini 的流式輸出邊解析 ID，每解析出一個就立即產出對應用戶
+
+        Args:
+            criteria: 推薦條件
+            top_k: 返回前 k 個推薦結果
+            deadline: 端到端截止時間，時間用完後停止接收並按候選順序補足
+
+        Yields:
+            ("metadata", 統計信息)，然後若干個 ("user", 用戶)，最後 ("done", 統計信息)
+        """
+        snapshot = self.catalog.snapshot()
+
+        cache_key = make_cache_key(criteria, top_k=top_k, use_ai_ranking=True, version=snapshot.version)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            ranked_users, metadata = cached
+            yield "metadata", dict(metadata, cache="hit")
+            for user in ranked_users:
+                yield "user", user
+            yield "done", {"count": len(ranked_users), "ranking": metadata.get("ranking")}
+            return
+
+        parsed = self._parse_description(snapshot, criteria)
+        if parsed is not None:
+            # 描述已被本地解析，結果一次算完，不需要流式調用 Gemini
+            ranked_users, metadata = self._recommend_parsed(snapshot, *parsed, top_k)
+            self.cache.put(cache_key, (list(ranked_users), metadata))
+            yield "metadata", dict(metadata, cache="miss")
+            for user in ranked_users:
+                yield "user", user
+            yield "done", {"count": len(ranked_users), "ranking": metadata["ranking"]}
+            return
+
+        positions, metadata = self._gather_candidates(snapshot, criteria, top_k, deadline)
+        candidates, candidate_tokens = [], 0
+        if positions:
+            candidates, candidate_tokens = self._select_candidates(snapshot, positions, criteria, top_k)
+        metadata["candidates_considered"] = len(candidates)
+        metadata["candidate_tokens"] = candidate_tokens
+        yield "metadata", dict(metadata, cache="miss")
+
+        id_to_user = {user['id']: user for user in candidates}
+        emitted: List[Dict] = []
+        emitted_ids = set()
+        ai_ok = True
+
+        if candidates:
+            print(f"🤖 使用 Gemini AI 進行流式排序...")
+            prompt = self._build_ranking_prompt(snapshot, candidates, criteria, top_k)
+            buffer = ""
+            scanned = 0
+            try:
+                for chunk in self.client.stream_text(
+                    prompt=prompt,
+                    temperature=0.3,
+                    max_tokens=ranking_max_tokens(top_k),
+                    deadline=deadline,
+                    response_mime_type="application/json",
+                    response_schema=RANKING_SCHEMA
+                ):
+                    buffer += chunk
+                    user_ids, scanned = _scan_complete_ids(buffer, scanned, final=False)
+                    for user_id in user_ids:
+                        user = id_to_user.get(user_id)
+                        if user is not None and user_id not in emitted_ids and len(emitted) < top_k:
+                            emitted.append(user)
+                            emitted_ids.add(user_id)
+                            yield "user", user
+                    if len(emitted) >= top_k:
+                        break
+                else:
+                    # 流結束：最後一個 ID 後面可能沒有分隔符
+                    user_ids, _ = _scan_complete_ids(buffer, scanned, final=True)
+                    for user_id in user_ids:
+                        user = id_to_user.get(user_id)
+                        if user is not None and user_id not in emitted_ids and len(emitted) < top_k:
+                            emitted.append(user)
+                            emitted_ids.add(user_id)
+                            yield "user", user
+            except requests.exceptions.RequestException as e:
+                print(f"⚠️  AI 流式排序失敗，使用本地排序結果: {e}")
+                ai_ok = False
+
+        if deadline is not None and deadline.expired():
+            # 流被截止時間截斷，結果不完整
+            ai_ok = False
+            metadata["deadline_exceeded"] = True
+
+        # AI 返回不足時補足：AI 正常時按候選順序，失敗時按本地排序
+        remaining = candidates if ai_ok else self._local_fallback(candidates, criteria, top_k)
+        for user in remaining:
+            if len(emitted) >= top_k:
+                break
+            if user['id'] not in emitted_ids:
+                emitted.append(user)
+                emitted_ids.add(user['id'])
+                yield "user", user
+        metadata["ranking"] = "ai" if ai_ok else "fallback"
+        if ai_ok:
+            self.cache.put(cache_key, (list(emitted), metadata))
+
+        yield "done", {"count": len(emitted), "ranking": metadata["ranking"]}
+
+    def _parse_description(
+        self,
+        snapshot: CatalogSnapshot,
+        criteria: Dict[str, Any]
+    ) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        用本地解析器把描述轉成結構化條件
+
+        Args:
+            snapshot: 本次請求使用的目錄快照
+            criteria: 推薦條件
+
+        Returns:
+            解析足夠可靠時返回 (結構化條件, 解析結果)，否則 None（交給 Gemini）
+        """
+        description = criteria.get("description")
+        if not self.parse_descriptions or not description:
+            return None
+
+        parsed = snapshot.parser.parse(description)
+        if not parsed["confident"]:
+            if parsed["criteria"]:
+                print(f"🤔 描述解析置信度 {parsed['confidence']:.2f}，未識別: {', '.join(parsed['unmatched'])}")
+            return None
+
+        # 請求中明確給出的條件優先於從描述中解析出的條件
+        structured = dict(parsed["criteria"])
+        structured.update({k: v for k, v in criteria.items() if k != "description" and v is not None and v != ""})
+        return structured, parsed
+
+    def _recommend_parsed(
+        self,
+        snapshot: CatalogSnapshot,
+        structured: Dict[str, Any],
+        parsed: Dict[str, Any],
+        top_k: int
+    ) -> Tuple[List[Dict], Dict[str, Any]]:
+        """
+        按解析出的結構化條件過濾並本地排序
+
+        Args:
+            snapshot: 本次請求使用的目錄快照
+            structured: 結構化條件
+            parsed: 解析結果（用於統計信息）
+            top_k: 返回前 k 個推薦結果
+
+        Returns:
+            (推薦的用戶列表, 統計信息)
+        """
+        print(f"🧩 描述解析為結構化條件（置信度 {parsed['confidence']:.2f}）: {structured}")
+        positions = snapshot.filter(structured)
+        if len(positions) < top_k:
+            # 完全匹配不足時放寬為部分匹配，由本地排序按匹配程度取前 top_k（性別仍是硬性條件）
+            positions = snapshot.filter(structured, strict=False)
+
+        metadata = {
+            "catalog_size": snapshot.size,
+            "catalog_version": snapshot.version,
+            "search_mode": "parsed",
+            "parsed_criteria": structured,
+            "parse_confidence": parsed["confidence"],
+            "matched": len(positions),
+            "candidates_considered": len(positions),
+            "ranking": "local",
+        }
+        return snapshot.rank_local(positions, structured, top_k, self.ranker), metadata
+
+    def _gather_candidates(
+        self,
+        snapshot: CatalogSnapshot,
+        criteria: Dict[str, Any],
+        top_k: int,
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[List[int], Dict[str, Any]]:
+        """
+        過濾或召回候選用戶（排序前的所有步驟；只返回位置，排序後才物化用戶）
+
+        Args:
+            snapshot: 本次請求使用的目錄快照
+            criteria: 推薦條件
+            top_k: 返回前 k 個推薦結果
+            deadline: 端到端截止時間（語義召回的查詢嵌入使用）
+
+        Returns:
+            (候選用戶位置列表, 統計信息)
+        """
+        metadata: Dict[str, Any] = {"catalog_size": snapshot.size, "catalog_version": snapshot.version}
+
         # Check if this is a description-only search (free-form text)
         has_description = 'description' in criteria and criteria['description']
         other_criteria = {k: v for k, v in criteria.items() if k != 'description' and v}
 
-        # If only description is provided, let AI handle all users
+        # If only description is provided, retrieve a bounded candidate window for AI ranking
         if has_description and not other_criteria:
             print(f"🎯 使用描述搜索: {criteria['description'][:50]}...")
-            filtered_users = self.users  # Use all users for AI ranking
-            print(f"📊 將從 {len(filtered_users)} 個用戶中使用 AI 篩選")
+            positions, metadata["retrieval"] = self._retrieve_for_description(snapshot, criteria, top_k, deadline)
+            metadata["search_mode"] = "description"
+            print(f"📊 從 {snapshot.size} 個用戶中召回 {len(positions)} 個候選用戶")
         else:
             # 1. 基礎過濾：找出符合基本條件的用戶
-            filtered_users = self._filter_users(criteria)
+            positions = snapshot.filter(criteria)
+            metadata["search_mode"] = "criteria"
 
-            print(f"📊 基礎過濾後找到 {len(filtered_users)} 個匹配用戶")
+            print(f"📊 基礎過濾後找到 {len(positions)} 個匹配用戶")
 
-            if len(filtered_users) == 0:
+            if len(positions) == 0:
                 print("⚠️  沒有找到完全匹配的用戶，嘗試放寬條件...")
-                filtered_users = self._filter_users(criteria, strict=False)
-                print(f"📊 放寬條件後找到 {len(filtered_users)} 個用戶")
+                positions = snapshot.filter(criteria, strict=False)
+                print(f"📊 放寬條件後找到 {len(positions)} 個用戶")
 
             # 確保至少有 top_k 個用戶
-            if len(filtered_users) < top_k:
+            if len(positions) < top_k:
                 print(f"⚠️  用戶數量不足 {top_k} 個，從所有用戶中隨機補充...")
-                # 獲取所有用戶 ID
-                filtered_ids = set(user['id'] for user in filtered_users)
-                # 從剩餘用戶中隨機選擇
-                remaining_users = [u for u in self.users if u['id'] not in filtered_ids]
-                import random
-                random.shuffle(remaining_users)
-                # 補充到 top_k 個
-                needed = top_k - len(filtered_users)
-                filtered_users.extend(remaining_users[:needed])
-                print(f"📊 補充後共有 {len(filtered_users)} 個用戶")
+                positions.extend(snapshot.sample_remaining(positions, top_k - len(positions)))
+                print(f"📊 補充後共有 {len(positions)} 個用戶")
 
-        # 2. 使用 Gemini 進行智能排序
-        if use_ai_ranking and len(filtered_users) > 0:
-            ranked_users = self._rank_with_ai(filtered_users, criteria, top_k)
-        else:
-            ranked_users = filtered_users[:top_k]
+        metadata["matched"] = len(positions)
+        return positions, metadata
 
-        return ranked_users
+    def _retrieve_for_description(
+        self,
+        snapshot: CatalogSnapshot,
+        criteria: Dict[str, Any],
+        top_k: int,
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[List[int], str]:
+        """
+        描述搜索的廉價召回：性別硬過濾 + 語義向量相似度（未啟用或失敗時用關鍵詞重疊）
+
+        Args:
+            snapshot: 本次請求使用的目錄快照
+            criteria: 只包含 description 的搜索條件
+            top_k: 返回前 k 個推薦結果
+            deadline: 端到端截止時間
+
+        Returns:
+            (候選用戶位置列表（大小有上限，不隨數據庫增長）, 召回方式 "embedding" / "keyword")
+        """
+        query = self.ranker.prepare(criteria)
+        within = snapshot.lookup("gender", query["gender"]) if query.get("gender") else None
+        pool_size = max(self.candidate_limit, top_k) * RETRIEVAL_POOL_FACTOR
+
+        if snapshot.embeddings is not None:
+            try:
+                positions = snapshot.search_embeddings(
+                    criteria["description"], pool_size, within=within, deadline=deadline
+                )
+                return positions, "embedding"
+            except requests.exceptions.RequestException as e:
+                print(f"⚠️  語義召回失敗，改用關鍵詞召回: {e}")
+
+        return snapshot.search_text(criteria["description"], pool_size, within=within), "keyword"
+
+    def _select_candidates(
+        self,
+        snapshot: CatalogSnapshot,
+        positions: List[int],
+        criteria: Dict[str, Any],
+        top_k: int
+    ) -> Tuple[List[Dict], int]:
+        """
+        按候選預算裁剪送進 AI 排序的用戶
+
+        Args:
+            snapshot: 本次請求使用的目錄快照
+            positions: 候選用戶位置
+            criteria: 搜索條件
+            top_k: 返回前 k 個推薦結果
+
+        Returns:
+            (裁剪後的候選用戶, 候選列表的估算 token 數)
+        """
+        limit = max(self.candidate_limit, top_k)
+        if len(positions) > limit:
+            candidates = snapshot.rank_local(positions, criteria, limit, self.ranker)
+            print(f"📉 本地預排序後保留 {len(candidates)} 個候選用戶")
+        else:
+            candidates = snapshot.users_at(positions)
+
+        selected = []
+        total_tokens = 0
+        for user in candidates:
+            tokens = self._candidate_tokens(snapshot, user)
+            # token 預算不足時停止，但至少保留 top_k 個候選
+            if (self.candidate_token_budget is not None
+                    and len(selected) >= top_k
+                    and total_tokens + tokens > self.candidate_token_budget):
+                print(f"📉 候選列表達到 token 預算 {self.candidate_token_budget}，保留 {len(selected)} 個候選用戶")
+                break
+            selected.append(user)
+            total_tokens += tokens
+
+        return selected, total_tokens
+
+    def _candidate_tokens(self, snapshot: CatalogSnapshot, user: Dict) -> int:
+        """單個候選在提示詞中的估算 token 數"""
+        if self.prompt_encoding == "compact":
+            return snapshot.encoder.fragment_tokens(user)
+        return estimate_tokens(self._format_candidate(user))
 
     def _filter_users(self, criteria: Dict[str, Any], strict: bool = True) -> List[Dict]:
         """
-        過濾用戶
+        過濾用戶（使用當前快照）
 
         Args:
             criteria: 過濾條件
@@ -102,120 +745,202 @@ class UserRecommendationSystem:
         Returns:
             符合條件的用戶列表
         """
-        filtered = []
+        snapshot = self.catalog.snapshot()
+        return snapshot.users_at(snapshot.filter(criteria, strict=strict))
 
-        for user in self.users:
-            match_count = 0
-            total_criteria = 0
+    def _rank_with_ai(
+        self,
+        snapshot: CatalogSnapshot,
+        users: List[Dict],
+        criteria: Dict[str, Any],
+        top_k: int,
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[List[Dict], bool]:
+        """
+        使用 Gemini AI 對用戶進行智能排序
 
-            for key, value in criteria.items():
-                if value is None or value == "":
-                    continue
+        Args:
+            snapshot: 本次請求使用的目錄快照
+            users: 待排序的用戶列表
+            criteria: 用戶的搜索條件
+            top_k: 返回前 k 個結果
+            deadline: 端到端截止時間
 
-                total_criteria += 1
+        Returns:
+            (排序後的用戶列表, AI 排序是否成功；失敗時按候選原順序返回)
+        """
+        # 候選多於一個分片時分片並行排序，否則一次調用
+        if self.shard_size and top_k < self.shard_size < len(users):
+            return self._rank_with_ai_sharded(snapshot, users, criteria, top_k, deadline)
+        return self._rank_batch(snapshot, users, criteria, top_k, deadline=deadline)
 
-                if key == "location":
-                    # Exact match for location
-                    if user["location"].lower() == value.lower():
-                        match_count += 1
-                elif key == "hobby":
-                    # 支持單個興趣或興趣列表
-                    target_hobbies = [value] if isinstance(value, str) else value
-                    user_hobbies_str = " ".join(user["hobby"]).lower()
-
-                    for hobby in target_hobbies:
-                        if hobby.lower() in user_hobbies_str:
-                            match_count += 1
-                            break
-                elif key == "occupation":
-                    if value.lower() in user["occupation"].lower() or user["occupation"].lower() in value.lower():
-                        match_count += 1
-                elif key == "age_min":
-                    if user["age"] >= value:
-                        match_count += 1
-                elif key == "age_max":
-                    if user["age"] <= value:
-                        match_count += 1
-                elif key == "gender":
-                    if user["gender"].lower() == value.lower():
-                        match_count += 1
-                else:
-                    # 其他條件直接比對
-                    if str(user.get(key, "")).lower() == str(value).lower():
-                        match_count += 1
-
-            # 嚴格模式：必須全部匹配；寬鬆模式：至少匹配一個
-            if strict:
-                if total_criteria > 0 and match_count == total_criteria:
-                    filtered.append(user)
-            else:
-                if match_count > 0:
-                    filtered.append(user)
+    def _rank_with_ai_sharded(
+        self,
+        snapshot: CatalogSnapshot,
+        users: List[Dict],
+        criteria: Dict[str, Any],
+        top_k: int,
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[List[Dict], bool]:
+        """
+        分片錦標賽排序：候選輪流分到各分片並行排序，
+        每個分片的勝出者再進入下一輪，直到剩下一個分片做最終比較
 
-        return filtered
+        Args:
+            snapshot: 本次請求使用的目錄快照
+            users: 待排序的用戶列表（已按本地預排序由好到差排列）
+            criteria: 用戶的搜索條件
+            top_k: 返回前 k 個結果
+            deadline: 端到端截止時間（所有分片共享；過期後各輪直接使用本地順序）
 
-    def _rank_with_ai(
+        Returns:
+            (排序後的用戶列表, 所有 AI 調用是否都成功)
+        """
+        shard_count = -(-len(users) // self.shard_size)
+        # 輪流分配，讓每個分片都有好有差，強候選不會在同一個分片裡互相淘汰
+        shards = [users[i::shard_count] for i in range(shard_count)]
+        print(f"🧩 將 {len(users)} 個候選分成 {shard_count} 個分片並行排序...")
+
+        workers = min(self.max_shard_workers, shard_count)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(
+                lambda shard: self._rank_batch(snapshot, shard, criteria, top_k, pad=False, deadline=deadline),
+                shards
+            ))
+
+        all_ok = all(ok for _, ok in results)
+        shard_winners = []
+        for shard, (ranked, _) in zip(shards, results):
+            # AI 返回不足時按分片內的本地順序補足
+            picked = {user['id'] for user in ranked}
+            ranked = ranked + [u for u in shard if u['id'] not in picked]
+            shard_winners.append(ranked[:top_k])
+
+        # 按名次交錯合併：各分片第一名在前，其次第二名……
+        finalists = [
+            winners[i]
+            for i in range(top_k)
+            for winners in shard_winners
+            if i < len(winners)
+        ]
+
+        # 只有本輪確實淘汰了候選才進入下一輪，否則（分片只比 top_k 略大時）直接最終排序
+        if self.shard_size < len(finalists) < len(users):
+            ranked, ok = self._rank_with_ai_sharded(snapshot, finalists, criteria, top_k, deadline)
+            return ranked, all_ok and ok
+
+        print(f"🏁 從 {len(finalists)} 個分片勝出者中進行最終排序...")
+        ranked, ok = self._rank_batch(snapshot, finalists, criteria, top_k, pad=False, deadline=deadline)
+        picked = {user['id'] for user in ranked}
+        ranked = ranked + [u for u in finalists if u['id'] not in picked]
+        return ranked[:top_k], all_ok and ok
+
+    def _rank_batch(
         self,
+        snapshot: CatalogSnapshot,
         users: List[Dict],
         criteria: Dict[str, Any],
-        top_k: int
-    ) -> List[Dict]:
+        top_k: int,
+        pad: bool = True,
+        deadline: Optional[Deadline] = None
+    ) -> Tuple[List[Dict], bool]:
         """
-        使用 Gemini AI 對用戶進行智能排序
+        用一次 Gemini 調用對一批候選排序
 
         Args:
+            snapshot: 本次請求使用的目錄快照
             users: 待排序的用戶列表
             criteria: 用戶的搜索條件
             top_k: 返回前 k 個結果
+            pad: AI 返回不足 top_k 時是否按候選原順序補足
+            deadline: 端到端截止時間
 
         Returns:
-            排序後的用戶列表
+            (排序後的用戶列表, AI 排序是否成功；失敗時按候選原順序返回)
         """
         print(f"🤖 使用 Gemini AI 進行智能排序...")
 
         # 構建提示詞
-        prompt = self._build_ranking_prompt(users, criteria, top_k)
+        prompt = self._build_ranking_prompt(snapshot, users, criteria, top_k)
 
         # 調用 Gemini
         response = self.client.generate_text(
             prompt=prompt,
             temperature=0.3,  # 較低的溫度以獲得更穩定的結果
-            max_tokens=2000
+            max_tokens=ranking_max_tokens(top_k),
+            deadline=deadline,
+            response_mime_type="application/json",
+            response_schema=RANKING_SCHEMA
         )
 
+        if "error" in response:
+            print(f"⚠️  AI 排序失敗，使用本地排序結果: {response['error']}")
+            return self._local_fallback(users, criteria, top_k), False
+
         # 提取結果
         ai_response = self.client.extract_text(response)
 
-        # 解析 AI 的排序結果
-        ranked_users = self._parse_ranking_result(ai_response, users)
+        # 解析 AI 的排序結果；一個有效 ID 都沒有時視為失敗（不緩存），改用本地排序
+        ranked_users = self._parse_ranking_result(ai_response, users, pad=False)
+        if not ranked_users:
+            print(f"⚠️  AI 排序結果無法解析，使用本地排序結果: {ai_response[:200]}")
+            return self._local_fallback(users, criteria, top_k), False
+
+        if pad:
+            picked = {user['id'] for user in ranked_users}
+            ranked_users += [user for user in users if user['id'] not in picked]
+
+        return ranked_users[:top_k], True
+
+    def _local_fallback(self, users: List[Dict], criteria: Dict[str, Any], top_k: int) -> List[Dict]:
+        """
+        AI 不可用時的本地排序（不發送任何請求，毫秒級返回）
+
+        Args:
+            users: 待排序的用戶列表
+            criteria: 用戶的搜索條件
+            top_k: 返回前 k 個結果
 
-        return ranked_users[:top_k]
+        Returns:
+            LocalRanker 排序結果；被性別條件排除導致不足 top_k 時按原順序補足
+        """
+        ranked = self.ranker.rank(users, criteria, top_k)
+        if len(ranked) < top_k:
+            picked = {user['id'] for user in ranked}
+            ranked += [user for user in users if user['id'] not in picked][:top_k - len(ranked)]
+        return ranked
 
     def _build_ranking_prompt(
         self,
+        snapshot: CatalogSnapshot,
         users: List[Dict],
         criteria: Dict[str, Any],
-        top_k: int
+        top_k: int,
+        encoding: Optional[str] = None
     ) -> str:
-        """構建 Gemini 排序提示詞"""
-
-        # 構建用戶信息字符串（包含外觀特征）
-        users_info = []
-        for i, user in enumerate(users, 1):
-            # 基本信息
-            user_str = f"{i}. ID:{user['id']}, {user['name']}, {user['age']}歲, {user['gender']}, {user['occupation']}, {user['location']}"
-
-            # 興趣
-            user_str += f", 興趣:{', '.join(user['hobby'])}"
-
-            # 外觀特征（如果存在）
-            if 'appearance' in user:
-                app = user['appearance']
-                user_str += f", 外觀:[{app['style']} style, {app['hair_length']} {app['hair_color']} hair, {app['eye_color']} eyes]"
+        """
+        構建 Gemini 排序提示詞
 
-            users_info.append(user_str)
+        Args:
+            snapshot: 本次請求使用的目錄快照（提供緊湊編碼的片段）
+            users: 候選用戶
+            criteria: 搜索條件
+            top_k: 返回數量
+            encoding: 候選編碼（默認使用 self.prompt_encoding）
 
-        users_text = "\n".join(users_info)
+        Returns:
+            提示詞
+        """
+        if (encoding or self.prompt_encoding) == "compact":
+            # 預先生成的片段 + 本次用到的代碼圖例；描述提到名字時才保留名字
+            include_names = bool(criteria.get("description")) and snapshot.encoder.mentioned_names(
+                users, criteria["description"]
+            )
+            users_text = snapshot.encoder.encode(users, include_names=include_names)
+        else:
+            # 構建用戶信息字符串（包含外觀特征）
+            users_info = [f"{i}. {self._format_candidate(user)}" for i, user in enumerate(users, 1)]
+            users_text = "\n".join(users_info)
 
         # 構建條件字符串
         criteria_parts = []
@@ -239,6 +964,10 @@ class UserRecommendationSystem:
                     criteria_parts.append(f"年齡最多 {value} 歲")
                 elif key == "gender":
                     criteria_parts.append(f"性別是 {value}")
+                elif key in APPEARANCE_KEYS:
+                    criteria_parts.append(f"外觀 {key} 是 {value}")
+                elif key == "query":
+                    criteria_parts.append(f"滿足布爾條件 {compile_query(value).describe()}")
 
         # If user provided a description, use it as the main criteria
         if user_description:
@@ -269,54 +998,100 @@ class UserRecommendationSystem:
 - 如果用戶描述中明確要求特定性別（如 "looking for female"），請只返回該性別的用戶。性別要求是硬性條件。
 - 如果用戶描述中提到外觀特征（如 "blonde hair", "long hair", "anime style"），請優先返回符合這些特征的用戶。
 
-請按照以下格式輸出推薦結果（只輸出 ID，用逗號分隔，不要有其他說明）：
-ID1, ID2, ID3, ID4, ID5
-
-例如：42, 17, 89, 3, 56"""
+請以 JSON 數組輸出最匹配的 {top_k} 個用戶 ID（按匹配度從高到低，不要有其他說明），例如：
+[42, 17, 89, 3, 56]"""
 
         return prompt
 
-    def _parse_ranking_result(self, ai_response: str, users: List[Dict]) -> List[Dict]:
+    def prompt_token_report(self, criteria: Dict[str, Any], top_k: int = 5) -> Dict[str, Any]:
+        """
+        比較同一次請求在兩種候選編碼下的提示詞 token 數（優先使用 Gemini countTokens）
+
+        Args:
+            criteria: 搜索條件
+            top_k: 返回數量
+
+        Returns:
+            候選數、兩種編碼的 token 數、節省的 token 數與比例、計數方式
+        """
+        snapshot = self.catalog.snapshot()
+        positions, _ = self._gather_candidates(snapshot, criteria, top_k)
+        candidates, _ = self._select_candidates(snapshot, positions, criteria, top_k)
+
+        counts = {}
+        method = "count_tokens"
+        for encoding in ("verbose", "compact"):
+            prompt = self._build_ranking_prompt(snapshot, candidates, criteria, top_k, encoding=encoding)
+            response = self.client.count_tokens(prompt)
+            if "totalTokens" in response and method == "count_tokens":
+                counts[encoding] = response["totalTokens"]
+            else:
+                # API 不可用時退回本地估算（兩種編碼使用同一種計數方式）
+                method = "estimate"
+                counts = {
+                    enc: estimate_tokens(self._build_ranking_prompt(snapshot, candidates, criteria, top_k, encoding=enc))
+                    for enc in ("verbose", "compact")
+                }
+                break
+
+        saved = counts["verbose"] - counts["compact"]
+        return {
+            "candidates": len(candidates),
+            "verbose_tokens": counts["verbose"],
+            "compact_tokens": counts["compact"],
+            "saved_tokens": saved,
+            "saved_ratio": round(saved / counts["verbose"], 4) if counts["verbose"] else 0.0,
+            "method": method,
+        }
+
+    def _format_candidate(self, user: Dict) -> str:
+        """構建單個候選用戶在提示詞中的描述"""
+        # 基本信息
+        user_str = f"ID:{user['id']}, {user['name']}, {user['age']}歲, {user['gender']}, {user['occupation']}, {user['location']}"
+
+        # 興趣
+        user_str += f", 興趣:{', '.join(user['hobby'])}"
+
+        # 外觀特征（如果存在）
+        if 'appearance' in user:
+            app = user['appearance']
+            user_str += f", 外觀:[{app['style']} style, {app['hair_length']} {app['hair_color']} hair, {app['eye_color']} eyes]"
+
+        return user_str
+
+    def _parse_ranking_result(self, ai_response: str, users: List[Dict], pad: bool = True) -> List[Dict]:
         """
         解析 AI 的排序結果
 
         Args:
             ai_response: AI 的回應文本
             users: 原始用戶列表
+            pad: 是否用剩餘用戶補足（False 時只返回 AI 明確排出的用戶）
 
         Returns:
             排序後的用戶列表
         """
-        try:
-            # 提取 ID
-            # 尋找數字序列
-            import re
-            # 移除所有非數字和逗號的字符，然後分割
-            numbers_line = ai_response.strip().split('\n')[-1]  # 取最後一行
-            ids_str = re.sub(r'[^0-9,]', '', numbers_line)
-            ranked_ids = [int(id_str.strip()) for id_str in ids_str.split(',') if id_str.strip()]
-
-            # 根據 ID 排序用戶
-            id_to_user = {user['id']: user for user in users}
-            ranked_users = []
-
-            for user_id in ranked_ids:
-                if user_id in id_to_user:
-                    ranked_users.append(id_to_user[user_id])
-
-            # 如果 AI 沒有返回足夠的用戶，補充剩餘的用戶
-            existing_ids = set(ranked_ids)
-            for user in users:
-                if user['id'] not in existing_ids and len(ranked_users) < len(users):
-                    ranked_users.append(user)
+        ranked_ids = _parse_ranked_ids(ai_response)
+
+        # 根據 ID 排序用戶
+        id_to_user = {user['id']: user for user in users}
+        ranked_users = []
 
+        existing_ids = set()
+        for user_id in ranked_ids:
+            if user_id in id_to_user and user_id not in existing_ids:
+                ranked_users.append(id_to_user[user_id])
+                existing_ids.add(user_id)
+
+        if not pad:
             return ranked_users
 
-        except Exception as e:
-            print(f"⚠️  解析 AI 結果時出錯: {e}")
-            print(f"AI 回應: {ai_response}")
-            # 如果解析失敗，返回原始列表
-            return users
+        # 如果 AI 沒有返回足夠的用戶，補充剩餘的用戶
+        for user in users:
+            if user['id'] not in existing_ids:
+                ranked_users.append(user)
+
+        return ranked_users
 
     def save_recommendations(self, recommendations: List[Dict], output_file: str = "recommendations.json"):
         """
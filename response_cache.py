@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Gemini 響應持久化緩存（SQLite）
+以 模型 + 端點 + 規範化請求負載 的哈希為鍵，跨進程、跨重啟復用相同提示詞的響應；
+只緩存白名單內的端點和低溫度的生成請求，按條目數與總大小淘汰最久未訪問的條目
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, Iterable
+
+
+DEFAULT_ENDPOINTS = ("generateContent", "countTokens", "batchEmbedContents")
+
+# 溫度高於此值的生成結果不復用（請求合併沿用同一規則）
+DEFAULT_MAX_TEMPERATURE = 0.5
+
+
+class ResponseCache:
+    """基於 SQLite 的 Gemini 響應緩存"""
+
+    def __init__(
+        self,
+        path: str = ".gemini_cache.sqlite3",
+        max_entries: int = 10000,
+        max_bytes: int = 256 * 1024 * 1024,
+        endpoints: Iterable[str] = DEFAULT_ENDPOINTS,
+        max_temperature: float = DEFAULT_MAX_TEMPERATURE
+    ):
+        """
+        初始化緩存
+
+        Args:
+            path: SQLite 文件路徑
+            max_entries: 最多緩存的響應數
+            max_bytes: 緩存響應的總大小上限
+            endpoints: 允許緩存的端點（如 generateContent、countTokens）
+            max_temperature: 只緩存溫度不高於此值的生成請求（溫度越高結果越不應復用）
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.endpoints = set(endpoints)
+        self.max_temperature = max_temperature
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL 模式允許多個 gunicorn worker 同時讀寫
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, endpoint: str, payload: Dict[str, Any]) -> str:
+        """
+        生成緩存鍵
+
+        Args:
+            model: 模型名稱
+            endpoint: 端點名稱（如 generateContent）
+            payload: 請求負載
+
+        Returns:
+            SHA-256 十六進制字符串
+        """
+        canonical = json.dumps(
+            {"model": model, "endpoint": endpoint, "payload": payload},
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def is_cacheable(self, endpoint: str, payload: Dict[str, Any]) -> bool:
+        """
+        判斷請求是否允許緩存
+
+        Args:
+            endpoint: 端點名稱
+            payload: 請求負載
+
+        Returns:
+            是否允許緩存
+        """
+        if endpoint not in self.endpoints:
+            return False
+        temperature = payload.get("generationConfig", {}).get("temperature")
+        return temperature is None or temperature <= self.max_temperature
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        讀取緩存的響應
+
+        Args:
+            key: 緩存鍵
+
+        Returns:
+            響應 dict，未命中時返回 None
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, endpoint: str, response: Dict[str, Any]):
+        """
+        寫入響應並按上限淘汰最久未訪問的條目
+
+        Args:
+            key: 緩存鍵
+            model: 模型名稱
+            endpoint: 端點名稱
+            response: API 響應
+        """
+        data = json.dumps(response, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, endpoint, data, size, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """淘汰超出條目數或總大小上限的最舊條目（調用方持有鎖）"""
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        excess_bytes = total - self.max_bytes
+        excess_count = count - self.max_entries
+        freed = 0
+        removed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if removed >= excess_count and freed >= excess_bytes:
+                break
+            victims.append((key,))
+            removed += 1
+            freed += size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def clear(self):
+        """清空緩存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回緩存統計"""
+        with self._lock:
+            count, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "path": self.path,
+            "entries": count,
+            "bytes": total,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+排序提示詞 token 節省報告
+對幾組典型搜索條件分別用逐項描述與緊湊編碼構建排序提示詞，
+通過 Gemini countTokens 比較 token 數（API 不可用時使用本地估算）
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from recommendation_system import UserRecommendationSystem
+
+
+SAMPLE_CRITERIA = [
+    {"gender": "female"},
+    {"location": "New York"},
+    {"hobby": ["Music", "Travel"], "age_min": 25, "age_max": 35},
+    {"description": "looking for a woman with long blonde hair who loves hiking"},
+]
+
+
+def main():
+    """打印每組條件的 token 對比"""
+    rec_system = UserRecommendationSystem()
+
+    print(f"\n{'搜索條件':<60} {'候選':>4} {'逐項':>6} {'緊湊':>6} {'節省':>7}")
+    print("=" * 90)
+    for criteria in SAMPLE_CRITERIA:
+        report = rec_system.prompt_token_report(criteria, top_k=5)
+        print(
+            f"{str(criteria)[:60]:<60} {report['candidates']:>4} "
+            f"{report['verbose_tokens']:>6} {report['compact_tokens']:>6} "
+            f"{report['saved_ratio']:>6.1%}"
+        )
+    print(f"\n計數方式: {report['method']}")
+
+
+if __name__ == "__main__":
+    main()
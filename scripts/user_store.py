@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+SQLite 用戶存儲的導入 / 導出與查詢工具
+
+  python scripts/user_store.py import users_database.json users.db
+  python scripts/user_store.py export users.db users_database.json
+  python scripts/user_store.py query users.db --location Miami --hobby Music --limit 10
+  python scripts/user_store.py update users.db 42 '{"location": "Seattle"}'
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlite_store import SQLiteUserStore
+
+
+def cmd_import(args):
+    """從 JSON 導入（替換存儲中的全部用戶）"""
+    store = SQLiteUserStore(args.database)
+    count = store.import_json(args.json_path)
+    print(f"✅ 已導入 {count} 個用戶到 {args.database}（版本 {store.version()}）")
+
+
+def cmd_export(args):
+    """導出為 users_database.json 格式"""
+    store = SQLiteUserStore(args.database)
+    count = store.export_json(args.json_path)
+    print(f"💾 已導出 {count} 個用戶到 {args.json_path}")
+
+
+def cmd_query(args):
+    """按條件分頁查詢"""
+    store = SQLiteUserStore(args.database)
+    criteria = {
+        "location": args.location,
+        "gender": args.gender,
+        "occupation": args.occupation,
+        "hobby": args.hobby,
+        "age_min": args.age_min,
+        "age_max": args.age_max,
+    }
+    criteria = {k: v for k, v in criteria.items() if v is not None}
+    page = store.page(criteria, strict=not args.relaxed, limit=args.limit, cursor=args.cursor)
+
+    total = store.count(criteria, strict=not args.relaxed) if criteria else store.size
+    print(f"📊 共 {total} 個匹配用戶，本頁 {len(page['users'])} 個")
+    for user in page["users"]:
+        print(f"  {user['id']:>6}  {user['name']:<24} {user['age']:>3}  {user['gender']:<7} {user['location']:<16} {user['occupation']}")
+    if page["next_cursor"] is not None:
+        print(f"➡️  下一頁: --cursor {page['next_cursor']}")
+
+
+def cmd_update(args):
+    """原地更新單個用戶"""
+    store = SQLiteUserStore(args.database)
+    user = store.update_user(args.user_id, json.loads(args.changes))
+    print(f"✅ 已更新用戶 {user['id']}（版本 {store.version()}）")
+    print(json.dumps(user, ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 用戶存儲工具")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("import", help="從 JSON 導入")
+    p.add_argument("json_path")
+    p.add_argument("database")
+    p.set_defaults(func=cmd_import)
+
+    p = commands.add_parser("export", help="導出為 JSON")
+    p.add_argument("database")
+    p.add_argument("json_path")
+    p.set_defaults(func=cmd_export)
+
+    p = commands.add_parser("query", help="按條件分頁查詢")
+    p.add_argument("database")
+    p.add_argument("--location")
+    p.add_argument("--gender")
+    p.add_argument("--occupation")
+    p.add_argument("--hobby", action="append")
+    p.add_argument("--age-min", type=int)
+    p.add_argument("--age-max", type=int)
+    p.add_argument("--relaxed", action="store_true", help="滿足任意一個條件即可")
+    p.add_argument("--limit", type=int, default=20)
+    p.add_argument("--cursor", type=int)
+    p.set_defaults(func=cmd_query)
+
+    p = commands.add_parser("update", help="更新單個用戶")
+    p.add_argument("database")
+    p.add_argument("user_id", type=int)
+    p.add_argument("changes", help='JSON 對象，例如 \'{"location": "Seattle"}\'')
+    p.set_defaults(func=cmd_update)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
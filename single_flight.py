@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+請求合併（single-flight）
+相同鍵的並發調用只執行一次：第一個調用者（leader）執行計算，
+同時到達的其他調用者（follower）等待它完成並共享結果或異常；
+leader 的結果不可共享時（如被它自己的截止時間截斷的降級結果），follower 各自重新計算；
+計算結束後鍵立即移除，之後的調用重新執行（持久的結果由緩存負責）
+"""
+
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class _Flight:
+    """一次進行中的計算"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """線程安全的進程內請求合併"""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+        self.recomputed = 0
+
+    def do(
+        self,
+        key: str,
+        fn: Callable[[], Any],
+        timeout: Optional[float] = None,
+        shareable: Optional[Callable[[Any], bool]] = None
+    ) -> Tuple[Any, bool]:
+        """
+        執行或加入相同鍵的計算
+
+        Args:
+            key: 規範化後的請求鍵
+            fn: 計算函數（只由 leader 調用）
+            timeout: follower 最多等待的秒數（None=一直等待）；超時後自己調用 fn，
+                     調用方的截止時間此時已用完，fn 應能立即返回降級結果
+            shareable: 判斷 leader 的結果能否共享給 follower（None=總是共享）；
+                       不能共享時 follower 自己調用 fn，按自己的截止時間重新計算
+
+        Returns:
+            (結果, 是否共享了其他調用者的計算)
+
+        Raises:
+            fn 拋出的異常（follower 收到與 leader 相同的異常）
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+                leader = True
+            else:
+                flight.followers += 1
+                self.followers += 1
+                leader = False
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                with self._lock:
+                    self.timeouts += 1
+                return fn(), False
+            if flight.error is not None:
+                raise flight.error
+            if shareable is not None and not shareable(flight.result):
+                with self._lock:
+                    self.recomputed += 1
+                return fn(), False
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回合併統計：followers - timeouts - recomputed 即省下的重複計算次數"""
+        with self._lock:
+            calls = self.leaders + self.followers
+            saved = self.followers - self.timeouts - self.recomputed
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "coalesced_rate": round(saved / calls, 4) if calls else 0.0,
+                "timeouts": self.timeouts,
+                "recomputed": self.recomputed,
+            }
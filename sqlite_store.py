@@ -0,0 +1,721 @@
+#!/usr/bin/env python3
+"""
+基於 SQLite 的用戶存儲
+location / gender / occupation / age 與外觀字段是帶索引的列，興趣放在單獨的關聯表，
+資料詞放在 FTS5 全文索引；過濾、分頁讀取與單個用戶的更新都直接在磁盤上完成，
+不需要把整個 JSON 數據庫讀進內存再整個寫回去。
+每行同時保存完整的 JSON 記錄，導出時與原有的 users_database.json 格式一致；
+SQLiteSnapshot 是固定在某個數據版本上的只讀視圖，目錄快照用它直接在磁盤上查詢
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from bitset_index import mask_positions, to_mask
+from user_index import APPEARANCE_TERM_FIELDS, RANGE_KEYS, TermCache, profile_terms, tokenize
+
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+# 按等值查詢的索引列（大小寫不敏感）
+EQUALITY_COLUMNS = ("location", "gender") + APPEARANCE_TERM_FIELDS
+
+
+def is_sqlite_path(path: str) -> bool:
+    """按擴展名判斷數據庫文件是否為 SQLite"""
+    return path.lower().endswith(SQLITE_SUFFIXES)
+
+
+def _placeholders(count: int) -> str:
+    return ", ".join("?" * count)
+
+
+class _UserQueries:
+    """存儲與只讀快照共用的查詢生成（子類提供 _conn、_lock、has_fts 與 _vocab_version）"""
+
+    _conn: sqlite3.Connection
+    _lock: threading.Lock
+    _vocabulary: Dict[str, Tuple[str, List[str]]]
+    has_fts: bool
+
+    def _vocab_version(self) -> str:
+        raise NotImplementedError
+
+    def _search_query(self, text: str, limit: int, gender: Optional[str], column: str) -> Optional[Tuple[str, List[Any]]]:
+        """關鍵詞召回的 SQL（column 為返回的列）；描述中沒有可用的詞時返回 None"""
+        terms = sorted(set(tokenize(text)))
+        if not terms or limit <= 0:
+            return None
+
+        gender_sql = " AND users.gender = ?" if gender else ""
+        gender_params = [gender] if gender else []
+        if self.has_fts:
+            match = " OR ".join(f'"{term}"' for term in terms)
+            sql = (f"SELECT users.{column} FROM users_fts JOIN users ON users.id = users_fts.rowid "
+                   f"WHERE users_fts MATCH ?{gender_sql} ORDER BY bm25(users_fts), users.position LIMIT ?")
+            return sql, [match] + gender_params + [limit]
+        like = " OR ".join("lower(data) LIKE ?" for _ in terms)
+        sql = f"SELECT {column} FROM users WHERE ({like}){gender_sql} ORDER BY position LIMIT ?"
+        return sql, [f"%{term}%" for term in terms] + gender_params + [limit]
+
+    def _where(self, criteria: Dict[str, Any], strict: bool) -> Tuple[str, List[Any]]:
+        """把條件轉成 WHERE 子句；沒有有效條件時不匹配任何用戶（與 UserIndex 一致）"""
+        active = [(k, v) for k, v in criteria.items() if v is not None and v != ""]
+        if not active:
+            return "0", []
+
+        clauses, params = [], []
+        for key, value in active:
+            clause, values = self._condition(key, value)
+            clauses.append(f"({clause})")
+            params.extend(values)
+        return (" AND " if strict else " OR ").join(clauses), params
+
+    def _condition(self, key: str, value: Any) -> Tuple[str, List[Any]]:
+        """單個條件的 SQL 片段"""
+        if key in EQUALITY_COLUMNS:
+            return f"{key} = ?", [str(value)]
+        if key in RANGE_KEYS:
+            return ("age >= ?" if key == "age_min" else "age <= ?"), [value]
+        if key == "hobby":
+            # 子字符串匹配先在興趣詞彙表上完成，再用關聯表的索引取用戶
+            targets = [value] if isinstance(value, str) else value
+            terms = [target.lower() for target in targets]
+            hobbies = [h for h in self._vocab("hobby") if any(term in h.lower() for term in terms)]
+            clauses = [f"id IN (SELECT user_id FROM user_hobbies WHERE hobby IN ({_placeholders(len(hobbies))}))"] if hobbies else []
+            params: List[Any] = list(hobbies)
+            # 含空格的詞可能跨越兩個興趣（與 " ".join(hobbies) 上的子字符串匹配一致）
+            for term in terms:
+                if " " in term:
+                    clauses.append("instr(hobby_text, ?) > 0")
+                    params.append(term)
+            return (" OR ".join(clauses) or "0"), params
+        if key == "occupation":
+            # 雙向子字符串匹配，在職業詞彙表上完成後走索引
+            term = str(value).lower()
+            matched = [o for o in self._vocab("occupation") if term in o.lower() or o.lower() in term]
+            if not matched:
+                return "0", []
+            return f"occupation IN ({_placeholders(len(matched))})", matched
+        # 其他字段直接比對 JSON 記錄中的值
+        return "lower(COALESCE(CAST(json_extract(data, ?) AS TEXT), '')) = ?", [f'$."{key}"', str(value).lower()]
+
+    def _vocab(self, field: str) -> List[str]:
+        """興趣 / 職業的不同取值（按數據版本緩存）"""
+        version = self._vocab_version()
+        cached = self._vocabulary.get(field)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        sql = "SELECT DISTINCT hobby FROM user_hobbies" if field == "hobby" else "SELECT DISTINCT occupation FROM users"
+        with self._lock:
+            values = [row[0] for row in self._conn.execute(sql)]
+        self._vocabulary[field] = (version, values)
+        return values
+
+
+
+class SQLiteUserStore(_UserQueries):
+    """SQLite 用戶存儲（單連接 + 鎖，WAL 模式下多個進程可同時讀）"""
+
+    def __init__(self, path: str = "users.db"):
+        """
+        打開（或創建）用戶存儲
+
+        Args:
+            path: SQLite 文件路徑
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._vocabulary: Dict[str, Tuple[str, List[str]]] = {}
+
+        appearance_columns = "".join(f"{field} TEXT COLLATE NOCASE,\n                " for field in APPEARANCE_TERM_FIELDS)
+        self._conn.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                position INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                age INTEGER NOT NULL,
+                gender TEXT NOT NULL COLLATE NOCASE,
+                occupation TEXT NOT NULL COLLATE NOCASE,
+                location TEXT NOT NULL COLLATE NOCASE,
+                {appearance_columns}hobby_text TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_users_position ON users(position);
+            CREATE INDEX IF NOT EXISTS idx_users_location ON users(location);
+            CREATE INDEX IF NOT EXISTS idx_users_gender ON users(gender);
+            CREATE INDEX IF NOT EXISTS idx_users_occupation ON users(occupation);
+            CREATE INDEX IF NOT EXISTS idx_users_age ON users(age);
+            CREATE INDEX IF NOT EXISTS idx_users_hair_color ON users(hair_color);
+            CREATE INDEX IF NOT EXISTS idx_users_style ON users(style);
+            CREATE TABLE IF NOT EXISTS user_hobbies (
+                hobby TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (hobby, user_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_user_hobbies_user ON user_hobbies(user_id);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            INSERT OR IGNORE INTO meta VALUES ('version', '0');
+            """
+        )
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(terms)")
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # 編譯時未啟用 FTS5 的 SQLite：關鍵詞檢索退回逐行匹配
+            self.has_fts = False
+        self._conn.commit()
+
+    # ------------------------------------------------------------------
+    # 讀取
+    # ------------------------------------------------------------------
+
+    def version(self) -> str:
+        """數據版本（每次寫入加一，其他進程的寫入也能看到）"""
+        with self._lock:
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def _vocab_version(self) -> str:
+        return self.version()
+
+    def snapshot(self) -> "SQLiteSnapshot":
+        """固定在當前數據版本上的只讀視圖（之後的寫入不影響它）"""
+        return SQLiteSnapshot(self.path, has_fts=self.has_fts)
+
+    @property
+    def size(self) -> int:
+        """用戶數"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def get_user(self, user_id: int) -> Optional[Dict]:
+        """按 ID 讀取單個用戶"""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_users(self, user_ids: List[int]) -> List[Dict]:
+        """按 ID 讀取多個用戶（保持傳入順序，不存在的 ID 跳過）"""
+        found: Dict[int, Dict] = {}
+        with self._lock:
+            # 分批查詢，避免超出 SQLite 的參數個數上限
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                for user_id, data in self._conn.execute(
+                    f"SELECT id, data FROM users WHERE id IN ({_placeholders(len(chunk))})", chunk
+                ):
+                    found[user_id] = json.loads(data)
+        return [found[user_id] for user_id in user_ids if user_id in found]
+
+    def iter_users(self, batch_size: int = 1000) -> Iterator[Dict]:
+        """按數據庫順序逐批讀取所有用戶（內存中只保留一批）"""
+        after = -1
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT position, data FROM users WHERE position > ? ORDER BY position LIMIT ?",
+                    (after, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for _, data in rows:
+                yield json.loads(data)
+            after = rows[-1][0]
+
+    def all_users(self) -> List[Dict]:
+        """按數據庫順序讀取所有用戶"""
+        return list(self.iter_users())
+
+    def versioned_users(self) -> Tuple[str, List[Dict]]:
+        """
+        在同一個讀事務中讀取數據版本與所有用戶（WAL 模式下讀事務看到的是一致的快照）
+
+        Returns:
+            (數據版本, 按數據庫順序排列的用戶列表)；用戶數據恰好是該版本的內容
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                version = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+                rows = self._conn.execute("SELECT data FROM users ORDER BY position").fetchall()
+            finally:
+                self._conn.rollback()
+        return version, [json.loads(data) for data, in rows]
+
+    # ------------------------------------------------------------------
+    # 過濾與分頁
+    # ------------------------------------------------------------------
+
+    def filter_ids(
+        self,
+        criteria: Dict[str, Any],
+        strict: bool = True,
+        limit: Optional[int] = None,
+        after: Optional[int] = None,
+        version: Optional[str] = None
+    ) -> Optional[List[int]]:
+        """
+        按條件過濾用戶（匹配規則與 UserIndex.filter 一致）
+
+        Args:
+            criteria: 過濾條件
+            strict: 是否嚴格匹配（True=所有條件都滿足，False=滿足任意一個）
+            limit: 最多返回的用戶數（None=不限制）
+            after: 只返回數據庫位置在此之後的用戶（分頁游標）
+            version: 只在數據版本等於此值時查詢（與版本檢查在同一個讀事務中）
+
+        Returns:
+            按數據庫順序排列的用戶 ID 列表；指定的版本已被寫入覆蓋時返回 None
+        """
+        rows = self._select("id, position", criteria, strict, limit, after, version=version)
+        return None if rows is None else [user_id for user_id, _ in rows]
+
+    def count(self, criteria: Dict[str, Any], strict: bool = True) -> int:
+        """滿足條件的用戶數"""
+        where, params = self._where(criteria, strict)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM users WHERE {where}", params).fetchone()[0]
+
+    def page(
+        self,
+        criteria: Optional[Dict[str, Any]] = None,
+        strict: bool = True,
+        limit: int = 20,
+        cursor: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        分頁讀取用戶（按位置做鍵集分頁，翻到後面的頁也不需要跳過前面的行）
+
+        Args:
+            criteria: 過濾條件（None 或空=所有用戶）
+            strict: 是否嚴格匹配
+            limit: 每頁用戶數
+            cursor: 上一頁返回的 next_cursor（None=第一頁）
+
+        Returns:
+            {"users": 本頁用戶, "next_cursor": 下一頁的游標，沒有下一頁時為 None}
+        """
+        rows = self._select("data, position", criteria or {}, strict, limit + 1, cursor, match_all=not criteria)
+        users = [json.loads(data) for data, _ in rows[:limit]]
+        next_cursor = rows[limit - 1][1] if len(rows) > limit else None
+        return {"users": users, "next_cursor": next_cursor}
+
+    def search_text(
+        self,
+        text: str,
+        limit: int,
+        gender: Optional[str] = None,
+        version: Optional[str] = None
+    ) -> Optional[List[int]]:
+        """
+        關鍵詞召回：描述中的詞與用戶資料詞的全文匹配，按 BM25 排序
+
+        Args:
+            text: 自由描述
+            limit: 最多返回的用戶數
+            gender: 只在該性別中召回（可選）
+            version: 只在數據版本等於此值時查詢（與版本檢查在同一個讀事務中）
+
+        Returns:
+            用戶 ID 列表（相關度高的在前）；指定的版本已被寫入覆蓋時返回 None
+        """
+        query = self._search_query(text, limit, gender, "id")
+        if query is None:
+            return []
+        rows = self._query_at(*query, version)
+        return None if rows is None else [row[0] for row in rows]
+
+    def _select(
+        self,
+        columns: str,
+        criteria: Dict[str, Any],
+        strict: bool,
+        limit: Optional[int],
+        after: Optional[int],
+        match_all: bool = False,
+        version: Optional[str] = None
+    ) -> Optional[List[tuple]]:
+        """執行過濾查詢，按位置排序（指定 version 且版本不符時返回 None）"""
+        where, params = ("1", []) if match_all else self._where(criteria, strict)
+        if after is not None:
+            where = f"({where}) AND position > ?"
+            params.append(after)
+        sql = f"SELECT {columns} FROM users WHERE {where} ORDER BY position"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._query_at(sql, params, version)
+
+    def _query_at(self, sql: str, params: List[Any], version: Optional[str]) -> Optional[List[tuple]]:
+        """
+        執行查詢；指定 version 時在讀事務中先核對數據版本，保證結果屬於該版本
+
+        Returns:
+            查詢結果；版本不符（已有新的寫入）時返回 None
+        """
+        with self._lock:
+            if version is None:
+                return self._conn.execute(sql, params).fetchall()
+            self._conn.execute("BEGIN")
+            try:
+                current = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+                if current != version:
+                    return None
+                return self._conn.execute(sql, params).fetchall()
+            finally:
+                self._conn.rollback()
+
+    # ------------------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------------------
+
+    def replace_all(self, users: Iterable[Dict]) -> int:
+        """
+        用新的用戶列表替換全部數據（單個事務，讀者看到的要麼是舊數據要麼是新數據）
+
+        Args:
+            users: 用戶列表（順序即數據庫順序）
+
+        Returns:
+            寫入的用戶數
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM user_hobbies")
+                self._conn.execute("DELETE FROM users")
+                if self.has_fts:
+                    self._conn.execute("DELETE FROM users_fts")
+                count = 0
+                for position, user in enumerate(users):
+                    self._write(user, position)
+                    count += 1
+                self._bump_version()
+        return count
+
+    def add_user(self, user: Dict):
+        """在數據庫末尾添加用戶（ID 已存在時拋出 ValueError）"""
+        with self._lock:
+            with self._conn:
+                if self._conn.execute("SELECT 1 FROM users WHERE id = ?", (user["id"],)).fetchone():
+                    raise ValueError(f"用戶 ID 已存在: {user['id']}")
+                position = self._conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM users").fetchone()[0]
+                self._write(user, position)
+                self._bump_version()
+
+    def update_user(self, user_id: int, changes: Dict[str, Any]) -> Dict:
+        """
+        原地更新單個用戶（appearance 按字段合併，其他字段直接替換）
+
+        Args:
+            user_id: 用戶 ID
+            changes: 要修改的字段
+
+        Returns:
+            更新後的用戶
+
+        Raises:
+            KeyError: 用戶不存在
+        """
+        with self._lock:
+            with self._conn:
+                row = self._conn.execute("SELECT position, data FROM users WHERE id = ?", (user_id,)).fetchone()
+                if row is None:
+                    raise KeyError(f"找不到用戶: {user_id}")
+                position, data = row
+                user = json.loads(data)
+                for key, value in changes.items():
+                    if key == "appearance" and isinstance(value, dict) and isinstance(user.get("appearance"), dict):
+                        user["appearance"] = {**user["appearance"], **value}
+                    else:
+                        user[key] = value
+                user["id"] = user_id
+                self._delete(user_id)
+                self._write(user, position)
+                self._bump_version()
+        return user
+
+    def delete_user(self, user_id: int) -> bool:
+        """刪除用戶，返回是否存在"""
+        with self._lock:
+            with self._conn:
+                if not self._conn.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone():
+                    return False
+                self._delete(user_id)
+                self._bump_version()
+        return True
+
+    def _write(self, user: Dict, position: int):
+        """寫入一個用戶的所有行（調用方持有鎖並處於事務中）"""
+        looks = user.get("appearance") or {}
+        self._conn.execute(
+            f"INSERT INTO users (id, position, name, age, gender, occupation, location, "
+            f"{', '.join(APPEARANCE_TERM_FIELDS)}, hobby_text, data) "
+            f"VALUES ({_placeholders(9 + len(APPEARANCE_TERM_FIELDS))})",
+            [
+                user["id"], position, user["name"], user["age"], user["gender"],
+                user["occupation"], user["location"],
+                *[looks.get(field) for field in APPEARANCE_TERM_FIELDS],
+                " ".join(user["hobby"]).lower(),
+                json.dumps(user, ensure_ascii=False),
+            ]
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO user_hobbies (hobby, user_id) VALUES (?, ?)",
+            [(hobby, user["id"]) for hobby in user["hobby"]]
+        )
+        if self.has_fts:
+            self._conn.execute(
+                "INSERT INTO users_fts (rowid, terms) VALUES (?, ?)",
+                (user["id"], " ".join(sorted(profile_terms(user))))
+            )
+
+    def _delete(self, user_id: int):
+        """刪除一個用戶的所有行（調用方持有鎖並處於事務中）"""
+        self._conn.execute("DELETE FROM user_hobbies WHERE user_id = ?", (user_id,))
+        self._conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        if self.has_fts:
+            self._conn.execute("DELETE FROM users_fts WHERE rowid = ?", (user_id,))
+
+    def _bump_version(self):
+        self._conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+
+    # ------------------------------------------------------------------
+    # 導入 / 導出
+    # ------------------------------------------------------------------
+
+    def import_json(self, json_path: str) -> int:
+        """從 users_database.json 格式的文件導入（替換現有數據）"""
+        with open(json_path, "r", encoding="utf-8") as f:
+            users = json.load(f)
+        return self.replace_all(users)
+
+    def export_json(self, json_path: str) -> int:
+        """導出為 users_database.json 格式（先寫臨時文件再替換）"""
+        users = self.all_users()
+        tmp_path = f"{json_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(users, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, json_path)
+        return len(users)
+
+    def close(self):
+        """關閉連接"""
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回存儲統計"""
+        return {
+            "path": self.path,
+            "users": self.size,
+            "version": self.version(),
+            "fts": self.has_fts,
+        }
+
+
+class SQLiteSnapshot(_UserQueries):
+    """
+    固定在一個數據版本上的只讀視圖
+    使用自己的連接並一直保持讀事務：WAL 模式下之後的寫入不改變它看到的數據，
+    所以目錄快照不必把用戶讀進內存，過濾、檢索、位圖與分面計數都直接查詢磁盤，只物化用到的行。
+    位置即 users.position 列（刪除用戶後可能不連續）；視圖被回收或 close 時讀事務結束
+    """
+
+    def __init__(self, path: str, has_fts: bool = True):
+        """
+        打開視圖並開始讀事務
+
+        Args:
+            path: SQLite 文件路徑
+            has_fts: 存儲是否有 FTS5 全文索引
+        """
+        self.path = path
+        self.has_fts = has_fts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._vocabulary: Dict[str, Tuple[str, List[str]]] = {}
+        # 單條件位圖按 (字段, 取值) 緩存；數據不會再變，按 LRU 限制條目數即可
+        self._masks = TermCache()
+        self._all: Optional[int] = None
+        self._size: Optional[int] = None
+        self._bit_length: Optional[int] = None
+
+        # 事務中的第一條讀取決定視圖看到的數據版本
+        self._conn.execute("BEGIN")
+        self.version = self._rows("SELECT value FROM meta WHERE key = 'version'")[0][0]
+
+    def _vocab_version(self) -> str:
+        return self.version
+
+    def _rows(self, sql: str, params: Iterable[Any] = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, list(params)).fetchall()
+
+    # ------------------------------------------------------------------
+    # 大小與位圖（與 BitsetIndex 接口一致，布爾查詢可直接在此求值）
+    # ------------------------------------------------------------------
+
+    @property
+    def size(self) -> int:
+        """用戶數"""
+        if self._size is None:
+            self._size = self._rows("SELECT COUNT(*) FROM users")[0][0]
+        return self._size
+
+    @property
+    def bit_length(self) -> int:
+        """位圖的位數（最大位置 + 1）"""
+        if self._bit_length is None:
+            self._bit_length = self._rows("SELECT COALESCE(MAX(position), -1) + 1 FROM users")[0][0]
+        return self._bit_length
+
+    @property
+    def all(self) -> int:
+        """所有用戶的位圖"""
+        if self._all is None:
+            self._all = to_mask((row[0] for row in self._rows("SELECT position FROM users")), self.bit_length)
+        return self._all
+
+    def lookup(self, key: str, value: Any) -> int:
+        """
+        滿足單個條件的用戶位圖（匹配規則與 BitsetIndex.lookup 一致）
+
+        Args:
+            key: 條件名稱
+            value: 條件值
+
+        Returns:
+            位圖
+        """
+        memo_key = json.dumps([key, value], sort_keys=True, ensure_ascii=False, default=str).lower()
+        mask = self._masks.get(memo_key)
+        if mask is None:
+            clause, params = self._condition(key, value)
+            rows = self._rows(f"SELECT position FROM users WHERE {clause}", params)
+            mask = to_mask((row[0] for row in rows), self.bit_length)
+            self._masks.put(memo_key, mask)
+        return mask
+
+    def positions(self, mask: int) -> List[int]:
+        """位圖轉按數據庫順序排列的位置列表"""
+        return mask_positions(mask, self.bit_length)
+
+    # ------------------------------------------------------------------
+    # 過濾、檢索與物化
+    # ------------------------------------------------------------------
+
+    def filter(self, criteria: Dict[str, Any], strict: bool = True) -> List[int]:
+        """按條件過濾，返回按數據庫順序排列的位置（與 UserIndex.filter 的結果相同）"""
+        where, params = self._where(criteria, strict)
+        return [row[0] for row in self._rows(f"SELECT position FROM users WHERE {where} ORDER BY position", params)]
+
+    def search_text(self, text: str, limit: int, gender: Optional[str] = None) -> List[int]:
+        """關鍵詞召回，返回位置列表（相關度高的在前）"""
+        query = self._search_query(text, limit, gender, "position")
+        return [] if query is None else [row[0] for row in self._rows(*query)]
+
+    def first_positions(self, limit: int) -> List[int]:
+        """按數據庫順序的前 limit 個位置"""
+        return [row[0] for row in self._rows("SELECT position FROM users ORDER BY position LIMIT ?", [limit])]
+
+    def sample(self, exclude: Iterable[int], needed: int) -> List[int]:
+        """隨機抽取不在 exclude 中的位置"""
+        exclude = list(exclude)
+        if needed <= 0:
+            return []
+        if len(exclude) > 500:
+            # 排除的位置很多時在 Python 中過濾，避免超出參數個數上限
+            taken = set(exclude)
+            rows = self._rows("SELECT position FROM users ORDER BY random() LIMIT ?", [needed + len(taken)])
+            return [pos for pos, in rows if pos not in taken][:needed]
+        rows = self._rows(
+            f"SELECT position FROM users WHERE position NOT IN ({_placeholders(len(exclude))}) ORDER BY random() LIMIT ?",
+            exclude + [needed]
+        )
+        return [row[0] for row in rows]
+
+    def users_at(self, positions: List[int]) -> List[Dict]:
+        """按位置讀取用戶（保持傳入順序）"""
+        found: Dict[int, Dict] = {}
+        # 分批查詢，避免超出 SQLite 的參數個數上限
+        for start in range(0, len(positions), 500):
+            chunk = positions[start:start + 500]
+            for position, data in self._rows(
+                f"SELECT position, data FROM users WHERE position IN ({_placeholders(len(chunk))})", chunk
+            ):
+                found[position] = json.loads(data)
+        return [found[pos] for pos in positions if pos in found]
+
+    def positioned_users(self) -> Tuple[List[int], List[Dict]]:
+        """按數據庫順序讀取所有用戶及其位置（只有需要整表時才調用，例如同步語義索引）"""
+        rows = self._rows("SELECT position, data FROM users ORDER BY position")
+        return [pos for pos, _ in rows], [json.loads(data) for _, data in rows]
+
+    # ------------------------------------------------------------------
+    # 詞彙與計數
+    # ------------------------------------------------------------------
+
+    def value_counts(self) -> Tuple[Counter, Counter, Counter]:
+        """(興趣出現次數, (外觀字段, 值) 出現次數, 性別出現次數)，供 CandidateEncoder 分配代碼"""
+        hobbies = Counter(dict(self._rows("SELECT hobby, COUNT(*) FROM user_hobbies GROUP BY hobby")))
+        looks: Counter = Counter()
+        for field in APPEARANCE_TERM_FIELDS:
+            for value, count in self._rows(
+                f"SELECT {field}, COUNT(*) FROM users WHERE {field} <> '' GROUP BY {field} COLLATE BINARY"
+            ):
+                looks[(field, value)] = count
+        genders = Counter(dict(self._rows("SELECT gender, COUNT(*) FROM users GROUP BY gender COLLATE BINARY")))
+        return hobbies, looks, genders
+
+    def vocabulary(self) -> Dict[str, Any]:
+        """各字段的不同取值與年齡範圍（DescriptionParser 的 vocabulary 格式）"""
+        vocabulary: Dict[str, Any] = {
+            "hobby": {row[0] for row in self._rows("SELECT DISTINCT hobby FROM user_hobbies")},
+        }
+        for field in ("location", "occupation", "gender") + APPEARANCE_TERM_FIELDS:
+            vocabulary[field] = {
+                row[0] for row in self._rows(f"SELECT DISTINCT {field} COLLATE BINARY FROM users WHERE {field} <> ''")
+            }
+        low, high = self._rows("SELECT MIN(age), MAX(age) FROM users")[0]
+        vocabulary["age"] = (18 if low is None else low, 99 if high is None else high)
+        return vocabulary
+
+    def facet_counts(self, field: str, criteria: Dict[str, Any]) -> List[Tuple[str, int]]:
+        """
+        單個分面在條件下的 (取值, 用戶數)（按小寫取值分組；條件之間為交集）
+
+        Args:
+            field: 分面字段
+            criteria: 已生效的條件（不含該分面自身）
+
+        Returns:
+            [(取值, 用戶數), ...]，不含 0
+        """
+        clauses, params = [], []
+        for key, value in criteria.items():
+            clause, values = self._condition(key, value)
+            clauses.append(f"({clause})")
+            params.extend(values)
+        where = " AND ".join(clauses) or "1"
+        if field == "hobby":
+            sql = ("SELECT MIN(user_hobbies.hobby), COUNT(DISTINCT user_hobbies.user_id) FROM user_hobbies "
+                   f"JOIN users ON users.id = user_hobbies.user_id WHERE {where} GROUP BY lower(user_hobbies.hobby)")
+        else:
+            present = f" AND {field} <> ''" if field in APPEARANCE_TERM_FIELDS else ""
+            sql = f"SELECT MIN({field}), COUNT(*) FROM users WHERE ({where}){present} GROUP BY lower({field})"
+        return [(value, count) for value, count in self._rows(sql, params)]
+
+    def close(self):
+        """結束讀事務並關閉連接"""
+        with self._lock:
+            self._conn.close()
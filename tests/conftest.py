@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 項目模塊都在倉庫根目錄
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
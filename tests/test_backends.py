@@ -0,0 +1,172 @@
+"""各過濾後端（index / columnar / sqlite / bitset）在相同條件下的結果一致性"""
+
+import json
+import os
+
+import pytest
+
+from catalog import Catalog, CatalogSnapshot
+from local_ranker import LocalRanker
+from sqlite_store import SQLiteUserStore
+
+DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "users_database.json")
+BACKENDS = ("index", "columnar", "sqlite", "bitset")
+
+CRITERIA = [
+    {"location": "Chicago"},
+    {"location": "chicago", "gender": "female"},
+    {"gender": "Male", "age_min": 25, "age_max": 35},
+    {"hobby": "Photography"},
+    {"hobby": ["gaming", "Reading"]},
+    {"hobby": "ing"},
+    {"hobby": "music singing"},
+    {"occupation": "manager"},
+    {"occupation": "Senior Architect"},
+    {"hair_color": "brown", "eye_color": "blue"},
+    {"style": "anime", "gender": "Female"},
+    {"location": "Miami", "hobby": "Music", "age_max": 45},
+    {"location": "Nowhere"},
+    {"hobby": "Underwater Basket Weaving"},
+]
+
+RANK_CRITERIA = CRITERIA + [
+    {"description": "a woman with long blonde hair and green eyes"},
+    {"gender": "male", "occupation": "photographer", "age_min": 30, "hair_length": "short"},
+]
+
+
+@pytest.fixture(scope="module")
+def catalogs(tmp_path_factory):
+    db_path = str(tmp_path_factory.mktemp("sqlite") / "users.db")
+    store = SQLiteUserStore(db_path)
+    store.import_json(DATABASE)
+    store.close()
+    result = {}
+    for backend in BACKENDS:
+        result[backend] = Catalog(db_path if backend == "sqlite" else DATABASE, backend=backend)
+    return result
+
+
+def ids(snapshot, positions):
+    return [user["id"] for user in snapshot.users_at(positions)]
+
+
+@pytest.mark.parametrize("strict", [True, False])
+@pytest.mark.parametrize("criteria", CRITERIA, ids=lambda c: json.dumps(c))
+def test_filter_parity(catalogs, criteria, strict):
+    expected_snapshot = catalogs["index"].snapshot()
+    expected = ids(expected_snapshot, expected_snapshot.filter(criteria, strict=strict))
+    for backend in BACKENDS[1:]:
+        snapshot = catalogs[backend].snapshot()
+        assert ids(snapshot, snapshot.filter(criteria, strict=strict)) == expected, backend
+
+
+@pytest.mark.parametrize("criteria", RANK_CRITERIA, ids=lambda c: json.dumps(c))
+def test_columnar_ranking_matches_local_ranker(catalogs, criteria):
+    ranker = LocalRanker()
+    snapshot = catalogs["columnar"].snapshot()
+    positions = list(range(snapshot.size))[::-1]
+
+    expected = [u["id"] for u in ranker.rank(snapshot.users_at(positions), criteria, snapshot.size)]
+    ranked = [u["id"] for u in snapshot.rank_local(positions, criteria, snapshot.size, ranker)]
+
+    assert ranked == expected
+    assert [u["id"] for u in snapshot.rank_local(positions, criteria, 5, ranker)] == expected[:5]
+
+
+@pytest.mark.parametrize("backend", ["index", "columnar", "bitset"])
+def test_null_appearance_is_accepted(backend):
+    with open(DATABASE, "r", encoding="utf-8") as f:
+        users = json.load(f)[:10]
+    users[0] = dict(users[0], appearance=None)
+    snapshot = CatalogSnapshot(users, "v1", backend=backend)
+
+    criteria = {"hair_color": users[1]["appearance"]["hair_color"]}
+    assert users[0]["id"] not in ids(snapshot, snapshot.filter(criteria))
+    ranked = snapshot.rank_local(list(range(len(users))), criteria, len(users), LocalRanker())
+    assert len(ranked) == len(users)
+
+
+def test_term_caches_are_bounded():
+    snapshot = Catalog(DATABASE, backend="index").snapshot()
+    index = snapshot.index
+    for i in range(1000):
+        index.lookup("hobby", f"made-up-{i}")
+        index.lookup("occupation", f"made-up-{i}")
+        index.lookup(f"field_{i}", "x")
+
+    assert len(index._hobby_term_cache) <= index._hobby_term_cache.max_entries
+    assert len(index._occupation_term_cache) <= index._occupation_term_cache.max_entries
+    assert len(index._generic) <= index._generic.max_entries
+    # 淘汰後重新計算的結果不變
+    assert index.lookup("hobby", "photo") == index.lookup("hobby", "Photography")
+
+
+def test_bitset_term_cache_is_bounded():
+    bitsets = Catalog(DATABASE, backend="bitset").snapshot().bitsets
+    expected = bitsets.hobby_term("photo")
+    for i in range(1000):
+        bitsets.hobby_term(f"made-up-{i}")
+        bitsets.occupation_term(f"made-up-{i}")
+        bitsets.lookup(f"field_{i}", "x")
+
+    assert len(bitsets._term_cache) <= bitsets._term_cache.max_entries
+    assert len(bitsets._generic) <= bitsets._generic.max_entries
+    assert bitsets.hobby_term("photo") == expected
+
+
+QUERY = {"or": [{"gender": "female"}, {"not": {"location": "Chicago"}}]}
+
+FACET_CRITERIA = [{}, {"gender": "Female"}, {"location": "Chicago", "age_min": 25}, {"hobby": ["read", "hik"]}]
+
+
+def test_sqlite_snapshot_keeps_users_on_disk(catalogs):
+    snapshot = catalogs["sqlite"].snapshot()
+    assert snapshot.index is None and snapshot.store is None and snapshot._users is None
+
+    expected = catalogs["bitset"].snapshot()
+    assert snapshot.size == expected.size
+    assert ids(snapshot, snapshot.filter({"query": QUERY})) == ids(expected, expected.filter({"query": QUERY}))
+    for criteria in FACET_CRITERIA:
+        assert snapshot.facets.counts(criteria) == expected.facets.counts(criteria)
+    assert snapshot.options == expected.options
+    description = "blonde woman who likes hiking in Chicago under 30"
+    assert snapshot.parser.parse(description) == expected.parser.parse(description)
+
+
+@pytest.mark.parametrize("criteria", RANK_CRITERIA, ids=lambda c: json.dumps(c))
+def test_sqlite_ranking_matches_local_ranker(catalogs, criteria, monkeypatch):
+    import catalog
+    # 小批次也要與一次性排序相同
+    monkeypatch.setattr(catalog, "SQL_RANK_BATCH", 7)
+    ranker = LocalRanker()
+    snapshot = catalogs["sqlite"].snapshot()
+    positions = snapshot.filter({"age_min": 0})[::-1]
+
+    expected = [u["id"] for u in ranker.rank(snapshot.users_at(positions), criteria, 10)]
+    assert [u["id"] for u in snapshot.rank_local(positions, criteria, 10, ranker)] == expected
+
+
+def test_sqlite_snapshot_is_pinned_to_its_version(tmp_path):
+    db_path = str(tmp_path / "users.db")
+    store = SQLiteUserStore(db_path)
+    store.import_json(DATABASE)
+    catalog = Catalog(db_path, backend="sqlite")
+    snapshot = catalog.snapshot()
+    user = snapshot.users_at([0])[0]
+    before = snapshot.filter({"location": user["location"]})
+
+    catalog.sql_store.update_user(user["id"], {"location": "Atlantis"})
+    catalog.sql_store.delete_user(snapshot.users_at([1])[0]["id"])
+
+    # 寫入之後舊快照仍看到自己版本的數據
+    assert snapshot.filter({"location": user["location"]}) == before
+    assert snapshot.users_at([0])[0]["location"] == user["location"]
+    assert snapshot.filter({"location": "Atlantis"}) == []
+
+    assert catalog.reload()
+    fresh = catalog.snapshot()
+    assert fresh.filter({"location": "Atlantis"}) == [0]
+    assert fresh.size == snapshot.size - 1
+    assert 1 not in fresh.filter({"age_min": 0})
+    assert len(fresh.sample_remaining([0], fresh.size)) == fresh.size - 1
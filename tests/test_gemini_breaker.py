@@ -0,0 +1,81 @@
+"""熔斷器在調用方截止時間下的統計：只有被截止時間提前截斷的調用不計入"""
+
+import time
+
+import pytest
+
+from gemini_client import GeminiClient
+from gemini_resilience import CircuitBreaker, Deadline, QuotaLimiter, RetryPolicy
+
+
+def make_client(monkeypatch, breaker, hang=None):
+    """
+    構造一個不發網絡請求的客戶端
+
+    Args:
+        breaker: 熔斷器
+        hang: 模擬 Gemini 掛起：每次調用耗盡讀取超時後返回超時錯誤；None 時立即返回連接錯誤
+    """
+    monkeypatch.delenv("GEMINI_CACHE_PATH", raising=False)
+    client = GeminiClient(
+        api_key="test", breaker=breaker, retry=RetryPolicy(max_retries=0), quota=QuotaLimiter()
+    )
+
+    def fake_send(url, payload, timeout=None):
+        if hang is not None:
+            time.sleep(min(hang, timeout[1]))
+            return {"error": "Read timed out", "status_code": None, "response": None}
+        return {"error": "Connection refused", "status_code": None, "response": None}
+
+    client._send_request = fake_send
+    return client
+
+
+def call(client, deadline):
+    return client.generate_text("hello", use_cache=False, deadline=deadline, coalesce=False)
+
+
+def test_short_caller_deadline_does_not_open_breaker(monkeypatch):
+    breaker = CircuitBreaker(min_calls=3, slow_call_seconds=1)
+    client = make_client(monkeypatch, breaker, hang=5)
+
+    for _ in range(6):
+        assert "error" in call(client, Deadline(0.02))
+
+    stats = breaker.stats()
+    assert stats["state"] == CircuitBreaker.CLOSED
+    assert stats["window_calls"] == 0
+
+
+def test_hung_gemini_opens_breaker_under_deadline(monkeypatch):
+    # 截止時間（0.1 秒）短於默認讀取超時，但每次都耗盡了超過慢調用閾值的時間
+    breaker = CircuitBreaker(min_calls=3, slow_call_seconds=0.03)
+    client = make_client(monkeypatch, breaker, hang=5)
+
+    for _ in range(3):
+        call(client, Deadline(0.1))
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert call(client, Deadline(0.1)).get("circuit_open")
+
+
+@pytest.mark.parametrize("deadline", [None, 20])
+def test_fast_connection_errors_open_breaker(monkeypatch, deadline):
+    breaker = CircuitBreaker(min_calls=3)
+    client = make_client(monkeypatch, breaker)
+
+    for _ in range(3):
+        call(client, Deadline(deadline) if deadline else None)
+
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_probe_released_when_deadline_cuts_call(monkeypatch):
+    breaker = CircuitBreaker(min_calls=1, open_seconds=0, slow_call_seconds=1)
+    breaker.record(False, 0.01)
+    client = make_client(monkeypatch, breaker, hang=5)
+
+    call(client, Deadline(0.02))
+
+    # 探測名額已釋放，下一個調用仍能作為探測發出
+    assert breaker.allow()
@@ -0,0 +1,51 @@
+"""問題預取的限額：未服務過的會話不預取，按會話與客戶端地址限制預取次數"""
+
+from question_prefetch import QuestionPrefetcher
+
+
+def make_prefetcher(**kwargs):
+    calls = []
+
+    def generate(answers, number):
+        calls.append((tuple(answers), number))
+        return {"question": f"Q{number}", "options": ["a", "b", "c"]}
+
+    return QuestionPrefetcher(generate, **kwargs), calls
+
+
+def test_unknown_session_is_not_prefetched():
+    prefetcher, calls = make_prefetcher()
+
+    assert prefetcher.prefetch("made-up", [], 1, ["x", "y", "z"]) == 0
+    assert calls == []
+    assert prefetcher.stats()["refused"] == 3
+
+
+def test_served_session_prefetches_and_takes():
+    prefetcher, _ = make_prefetcher()
+    prefetcher.mark_served("s1")
+
+    assert prefetcher.prefetch("s1", ["NY"], 2, ["a", "b", "c"]) == 3
+    assert prefetcher.take("s1", ["NY", "b"], 3, timeout=5) == {"question": "Q3", "options": ["a", "b", "c"]}
+
+
+def test_per_session_cap():
+    prefetcher, _ = make_prefetcher(max_per_session=4)
+    prefetcher.mark_served("s1")
+
+    assert prefetcher.prefetch("s1", [], 1, ["a", "b", "c"]) == 3
+    assert prefetcher.prefetch("s1", ["a"], 2, ["d", "e", "f"]) == 1
+    assert prefetcher.prefetch("s1", ["a", "d"], 3, ["g", "h", "i"]) == 0
+
+
+def test_per_client_cap_spans_sessions():
+    prefetcher, _ = make_prefetcher(max_per_client=5, client_window=60)
+    for i in range(3):
+        prefetcher.mark_served(f"s{i}")
+
+    scheduled = [prefetcher.prefetch(f"s{i}", [], 1, ["a", "b", "c"], client="10.0.0.1") for i in range(3)]
+
+    assert scheduled == [3, 2, 0]
+    # 其他地址不受影響
+    prefetcher.mark_served("other")
+    assert prefetcher.prefetch("other", [], 1, ["a", "b", "c"], client="10.0.0.2") == 3
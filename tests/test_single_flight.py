@@ -0,0 +1,173 @@
+"""請求合併：follower 在 leader 失敗、超時或得到降級結果時的行為"""
+
+import json
+import re
+import threading
+import time
+
+import pytest
+
+from gemini_client import GeminiClient
+from gemini_resilience import CircuitBreaker, Deadline, QuotaLimiter, RetryPolicy
+from single_flight import SingleFlight
+
+
+def run_concurrently(flights, key, fns, **kwargs):
+    """第一個函數作為 leader 先開始，其餘在它進行中加入；返回每個調用的 (結果, 是否共享) 或異常"""
+    results = [None] * len(fns)
+    started = threading.Event()
+
+    def worker(i):
+        try:
+            results[i] = flights.do(key, fns[i], **kwargs)
+        except Exception as e:
+            results[i] = e
+
+    def leader_fn(fn):
+        def wrapped():
+            started.set()
+            time.sleep(0.1)
+            return fn()
+        return wrapped
+
+    fns = [leader_fn(fns[0])] + list(fns[1:])
+    threads = [threading.Thread(target=worker, args=(0,))]
+    threads[0].start()
+    started.wait(5)
+    for i in range(1, len(fns)):
+        threads.append(threading.Thread(target=worker, args=(i,)))
+        threads[-1].start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_followers_share_leader_result():
+    flights = SingleFlight()
+    calls = []
+    fn = lambda: calls.append(1) or "ok"
+
+    results = run_concurrently(flights, "k", [fn] * 5)
+
+    assert len(calls) == 1
+    assert results[0] == ("ok", False)
+    assert all(r == ("ok", True) for r in results[1:])
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_followers_receive_leader_exception():
+    flights = SingleFlight()
+
+    def boom():
+        raise ValueError("leader failed")
+
+    results = run_concurrently(flights, "k", [boom] * 3)
+
+    assert all(isinstance(r, ValueError) for r in results)
+    # 失敗後鍵已移除，下一次調用重新執行
+    assert flights.do("k", lambda: "again") == ("again", False)
+
+
+def test_follower_timeout_computes_itself():
+    flights = SingleFlight()
+
+    results = run_concurrently(flights, "k", [lambda: "slow", lambda: "own"], timeout=0.01)
+
+    assert results == [("slow", False), ("own", False)]
+    assert flights.stats()["timeouts"] == 1
+
+
+def test_unshareable_leader_result_is_recomputed():
+    flights = SingleFlight()
+    fns = [lambda: {"ranking": "fallback"}] + [lambda: {"ranking": "ai"}] * 3
+
+    results = run_concurrently(flights, "k", fns, shareable=lambda r: r["ranking"] != "fallback")
+
+    assert results[0] == ({"ranking": "fallback"}, False)
+    assert all(r == ({"ranking": "ai"}, False) for r in results[1:])
+    assert flights.stats()["recomputed"] == 3
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.delenv("GEMINI_CACHE_PATH", raising=False)
+    return GeminiClient(
+        api_key="test",
+        breaker=CircuitBreaker(min_calls=100),
+        retry=RetryPolicy(max_retries=0),
+        quota=QuotaLimiter(),
+        flights=SingleFlight()
+    )
+
+
+def test_gemini_follower_retries_after_leader_deadline(client):
+    sent = []
+
+    def fake_send(url, payload, timeout=None):
+        sent.append(timeout[1])
+        # 模擬 Gemini 需要 0.1 秒：讀取超時更短的請求超時
+        time.sleep(min(0.1, timeout[1]))
+        if timeout[1] < 0.1:
+            return {"error": "Read timed out", "status_code": None, "response": None}
+        return {"candidates": [{"content": {"parts": [{"text": "hi"}]}}]}
+
+    client._send_request = fake_send
+    results = [None, None]
+
+    def call(i, seconds):
+        results[i] = client.generate_text("hello", temperature=0.2, use_cache=False, deadline=Deadline(seconds))
+
+    leader = threading.Thread(target=call, args=(0, 0.03))
+    leader.start()
+    time.sleep(0.01)
+    follower = threading.Thread(target=call, args=(1, 5))
+    follower.start()
+    leader.join()
+    follower.join()
+
+    assert "error" in results[0]
+    assert "error" not in results[1]
+    assert len(sent) == 2
+
+
+def test_recommend_followers_recompute_after_leader_fallback(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    monkeypatch.setenv("GEMINI_COALESCE", "0")
+    monkeypatch.delenv("GEMINI_CACHE_PATH", raising=False)
+    from recommendation_system import UserRecommendationSystem
+
+    system = UserRecommendationSystem()
+    system.client.breaker = CircuitBreaker(min_calls=100)
+    system.client.quota = QuotaLimiter()
+
+    def fake_send(url, payload, timeout=None):
+        # 模擬 Gemini 需要 0.2 秒，返回候選中的前幾個 ID
+        time.sleep(min(0.2, timeout[1]))
+        if timeout[1] < 0.2:
+            return {"error": "Read timed out", "status_code": None, "response": None}
+        prompt = payload["contents"][0]["parts"][0]["text"]
+        ids = [int(x) for x in re.findall(r"(?m)^\D{0,3}(\d+)", prompt)][:5]
+        return {"candidates": [{"content": {"parts": [{"text": json.dumps(ids)}]}}]}
+
+    system.client._send_request = fake_send
+    criteria = {"location": "Miami", "hobby": "Music"}
+    results = {}
+
+    def call(name, seconds):
+        results[name] = system.recommend_with_metadata(criteria, top_k=5, deadline=Deadline(seconds))
+
+    threads = [threading.Thread(target=call, args=("leader", 0.1))]
+    threads[0].start()
+    time.sleep(0.02)
+    threads += [threading.Thread(target=call, args=(f"follower{i}", 5)) for i in range(3)]
+    for t in threads[1:]:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results["leader"][1]["ranking"] == "fallback"
+    for i in range(3):
+        _, metadata = results[f"follower{i}"]
+        assert metadata["ranking"] == "ai"
+        assert metadata["cache"] != "coalesced"
+    assert system.flights.stats()["recomputed"] == 3
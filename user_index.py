@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+用戶倒排索引
+在載入數據庫時一次性建立 location / gender / occupation / hobby 的倒排表與年齡排序數組，
+讓 _filter_users 以集合交集/並集回答查詢，而不是每次請求都掃描所有用戶
+"""
+
+import heapq
+import re
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, Counter, OrderedDict
+from typing import List, Dict, Any, Set, FrozenSet, Iterable, Optional
+
+
+EMPTY: FrozenSet[int] = frozenset()
+
+# 以排序數組做範圍查詢的條件
+RANGE_KEYS = ("age_min", "age_max")
+
+
+# 外觀特征中參與關鍵詞檢索的字段
+APPEARANCE_TERM_FIELDS = ("style", "hair_length", "hair_color", "hairstyle", "eye_color")
+
+# 子字符串查詢結果緩存的條目上限（鍵來自用戶輸入，必須有上限）
+TERM_CACHE_SIZE = 128
+
+
+def tokenize(text: str) -> List[str]:
+    """把文本切成小寫的英文/數字詞"""
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def profile_terms(user: Dict) -> Set[str]:
+    """用戶資料中可被描述檢索命中的詞（地區、職業、興趣、外觀）"""
+    parts = [user["location"], user["occupation"]]
+    parts.extend(user["hobby"])
+    appearance = user.get("appearance")
+    if appearance:
+        parts.extend(appearance.get(field) or "" for field in APPEARANCE_TERM_FIELDS)
+        parts.extend(appearance.get("tags", []))
+    return set(tokenize(" ".join(parts)))
+
+
+class TermCache:
+    """
+    子字符串查詢結果的 LRU 緩存（線程安全）
+    鍵是客戶端傳來的搜索詞，不設上限時每個新詞都會在快照的整個生命週期內佔用內存
+    """
+
+    def __init__(self, max_entries: int = TERM_CACHE_SIZE):
+        """
+        初始化緩存
+
+        Args:
+            max_entries: 最多緩存的詞數（0=不緩存）
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[Any]:
+        """讀取緩存（命中時刷新 LRU 順序），未命中返回 None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Any, value: Any):
+        """寫入緩存，超出上限時淘汰最久未使用的詞"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class UserIndex:
+    """用戶倒排索引（posting list 存放的是用戶在列表中的位置）"""
+
+    def __init__(self, users: List[Dict]):
+        """
+        建立索引
+
+        Args:
+            users: 用戶列表（順序即過濾結果的返回順序）
+        """
+        self.users = users
+        self.size = len(users)
+
+        location = defaultdict(set)
+        gender = defaultdict(set)
+        occupation = defaultdict(set)
+        hobby = defaultdict(set)
+        hobby_text = defaultdict(set)
+        terms = defaultdict(set)
+        appearance = {field: defaultdict(set) for field in APPEARANCE_TERM_FIELDS}
+        ages = []
+
+        for pos, user in enumerate(users):
+            location[user["location"].lower()].add(pos)
+            gender[user["gender"].lower()].add(pos)
+            occupation[user["occupation"].lower()].add(pos)
+            for h in user["hobby"]:
+                hobby[h.lower()].add(pos)
+            # 與原本的過濾邏輯一致：興趣以空格拼接後做子字符串匹配
+            hobby_text[" ".join(user["hobby"]).lower()].add(pos)
+            ages.append(user["age"])
+            looks = user.get("appearance") or {}
+            for field in APPEARANCE_TERM_FIELDS:
+                if looks.get(field):
+                    appearance[field][looks[field].lower()].add(pos)
+            for term in profile_terms(user):
+                terms[term].add(pos)
+
+        self._location = {k: frozenset(v) for k, v in location.items()}
+        self._gender = {k: frozenset(v) for k, v in gender.items()}
+        self._occupation = {k: frozenset(v) for k, v in occupation.items()}
+        self._hobby = {k: frozenset(v) for k, v in hobby.items()}
+        self._hobby_text = {k: frozenset(v) for k, v in hobby_text.items()}
+        # 資料詞倒排表，供自由描述搜索做廉價的關鍵詞召回
+        self._terms = {k: frozenset(v) for k, v in terms.items()}
+        # 外觀條件（hair_color 等，描述解析器生成的結構化條件會用到）
+        self._appearance = {
+            field: {k: frozenset(v) for k, v in postings.items()}
+            for field, postings in appearance.items()
+        }
+
+        # 年齡：按年齡排序的位置數組 + 對應的年齡值，用 bisect 做範圍查詢
+        self._age_of = ages
+        self._age_positions = sorted(range(self.size), key=ages.__getitem__)
+        self._sorted_ages = [ages[p] for p in self._age_positions]
+
+        # 其他條件（通用字段）按需建立；字段名同樣來自請求，按 LRU 限制
+        self._generic = TermCache()
+
+        # 子字符串類查詢（hobby / occupation）的結果緩存，按 LRU 限制條目數
+        self._hobby_term_cache = TermCache()
+        self._occupation_term_cache = TermCache()
+
+    # ------------------------------------------------------------------
+    # 單條件查詢
+    # ------------------------------------------------------------------
+
+    def lookup(self, key: str, value: Any) -> FrozenSet[int]:
+        """
+        查詢滿足單個條件的用戶位置
+
+        Args:
+            key: 條件名稱
+            value: 條件值
+
+        Returns:
+            用戶位置集合
+        """
+        if key == "location":
+            return self._location.get(value.lower(), EMPTY)
+        if key == "gender":
+            return self._gender.get(value.lower(), EMPTY)
+        if key == "hobby":
+            # 支持單個興趣或興趣列表，命中任意一個即可
+            targets = [value] if isinstance(value, str) else value
+            if len(targets) == 1:
+                return self._lookup_hobby_term(targets[0].lower())
+            result: Set[int] = set()
+            for target in targets:
+                result |= self._lookup_hobby_term(target.lower())
+            return frozenset(result)
+        if key == "occupation":
+            return self._lookup_occupation(value.lower())
+        if key in RANGE_KEYS:
+            return frozenset(self._age_range(key, value))
+        if key in self._appearance:
+            return self._appearance[key].get(str(value).lower(), EMPTY)
+        return self._lookup_generic(key, value)
+
+    def _lookup_hobby_term(self, term: str) -> FrozenSet[int]:
+        """興趣子字符串匹配（與 `term in " ".join(hobbies).lower()` 等價）"""
+        cached = self._hobby_term_cache.get(term)
+        if cached is not None:
+            return cached
+
+        result: Set[int] = set()
+        if term and " " not in term:
+            # 不含空格的詞不可能跨越兩個興趣，只需掃描單個興趣的詞彙表
+            for hobby, positions in self._hobby.items():
+                if term in hobby:
+                    result |= positions
+        else:
+            for text, positions in self._hobby_text.items():
+                if term in text:
+                    result |= positions
+
+        cached = frozenset(result)
+        self._hobby_term_cache.put(term, cached)
+        return cached
+
+    def _lookup_occupation(self, term: str) -> FrozenSet[int]:
+        """職業雙向子字符串匹配"""
+        cached = self._occupation_term_cache.get(term)
+        if cached is not None:
+            return cached
+
+        result: Set[int] = set()
+        for occupation, positions in self._occupation.items():
+            if term in occupation or occupation in term:
+                result |= positions
+
+        cached = frozenset(result)
+        self._occupation_term_cache.put(term, cached)
+        return cached
+
+    def _age_range(self, key: str, value: Any) -> List[int]:
+        """用排序數組取出年齡範圍內的用戶位置"""
+        if key == "age_min":
+            return self._age_positions[bisect_left(self._sorted_ages, value):]
+        return self._age_positions[:bisect_right(self._sorted_ages, value)]
+
+    def _age_matches(self, pos: int, key: str, value: Any) -> bool:
+        if key == "age_min":
+            return self._age_of[pos] >= value
+        return self._age_of[pos] <= value
+
+    def _lookup_generic(self, key: str, value: Any) -> FrozenSet[int]:
+        """其他條件直接比對字符串（按字段懶加載倒排表）"""
+        postings = self._generic.get(key)
+        if postings is None:
+            grouped = defaultdict(set)
+            for pos, user in enumerate(self.users):
+                grouped[str(user.get(key, "")).lower()].add(pos)
+            postings = {k: frozenset(v) for k, v in grouped.items()}
+            self._generic.put(key, postings)
+        return postings.get(str(value).lower(), EMPTY)
+
+    # ------------------------------------------------------------------
+    # 組合查詢
+    # ------------------------------------------------------------------
+
+    def filter(self, criteria: Dict[str, Any], strict: bool = True) -> List[int]:
+        """
+        按條件過濾用戶
+
+        Args:
+            criteria: 過濾條件
+            strict: 是否嚴格匹配（True=交集，False=並集）
+
+        Returns:
+            按原始順序排列的用戶位置列表
+        """
+        active = [(k, v) for k, v in criteria.items() if v is not None and v != ""]
+        if not active:
+            return []
+
+        if not strict:
+            result: Set[int] = set()
+            for key, value in active:
+                if key in RANGE_KEYS:
+                    result.update(self._age_range(key, value))
+                else:
+                    result |= self.lookup(key, value)
+            return sorted(result)
+
+        ranges = [(k, v) for k, v in active if k in RANGE_KEYS]
+        postings = [self.lookup(k, v) for k, v in active if k not in RANGE_KEYS]
+
+        if postings:
+            # 從最短的 posting list 開始求交集
+            postings.sort(key=len)
+            result = postings[0]
+            for positions in postings[1:]:
+                if not result:
+                    break
+                result = result & positions
+            # 年齡條件直接在候選集上檢查，避免物化整個範圍
+            for key, value in ranges:
+                result = {p for p in result if self._age_matches(p, key, value)}
+            return sorted(result)
+
+        lo, hi = 0, self.size
+        for key, value in ranges:
+            if key == "age_min":
+                lo = max(lo, bisect_left(self._sorted_ages, value))
+            else:
+                hi = min(hi, bisect_right(self._sorted_ages, value))
+        return sorted(self._age_positions[lo:hi]) if lo < hi else []
+
+    def search_text(
+        self,
+        text: str,
+        limit: int,
+        within: Optional[FrozenSet[int]] = None
+    ) -> List[int]:
+        """
+        關鍵詞召回：按描述與用戶資料共同出現的詞數排序
+
+        Args:
+            text: 自由描述
+            limit: 最多返回的用戶數
+            within: 只在這些位置中召回（例如性別硬過濾後的集合）
+
+        Returns:
+            用戶位置列表（命中詞多的在前，不足 limit 時按數據庫順序補足）
+        """
+        hits: Counter = Counter()
+        for term in set(tokenize(text)):
+            positions = self._terms.get(term)
+            if positions:
+                hits.update(positions if within is None else positions & within)
+
+        best = heapq.nsmallest(limit, hits.items(), key=lambda item: (-item[1], item[0]))
+        result = [pos for pos, _ in best]
+
+        if len(result) < limit:
+            chosen = set(result)
+            pool = range(self.size) if within is None else sorted(within)
+            for pos in pool:
+                if len(result) >= limit:
+                    break
+                if pos not in chosen:
+                    result.append(pos)
+        return result
+
+    def users_at(self, positions: Iterable[int]) -> List[Dict]:
+        """根據位置取出用戶"""
+        return [self.users[p] for p in positions]